@@ -16,10 +16,51 @@ class Settings(BaseSettings):
     MQTT_USERNAME: str = "admin"
     MQTT_PASSWORD: str = "public"
     MQTT_USE_TLS: bool = False
+    MQTT_SHARED_GROUP: str = ""  # e.g. "solar_ingest" to load-balance ingest across workers/hosts; needs EMQX hash_topic
+
+    # Ingest Pipeline
+    MQTT_INGEST_WORKERS: int = 4
+    MQTT_INGEST_QUEUE_SIZE: int = 1000  # per worker
+    MQTT_CLIENT_QUEUE_SIZE: int = 10000  # aiomqtt inbound buffer, 0 = unbounded
+
+    # Telemetry Writer
+    TELEMETRY_FLUSH_INTERVAL: float = 5.0  # seconds
+    MACHINE_STATUS_FLUSH_INTERVAL: float = 1.0  # seconds between batched status upserts
+    TELEMETRY_INSERT_CHUNK_SIZE: int = 1000
+    TELEMETRY_LOAD_DATA_THRESHOLD: int = 0  # rows per flush to switch to LOAD DATA LOCAL INFILE, 0 = off
+    TELEMETRY_SPOOL_DIR: str = "storage/spool"
+    TELEMETRY_SPOOL_SEGMENT_BYTES: int = 4 * 1024 * 1024
+    TELEMETRY_BUFFER_MAX_ROWS: int = 50000  # rows held in RAM, the rest is read back from the spool
+    TELEMETRY_HISTORY_MAX_POINTS: int = 1000  # buckets per history response
+    TELEMETRY_RETENTION_DAYS: int = 90  # raw rows kept for companies without their own setting
+    TELEMETRY_PARTITION_DAYS_AHEAD: int = 7  # daily partitions created in advance
+    TELEMETRY_PARTITION_CHECK_INTERVAL: float = 3600.0  # seconds between partition maintenance runs
+    TELEMETRY_ARCHIVE_ENABLED: bool = True  # export closed days before MySQL drops them
+    TELEMETRY_ARCHIVE_DIR: str = "storage/archive"
+    TELEMETRY_ARCHIVE_COMPRESS: bool = False  # deflate day files (smaller, but not memory-mappable)
+    TELEMETRY_ARCHIVE_DAYS_PER_RUN: int = 7  # days exported per maintenance run
+    TELEMETRY_RECENT_ROWS: int = 3600  # rows kept in memory per machine for recent history reads
+    TELEMETRY_RECENT_MAX_BYTES: int = 256 * 1024 * 1024  # all in-memory rings together, 0 = off
+
+    # WebSocket Delivery
+    WS_SEND_QUEUE_SIZE: int = 256  # outbound frames queued per socket
+    WS_OVERFLOW_POLICY: str = "conflate"  # "conflate" (latest per machine) or "disconnect"
+    WS_MACHINE_MAX_HZ: float = 10.0  # max frames/s per machine to a machine detail socket, 0 = unthrottled
+    WS_COMPANY_MAX_HZ: float = 0.0  # max updates/s per machine to a company socket, 0 = one per batch window
+    WS_COMPANY_BATCH_WINDOW: float = 0.2  # seconds of company updates sent as one frame, 0 = a frame per update
+    WS_KEYFRAME_INTERVAL: float = 30.0  # seconds between full frames on delta-encoded sockets
+    WS_MAX_SUBSCRIPTIONS: int = 1000  # topics one multiplexed socket may subscribe to
+    WS_HEARTBEAT_INTERVAL: float = 5.0  # seconds of silence before a heartbeat frame is sent
 
     # Redis Configuration
     REDIS_HOST: str = "redis"
     REDIS_PORT: int = 6379
+    MACHINE_STATE_FLUSH_INTERVAL: float = 0.005  # seconds between pipelined state writes
+    REALTIME_FANOUT_FLUSH_INTERVAL: float = 0.002  # seconds between pipelined cross-worker publishes
+
+    # Machine Index (SerialNo resolution on ingest)
+    MACHINE_INDEX_MAX_ENTRIES: int = 100000
+    MACHINE_INDEX_NEGATIVE_TTL: int = 300  # seconds an unknown serial is ignored
 
     class Config:
         env_file = ".env"
@@ -14,6 +14,8 @@ engine = create_async_engine(
     pool_recycle=3600,
     pool_size=10,
     max_overflow=20,
+    # LOAD DATA LOCAL INFILE for large telemetry backlogs needs the client flag
+    connect_args={"local_infile": True} if settings.TELEMETRY_LOAD_DATA_THRESHOLD > 0 else {},
 )
 
 AsyncSessionLocal = sessionmaker(
@@ -0,0 +1,162 @@
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple, Dict, List, Iterable
+
+import redis.asyncio as redis
+from sqlalchemy import select
+
+from .database import AsyncSessionLocal
+from .models.machine import Machine
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Redis channel the machine routes publish SerialNo changes on
+MACHINE_INDEX_CHANNEL = "machine_index:changes"
+
+MachineRef = Tuple[int, Optional[int]]  # (TableID, CompanyID)
+
+
+class MachineIndex:
+    """In-process SerialNo -> (TableID, CompanyID) index for the ingest path.
+
+    The whole Machine table is loaded at startup and kept current by change events
+    that ``routes/machine.py`` publishes on create/update/delete. The map is LRU
+    bounded; serials that fall out of it are looked up again on demand. Unknown
+    serials are remembered for ``negative_ttl`` seconds so a misconfigured device
+    does not hit MySQL on every message.
+    """
+
+    def __init__(self, redis_client: redis.Redis, max_entries: int, negative_ttl: float):
+        self.redis_client = redis_client
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.entries: "OrderedDict[str, MachineRef]" = OrderedDict()
+        self.unknown: "OrderedDict[str, float]" = OrderedDict()  # serial -> expiry (monotonic)
+        self.by_company: Dict[Optional[int], Dict[str, int]] = {}  # company -> serial -> TableID
+
+    def _link(self, serial: str, ref: MachineRef):
+        self.by_company.setdefault(ref[1], {})[serial] = ref[0]
+
+    def _unlink(self, serial: str, ref: Optional[MachineRef]):
+        if ref is None:
+            return
+        machines = self.by_company.get(ref[1])
+        if machines is not None:
+            machines.pop(serial, None)
+            if not machines:
+                del self.by_company[ref[1]]
+
+    def put(self, serial: str, machine_id: int, company_id: Optional[int]):
+        self.unknown.pop(serial, None)
+        self._unlink(serial, self.entries.get(serial))
+        self.entries[serial] = (machine_id, company_id)
+        self._link(serial, self.entries[serial])
+        self.entries.move_to_end(serial)
+        if len(self.entries) > self.max_entries:
+            self._unlink(*self.entries.popitem(last=False))
+
+    def discard(self, serial: str):
+        self._unlink(serial, self.entries.pop(serial, None))
+        self.unknown.pop(serial, None)
+
+    def _remember_unknown(self, serial: str):
+        self.unknown[serial] = time.monotonic() + self.negative_ttl
+        self.unknown.move_to_end(serial)
+        if len(self.unknown) > self.max_entries:
+            self.unknown.popitem(last=False)
+
+    def machines_of_company(self, company_id: int) -> List[int]:
+        return list(self.by_company.get(company_id, {}).values())
+
+    async def load(self):
+        """Replaces the index with the current Machine table."""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Machine.SerialNo, Machine.TableID, Machine.CompanyID))
+            rows = result.all()
+        self.entries.clear()
+        self.unknown.clear()
+        self.by_company.clear()
+        for serial, machine_id, company_id in rows[-self.max_entries:]:
+            self.entries[serial] = (machine_id, company_id)
+            self._link(serial, self.entries[serial])
+        logger.info(f"Machine index loaded with {len(self.entries)} machines")
+
+    async def resolve(self, serial: str) -> Optional[MachineRef]:
+        """Returns (TableID, CompanyID) for a serial, or None if no such machine."""
+        ref = self.entries.get(serial)
+        if ref is not None:
+            self.entries.move_to_end(serial)
+            return ref
+
+        expiry = self.unknown.get(serial)
+        if expiry is not None:
+            if expiry > time.monotonic():
+                return None
+            del self.unknown[serial]
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Machine.TableID, Machine.CompanyID).filter(Machine.SerialNo == serial)
+            )
+            row = result.first()
+
+        if not row:
+            logger.warning(f"Machine with SerialNo {serial} not found, ignoring it for {self.negative_ttl}s")
+            self._remember_unknown(serial)
+            return None
+
+        self.put(serial, row[0], row[1])
+        return row[0], row[1]
+
+    def apply(self, change: Dict):
+        """Applies one change event: ``{"serial": ..., "machine": [id, company] | null}``."""
+        serial = change["serial"]
+        machine = change.get("machine")
+        if machine:
+            self.put(serial, machine[0], machine[1])
+        else:
+            self.discard(serial)
+
+    async def listen(self):
+        """Follows change events; reloads in full after every (re)subscribe."""
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub()
+                await pubsub.subscribe(MACHINE_INDEX_CHANNEL)
+                try:
+                    # Events may have been missed while unsubscribed
+                    await self.load()
+                    async for event in pubsub.listen():
+                        if event.get("type") != "message":
+                            continue
+                        for change in json.loads(event["data"]):
+                            self.apply(change)
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Machine index listener error: {e}. Retrying in 5 seconds...")
+                await asyncio.sleep(5)
+
+
+def machine_change(machine: Machine, deleted: bool = False) -> Dict:
+    return {"serial": machine.SerialNo, "machine": None if deleted else [machine.TableID, machine.CompanyID]}
+
+
+async def publish_machine_changes(changes: Iterable[Dict]):
+    """Notifies every ingest worker about Machine rows that were written."""
+    changes = list(changes)
+    if not changes:
+        return
+    client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, decode_responses=True)
+    try:
+        await client.publish(MACHINE_INDEX_CHANNEL, json.dumps(changes))
+    except Exception as e:
+        logger.error(f"Failed to publish machine index changes: {e}")
+    finally:
+        await client.aclose()
@@ -0,0 +1,89 @@
+import time
+import asyncio
+import logging
+from typing import Dict, Any, Iterable
+
+import redis.asyncio as redis
+
+from . import serialization
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Latest known field values per machine, one Redis hash per machine
+MACHINE_STATE_KEY = "machine_fields:{}"
+
+
+def state_key(machine_id: int) -> str:
+    return MACHINE_STATE_KEY.format(machine_id)
+
+
+def decode_state(raw: Dict[str, str]) -> Dict[str, Any]:
+    """Turns an HGETALL result (JSON encoded values) back into typed fields."""
+    return {field: serialization.loads(value) for field, value in raw.items()}
+
+
+async def read_state(redis_client: redis.Redis, machine_id: int) -> Dict[str, Any]:
+    return decode_state(await redis_client.hgetall(state_key(machine_id)))
+
+
+async def read_states(redis_client: redis.Redis, machine_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    """Fetches the state of many machines in one pipelined round trip."""
+    machine_ids = list(machine_ids)
+    if not machine_ids:
+        return {}
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for machine_id in machine_ids:
+            pipe.hgetall(state_key(machine_id))
+        results = await pipe.execute()
+    return {machine_id: decode_state(raw) for machine_id, raw in zip(machine_ids, results)}
+
+
+class MachineStateWriter:
+    """Coalesces machine state updates and writes them as pipelined HSETs.
+
+    ``update`` only merges fields into a pending map, so the ingest path never
+    waits on Redis. Every ``interval`` seconds the pending fields of all machines
+    go out in one pipeline, one ``HSET`` per machine with just the fields that
+    arrived. Field-level writes mean concurrent updates no longer overwrite each
+    other the way the old GET/merge/SET of a JSON blob could.
+    """
+
+    def __init__(self, redis_client: redis.Redis, interval: float, retry_delay: float = 1.0):
+        self.redis_client = redis_client
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.pending: Dict[int, Dict[str, str]] = {}
+
+    def update(self, machine_id: int, payload: Dict[str, Any]):
+        fields = self.pending.setdefault(machine_id, {})
+        for field, value in payload.items():
+            fields[field] = serialization.dumps(value)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        started = time.perf_counter()
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for machine_id, fields in batch.items():
+                    pipe.hset(state_key(machine_id), mapping=fields)
+                await pipe.execute()
+            metrics.REDIS_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        except BaseException:
+            # Put the batch back underneath anything newer that arrived meanwhile,
+            # also when shutdown cancels the flush so the final one still writes it
+            for machine_id, fields in batch.items():
+                fields.update(self.pending.get(machine_id, {}))
+                self.pending[machine_id] = fields
+            raise
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Redis state flush failed for {len(self.pending)} machines: {e}")
+                await asyncio.sleep(self.retry_delay)
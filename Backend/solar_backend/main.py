@@ -12,7 +12,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
 from solar_backend.database import engine, Base
-from solar_backend.routes import company, employee, customer, machine, report, dashboard, machine_status, auth, realtime
+from solar_backend.routes import company, employee, customer, machine, report, dashboard, machine_status, auth, realtime, telemetry, metrics as metrics_route
+from solar_backend import metrics
+from solar_backend.models.telemetry import Telemetry
+from solar_backend.telemetry_partitions import ensure_telemetry_layout, partition_maintainer
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -30,6 +33,8 @@ async def lifespan(app: FastAPI):
             async with engine.connect() as conn:
                 print("Starting schema synchronization...")
                 for table_name, table in Base.metadata.tables.items():
+                    if table_name == Telemetry.__tablename__:
+                        continue  # partitioned; synced by ensure_telemetry_layout below
                     # Get existing columns from DB
                     result = await conn.execute(text(f"SHOW COLUMNS FROM `{table_name}`"))
                     existing_columns = {row[0].lower() for row in result.fetchall()}
@@ -72,6 +77,37 @@ async def lifespan(app: FastAPI):
         except Exception as sync_e:
             print(f"CRITICAL SYNC ERROR: {sync_e}")
 
+        # MachineStatus needs a unique MachineID for the batched status upserts
+        try:
+            from sqlalchemy import text
+
+            async with engine.connect() as conn:
+                result = await conn.execute(text(
+                    "SHOW INDEX FROM `MachineStatus` WHERE Column_name = 'MachineID' AND Non_unique = 0"
+                ))
+                if not result.fetchall():
+                    print("SYNC: Adding unique index on `MachineStatus`.`MachineID`")
+                    # Keep only the newest row per machine before enforcing uniqueness
+                    await conn.execute(text(
+                        "DELETE s1 FROM `MachineStatus` s1 JOIN `MachineStatus` s2 "
+                        "ON s1.MachineID = s2.MachineID AND s1.StatusID < s2.StatusID"
+                    ))
+                    await conn.execute(text(
+                        "ALTER TABLE `MachineStatus` ADD UNIQUE INDEX `uq_MachineStatus_MachineID` (`MachineID`)"
+                    ))
+                    await conn.commit()
+                    print("SYNC: Unique index on `MachineStatus`.`MachineID` added.")
+        except Exception as index_e:
+            print(f"SYNC ERROR: Failed to add unique index on MachineStatus: {index_e}")
+
+        # Telemetry is partitioned by day: columns, index and partitioning are synced together
+        try:
+            async with engine.connect() as conn:
+                await ensure_telemetry_layout(conn)
+                await conn.commit()
+        except Exception as layout_e:
+            print(f"SYNC ERROR: Failed to sync Telemetry layout: {layout_e}")
+
         # Start MQTT Handler
         from .mqtt_handler import MQTTHandler
         from .config import settings
@@ -81,15 +117,29 @@ async def lifespan(app: FastAPI):
             port=settings.MQTT_PORT,
             username=settings.MQTT_USERNAME,
             password=settings.MQTT_PASSWORD,
-            use_tls=settings.MQTT_USE_TLS
+            use_tls=settings.MQTT_USE_TLS,
+            shared_group=settings.MQTT_SHARED_GROUP or None
         )
         
         # Run MQTT handler as a background task
         mqtt_task = asyncio.create_task(mqtt_handler.start())
+        # Future partitions and retention
+        partition_task = asyncio.create_task(partition_maintainer(engine))
         app.state.mqtt_handler = mqtt_handler
+
+        # Scrape-time gauges read the live handler and connection manager
+        metrics.register_ingest(mqtt_handler)
+        metrics.register_realtime(realtime.manager)
         
         yield
         
+        # Stop partition maintenance; a run cut off mid-statement is redone next start
+        partition_task.cancel()
+        try:
+            await partition_task
+        except asyncio.CancelledError:
+            pass
+
         # Shutdown MQTT handler
         mqtt_task.cancel()
         try:
@@ -127,6 +177,8 @@ app.include_router(report.router)
 app.include_router(dashboard.router)
 app.include_router(machine_status.router)
 app.include_router(realtime.router)
+app.include_router(telemetry.router)
+app.include_router(metrics_route.router)
 
 @app.get("/")
 def root():
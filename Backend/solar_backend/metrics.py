@@ -0,0 +1,158 @@
+"""Prometheus metrics for the ingest and realtime paths.
+
+prometheus_client's own Counter/Histogram take a lock on every update, which
+costs microseconds per call on the ingest hot path. Instead, hot-path metrics
+are plain Python counters (each worker process is single threaded) that a
+custom collector converts to Prometheus families at scrape time. Depths and
+connection counts are read from the live objects during the scrape and cost
+nothing per message.
+"""
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+
+MESSAGE_TYPES: Tuple[str, ...] = ("telemetry", "status", "other")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+FLUSH_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+
+class CounterByType:
+    """Lock-free counter labelled by MQTT message type."""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.counts: Dict[str, int] = {msg_type: 0 for msg_type in MESSAGE_TYPES}
+
+    def inc(self, msg_type: str):
+        if msg_type not in self.counts:
+            msg_type = "other"
+        self.counts[msg_type] += 1
+
+    def collect(self):
+        family = CounterMetricFamily(self.name, self.documentation, labels=["type"])
+        for msg_type, value in self.counts.items():
+            family.add_metric([msg_type], value)
+        return family
+
+
+class FastHistogram:
+    """Lock-free histogram; cumulative buckets are only built at scrape time."""
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.bounds = tuple(buckets)
+        self.counts: List[int] = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def collect(self):
+        cumulative, buckets = 0, []
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            cumulative += count
+            buckets.append(("+Inf" if bound == float("inf") else str(bound), cumulative))
+        return HistogramMetricFamily(self.name, self.documentation, buckets=buckets, sum_value=self.sum)
+
+
+MESSAGES_RECEIVED = CounterByType("solar_mqtt_messages_received", "MQTT messages taken off the ingest queues")
+MESSAGES_PARSED = CounterByType("solar_mqtt_messages_parsed", "MQTT messages decoded successfully")
+MESSAGES_DROPPED = CounterByType("solar_mqtt_messages_dropped", "MQTT messages ignored (bad topic, unknown machine)")
+MESSAGES_FAILED = CounterByType("solar_mqtt_messages_failed", "MQTT messages that raised while being handled")
+
+HANDLE_SECONDS = FastHistogram("solar_mqtt_handle_seconds", "Time spent in MQTTHandler.handle_message", LATENCY_BUCKETS)
+REDIS_FLUSH_SECONDS = FastHistogram("solar_redis_state_flush_seconds", "Duration of one pipelined Redis state write", LATENCY_BUCKETS)
+TELEMETRY_FLUSH_SECONDS = FastHistogram("solar_telemetry_flush_seconds", "Duration of one telemetry flush to MySQL", FLUSH_BUCKETS)
+TELEMETRY_FLUSH_ROWS = FastHistogram("solar_telemetry_flush_rows", "Telemetry rows written per flush", BATCH_BUCKETS)
+
+HOT_PATH_METRICS = (
+    MESSAGES_RECEIVED, MESSAGES_PARSED, MESSAGES_DROPPED, MESSAGES_FAILED,
+    HANDLE_SECONDS, REDIS_FLUSH_SECONDS, TELEMETRY_FLUSH_SECONDS, TELEMETRY_FLUSH_ROWS,
+)
+
+
+def _gauge(name: str, documentation: str, value: float) -> GaugeMetricFamily:
+    return GaugeMetricFamily(name, documentation, value=value)
+
+
+class SolarCollector:
+    """Exposes the hot-path metrics plus gauges read from the live handler and sockets."""
+
+    def __init__(self):
+        self.handler = None
+        self.manager = None
+
+    def collect(self):
+        for metric in HOT_PATH_METRICS:
+            yield metric.collect()
+
+        handler = self.handler
+        if handler is not None:
+            yield _gauge("solar_telemetry_buffer_rows", "Telemetry rows held in memory awaiting flush",
+                         handler.telemetry_buffer.buffered_rows())
+            yield _gauge("solar_telemetry_spool_segments", "Sealed telemetry spool segments awaiting flush",
+                         len(handler.telemetry_buffer.pending))
+            yield _gauge("solar_ingest_queue_depth", "Messages waiting in the ingest worker queues",
+                         sum(queue.qsize() for queue in handler.ingest_queues))
+
+            recent = handler.recent_telemetry
+            yield _gauge("solar_telemetry_recent_machines", "Machines with an in-memory telemetry ring",
+                         len(recent.rings))
+            yield _gauge("solar_telemetry_recent_bytes", "Memory held by the in-memory telemetry rings",
+                         recent.nbytes)
+            yield CounterMetricFamily("solar_telemetry_recent_evictions", "Telemetry rings dropped for idle machines",
+                                      value=recent.evictions)
+            yield CounterMetricFamily("solar_telemetry_recent_hits", "History reads served from the in-memory rings",
+                                      value=recent.hits)
+            yield CounterMetricFamily("solar_telemetry_recent_misses", "History reads not covered by the in-memory rings",
+                                      value=recent.misses)
+
+            bus = handler.realtime_bus
+            yield CounterMetricFamily("solar_realtime_fanout_published", "Updates published to other workers",
+                                      value=bus.published)
+            yield CounterMetricFamily("solar_realtime_fanout_relayed", "Updates relayed from other workers",
+                                      value=bus.relayed)
+            yield _gauge("solar_realtime_fanout_companies", "Company channels this worker is subscribed to",
+                         len(bus.subscribed))
+
+        manager = self.manager
+        if manager is not None:
+            company = GaugeMetricFamily(
+                "solar_websocket_company_connections", "Active company WebSocket subscriptions", labels=["company_id"]
+            )
+            for company_id, count in manager.subscriber_counts("company").items():
+                company.add_metric([str(company_id)], count)
+            yield company
+            yield _gauge("solar_websocket_machine_connections", "Active machine WebSocket subscriptions",
+                         sum(manager.subscriber_counts("machine").values()))
+            yield _gauge("solar_websocket_connections", "Open realtime WebSockets", len(manager.subscriptions))
+
+            clients = list(manager.subscriptions)
+            yield _gauge("solar_websocket_queued_frames", "Frames waiting in WebSocket send queues",
+                         sum(client.depth for client in clients))
+            yield _gauge("solar_websocket_max_queue_depth", "Deepest WebSocket send queue",
+                         max((client.depth for client in clients), default=0))
+            yield _gauge("solar_websocket_conflating_connections", "WebSockets currently receiving conflated updates",
+                         sum(1 for client in clients if client.conflated is not None))
+            yield CounterMetricFamily("solar_websocket_evictions", "WebSockets dropped as dead or slow consumers",
+                                      value=manager.evictions)
+
+
+collector = SolarCollector()
+REGISTRY.register(collector)
+
+
+def register_ingest(handler):
+    """Binds the scrape-time gauges to a running MQTTHandler."""
+    collector.handler = handler
+
+
+def register_realtime(manager):
+    collector.manager = manager
@@ -11,6 +11,7 @@ class Company(Base):
     Address = Column(Text)
     Location = Column(Text)
     image = Column(LONGBLOB)
+    TelemetryRetentionDays = Column(Integer, nullable=True)  # NULL = TELEMETRY_RETENTION_DAYS
 
     # Relationships
     employees = relationship("CompanyEmployee", back_populates="company")
@@ -1,10 +1,12 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from ..database import Base
 
 class MachineStatus(Base):
     __tablename__ = "MachineStatus"
+    # One live row per machine; the batched status writer upserts on it
+    __table_args__ = (UniqueConstraint("MachineID", name="uq_MachineStatus_MachineID"),)
 
     StatusID = Column(Integer, primary_key=True, autoincrement=True)
     MachineID = Column(Integer, ForeignKey("Machine.TableID"), nullable=False)
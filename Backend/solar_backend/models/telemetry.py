@@ -1,19 +1,34 @@
-from sqlalchemy import Column, Integer, Float, DateTime, ForeignKey, JSON
+from sqlalchemy import Column, Integer, Float, DateTime, JSON, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from ..database import Base
 
 class Telemetry(Base):
     __tablename__ = "Telemetry"
+    __table_args__ = (
+        # History queries are range scans of one machine's rows
+        Index("ix_Telemetry_MachineID_Timestamp", "MachineID", "Timestamp"),
+        # Daily partitions are added and dropped by telemetry_partitions
+        {"mysql_partition_by": "RANGE (TO_DAYS(`Timestamp`)) (PARTITION pmax VALUES LESS THAN MAXVALUE)"},
+    )
 
+    # MySQL needs the partitioning column in the primary key and does not
+    # allow foreign keys on partitioned tables
     TelemetryID = Column(Integer, primary_key=True, autoincrement=True)
-    MachineID = Column(Integer, ForeignKey("Machine.TableID"), nullable=False)
+    MachineID = Column(Integer, nullable=False)
     BatteryLevel = Column(Float, nullable=True)
     SolarVoltage = Column(Float, nullable=True)
     SolarCurrent = Column(Float, nullable=True)
     WaterLevel = Column(Float, nullable=True)
+    BatteryVoltage = Column(Float, nullable=True)
+    BrushRPM = Column(Float, nullable=True)
+    BrushTemp = Column(Float, nullable=True)
+    Speed = Column(Float, nullable=True)
+    AreaToday = Column(Float, nullable=True)
     AdditionalData = Column(JSON, nullable=True)
-    Timestamp = Column(DateTime, default=datetime.utcnow)
+    Timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)
 
     # Relationship
-    machine = relationship("Machine", backref="telemetry_records")
+    machine = relationship(
+        "Machine", backref="telemetry_records", primaryjoin="Machine.TableID == foreign(Telemetry.MachineID)"
+    )
@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, Float, Double, DateTime
+from ..database import Base
+from ..telemetry_schema import TELEMETRY_SCHEMA
+
+
+def _rollup_columns():
+    """Columns of a rollup table: per bucket, and per numeric Telemetry column
+    the count of non-NULL values, their sum, min, max and last value."""
+    columns = {
+        "MachineID": Column(Integer, primary_key=True, autoincrement=False),
+        "BucketStart": Column(DateTime, primary_key=True),
+        "Count": Column(Integer, nullable=False, default=0),  # raw rows in the bucket
+        "LastAt": Column(DateTime, nullable=True),  # newest raw row folded in
+    }
+    for name in TELEMETRY_SCHEMA.columns:
+        columns[f"{name}Count"] = Column(Integer, nullable=False, default=0)
+        columns[f"{name}Sum"] = Column(Double, nullable=False, default=0.0)
+        columns[f"{name}Min"] = Column(Float, nullable=True)
+        columns[f"{name}Max"] = Column(Float, nullable=True)
+        columns[f"{name}Last"] = Column(Float, nullable=True)
+    return columns
+
+
+def _rollup_model(table_name: str):
+    return type(table_name, (Base,), {"__tablename__": table_name, **_rollup_columns()})
+
+
+TelemetryRollup1m = _rollup_model("TelemetryRollup1m")
+TelemetryRollup1h = _rollup_model("TelemetryRollup1h")
+TelemetryRollup1d = _rollup_model("TelemetryRollup1d")
+
+# (bucket seconds, model), finest first
+ROLLUPS = (
+    (60, TelemetryRollup1m),
+    (3600, TelemetryRollup1h),
+    (86400, TelemetryRollup1d),
+)
@@ -1,202 +1,295 @@
-import json
+import zlib
+import time
 import logging
 import asyncio
-from typing import Optional, List, Dict
+from datetime import datetime
+from typing import Optional, List
 from aiomqtt import Client, Message, MqttError
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 import redis.asyncio as redis
 
-from .database import AsyncSessionLocal
-from .models.machine import Machine
-from .models.telemetry import Telemetry
-from .models.machine_status import MachineStatus
+from .database import engine
+from .telemetry_writer import REJECTED_ERRORS, write_telemetry
+from .telemetry_spool import TelemetrySpool
+from .telemetry_recent import recent_telemetry
+from .machine_index import MachineIndex
+from .machine_state import MachineStateWriter
+from .status_writer import MachineStatusWriter
+from .telemetry_schema import TELEMETRY_SCHEMA, STATUS_SCHEMA
 from .routes.realtime import manager
+from .ws_stream import RealtimeUpdate
+from .realtime_bus import RealtimeBus
+from . import serialization
+from . import metrics
 from .config import settings
 
 logger = logging.getLogger(__name__)
 
 class MQTTHandler:
-    def __init__(self, broker: str, port: int, username: Optional[str] = None, password: Optional[str] = None, use_tls: bool = False):
+    def __init__(self, broker: str, port: int, username: Optional[str] = None, password: Optional[str] = None, use_tls: bool = False, shared_group: Optional[str] = None):
         self.broker = broker
         self.port = port
         self.username = username
         self.password = password
         self.use_tls = use_tls
+        self.shared_group = shared_group
         self.client: Optional[Client] = None
         self.redis_client = redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, decode_responses=True)
         
         # Batching state
-        self.telemetry_buffer: List[Telemetry] = []
+        # Write-ahead spool: rows hit disk before joining the in-memory batch
+        self.telemetry_buffer = TelemetrySpool(
+            directory=settings.TELEMETRY_SPOOL_DIR,
+            segment_bytes=settings.TELEMETRY_SPOOL_SEGMENT_BYTES,
+            max_memory_rows=settings.TELEMETRY_BUFFER_MAX_ROWS,
+        )
         self.buffer_lock = asyncio.Lock()
-        self.flush_interval = 5  # seconds
+        self.flush_interval = settings.TELEMETRY_FLUSH_INTERVAL
+
+        # Recent rows per machine for history reads; with a shared subscription
+        # this worker only sees part of each machine's rows, so they are not kept
+        self.recent_telemetry = recent_telemetry
+        if self.shared_group:
+            self.recent_telemetry.enabled = False
         
-        # Local Memory Cache for Machine ID resolution
-        self.machine_id_cache: Dict[str, int] = {}
+        # SerialNo -> machine index, kept current by change events from the machine routes
+        self.machine_index = MachineIndex(
+            self.redis_client,
+            max_entries=settings.MACHINE_INDEX_MAX_ENTRIES,
+            negative_ttl=settings.MACHINE_INDEX_NEGATIVE_TTL,
+        )
+
+        # Live machine state, written to Redis hashes in pipelined batches
+        self.state_writer = MachineStateWriter(self.redis_client, interval=settings.MACHINE_STATE_FLUSH_INTERVAL)
+
+        # Latest-wins machine status, upserted to MySQL in batches
+        self.status_writer = MachineStatusWriter(engine, interval=settings.MACHINE_STATUS_FLUSH_INTERVAL)
+
+        # Realtime fan-out to the other workers, needed once ingest is split between them
+        self.realtime_bus = RealtimeBus(
+            self.redis_client,
+            manager,
+            enabled=bool(self.shared_group),
+            interval=settings.REALTIME_FANOUT_FLUSH_INTERVAL,
+        )
+        manager.bus = self.realtime_bus
+        # Snapshots on connect come from the cached state and the machine index
+        manager.redis_client = self.redis_client
+        manager.machine_index = self.machine_index
+
+        # Ingest pipeline: one bounded queue per worker, sharded by machine serial
+        self.ingest_queues: List[asyncio.Queue] = [
+            asyncio.Queue(maxsize=settings.MQTT_INGEST_QUEUE_SIZE)
+            for _ in range(max(1, settings.MQTT_INGEST_WORKERS))
+        ]
+        self.backpressure_events = 0
 
     async def start(self):
-        # Start the telemetry batch flusher
-        asyncio.create_task(self.telemetry_flusher())
+        # Start the batch writers, the machine index and the ingest workers
+        pipeline_tasks = [
+            asyncio.create_task(self.telemetry_flusher()),
+            asyncio.create_task(self.machine_index.listen()),
+            asyncio.create_task(self.state_writer.run()),
+            asyncio.create_task(self.status_writer.run()),
+            asyncio.create_task(self.realtime_bus.run()),
+            asyncio.create_task(self.realtime_bus.listen()),
+        ]
+        pipeline_tasks += [asyncio.create_task(self.ingest_worker(q)) for q in self.ingest_queues]
         
+        try:
+            while True:
+                try:
+                    async with Client(
+                        hostname=self.broker,
+                        port=self.port,
+                        username=self.username,
+                        password=self.password,
+                        max_queued_incoming_messages=settings.MQTT_CLIENT_QUEUE_SIZE,
+                    ) as client:
+                        self.client = client
+                        logger.info("Connected to MQTT Broker")
+                        
+                        # Subscribe to telemetry and status
+                        await client.subscribe(self.subscription("company/+/machine/+/telemetry"))
+                        await client.subscribe(self.subscription("company/+/machine/+/status"))
+                        
+                        async for message in client.messages:
+                            await self.dispatch(message)
+                except MqttError as e:
+                    logger.error(f"MQTT Error: {e}. Retrying in 5 seconds...")
+                    await asyncio.sleep(5)
+                except Exception as e:
+                    logger.error(f"Unexpected MQTT Error: {e}. Retrying in 5 seconds...")
+                    await asyncio.sleep(5)
+        finally:
+            for task in pipeline_tasks:
+                task.cancel()
+            await asyncio.gather(*pipeline_tasks, return_exceptions=True)
+            # Last interval of live state and status, including a batch a cancelled flush put back
+            for writer in (self.state_writer, self.status_writer):
+                try:
+                    await writer.flush()
+                except Exception as e:
+                    logger.error(f"Final {type(writer).__name__} flush failed: {e}")
+            self.telemetry_buffer.close()
+
+    def subscription(self, topic: str) -> str:
+        """Wraps a topic filter in a shared subscription when a group is configured.
+
+        With ``$share/<group>/...`` the broker delivers each message to only one
+        member of the group, so several workers or hosts split the ingest load
+        instead of each persisting every message.
+
+        The broker must pick the member by topic (EMQX
+        ``shared_subscription_strategy = hash_topic``). Its default,
+        ``round_robin``, spreads one machine's messages over several workers,
+        so latest-wins status, the cached state and delta ``seq`` could go
+        backwards.
+        """
+        if self.shared_group:
+            return f"$share/{self.shared_group}/{topic}"
+        return topic
+
+    async def dispatch(self, message: Message):
+        """Hands a message to the worker that owns its machine serial.
+
+        All messages of one machine land on the same queue, so they are handled in
+        arrival order. When that queue is full the reader waits here, which stops
+        draining the client buffer instead of piling up unbounded work.
+        """
+        topic_parts = message.topic.value.split('/')
+        machine_serial = topic_parts[3] if len(topic_parts) > 3 else ""
+        shard = zlib.crc32(machine_serial.encode()) % len(self.ingest_queues)
+        queue = self.ingest_queues[shard]
+
+        if queue.full():
+            self.backpressure_events += 1
+            if self.backpressure_events == 1 or self.backpressure_events % 1000 == 0:
+                logger.warning(
+                    f"Ingest worker {shard} queue full ({queue.maxsize}), applying backpressure "
+                    f"({self.backpressure_events} stalls so far)"
+                )
+        await queue.put(message)
+
+    async def ingest_worker(self, queue: asyncio.Queue):
+        """Processes messages of one shard sequentially."""
         while True:
+            message = await queue.get()
+            started = time.perf_counter()
             try:
-                async with Client(
-                    hostname=self.broker,
-                    port=self.port,
-                    username=self.username,
-                    password=self.password,
-                ) as client:
-                    self.client = client
-                    logger.info("Connected to MQTT Broker")
-                    
-                    # Subscribe to telemetry and status
-                    await client.subscribe("company/+/machine/+/telemetry")
-                    await client.subscribe("company/+/machine/+/status")
-                    
-                    async for message in client.messages:
-                        await self.handle_message(message)
-            except MqttError as e:
-                logger.error(f"MQTT Error: {e}. Retrying in 5 seconds...")
-                await asyncio.sleep(5)
-            except Exception as e:
-                logger.error(f"Unexpected MQTT Error: {e}. Retrying in 5 seconds...")
-                await asyncio.sleep(5)
+                await self.handle_message(message)
+            finally:
+                metrics.HANDLE_SECONDS.observe(time.perf_counter() - started)
+                queue.task_done()
 
     async def telemetry_flusher(self):
-        """Periodically flushes the telemetry buffer to MySQL in batches."""
+        """Periodically flushes spooled telemetry to MySQL in batches.
+
+        Each tick seals the active spool segment; segments are deleted only after
+        their rows are committed, and whatever is left over (including segments
+        replayed from a previous run) is retried on the next tick.
+        """
         while True:
             await asyncio.sleep(self.flush_interval)
             try:
                 async with self.buffer_lock:
-                    if not self.telemetry_buffer:
+                    self.telemetry_buffer.seal()
+                    if not self.telemetry_buffer.pending:
                         continue
-                    to_save = self.telemetry_buffer
-                    self.telemetry_buffer = []
 
-                async with AsyncSessionLocal() as db:
-                    db.add_all(to_save)
-                    await db.commit()
-                    logger.info(f"💾 Batched {len(to_save)} telemetry records to DB")
+                started = time.perf_counter()
+                saved = await self.telemetry_buffer.drain(lambda rows: write_telemetry(engine, rows), REJECTED_ERRORS)
+                metrics.TELEMETRY_FLUSH_SECONDS.observe(time.perf_counter() - started)
+                metrics.TELEMETRY_FLUSH_ROWS.observe(saved)
+                logger.info(f"💾 Batched {saved} telemetry records to DB")
             except Exception as e:
                 logger.error(f"Batch insert error: {e}")
 
     async def handle_message(self, message: Message):
         topic_parts = message.topic.value.split('/')
+        msg_type = topic_parts[4] if len(topic_parts) >= 5 else "other"
+        metrics.MESSAGES_RECEIVED.inc(msg_type)
         if len(topic_parts) < 5:
+            metrics.MESSAGES_DROPPED.inc(msg_type)
             return
 
         try:
             company_id = int(topic_parts[1])
             machine_serial = topic_parts[3]
-            msg_type = topic_parts[4]
             
-            payload = json.loads(message.payload.decode())
+            payload = serialization.loads(message.payload)
+            metrics.MESSAGES_PARSED.inc(msg_type)
             
-            # 1. Resolve Machine ID (Order: Memory -> Redis -> DB)
-            if machine_serial in self.machine_id_cache:
-                machine_id = self.machine_id_cache[machine_serial]
+            # 1. Resolve Machine ID (Order: Preloaded index -> negative cache -> DB)
+            machine_ref = await self.machine_index.resolve(machine_serial)
+            if machine_ref is None:
+                metrics.MESSAGES_DROPPED.inc(msg_type)
+                return
+            machine_id = machine_ref[0]
+
+            # 2. Map device keys to typed canonical fields (one dict lookup per key),
+            # so live frames, snapshots, delta state and field filters share one key space
+            if msg_type == "telemetry":
+                fields, extra = TELEMETRY_SCHEMA.extract(payload)
+                state = {**extra, **fields}
+            elif msg_type == "status":
+                fields, extra = STATUS_SCHEMA.extract(payload)
+                state = {**extra, **fields}
             else:
-                redis_machine_key = f"machine_map:{machine_serial}"
-                machine_id_str = await self.redis_client.get(redis_machine_key)
-                
-                if machine_id_str:
-                    machine_id = int(machine_id_str)
-                    self.machine_id_cache[machine_serial] = machine_id
-                else:
-                    async with AsyncSessionLocal() as db:
-                        stmt = select(Machine).filter(Machine.SerialNo == machine_serial)
-                        result = await db.execute(stmt)
-                        machine = result.scalar_one_or_none()
-                        if not machine:
-                            logger.warning(f"Machine with SerialNo {machine_serial} not found")
-                            return
-                        machine_id = machine.TableID
-                        await self.redis_client.setex(redis_machine_key, 3600, str(machine_id))
-                        self.machine_id_cache[machine_serial] = machine_id
-
-            # 2. IMMEDIATE Broadcast (Zero-latency path)
-            # Send payload to UI before ANY db/redis blocking calls
-            update_msg = {"type": msg_type, "machine_id": machine_id, "data": payload}
-            asyncio.create_task(manager.broadcast_to_machine(machine_id, update_msg))
-            asyncio.create_task(manager.broadcast_to_company(company_id, update_msg))
-
-            # 3. Update Redis Cache (Background Task)
-            # Retrieve current state to merge new payload
-            redis_state_key = f"machine_state:{machine_id}"
-            
-            # Use 'create_task' to not block the next message processing
-            async def update_redis_cache():
-                try:
-                    cached_state_raw = await self.redis_client.get(redis_state_key)
-                    cached_state = json.loads(cached_state_raw) if cached_state_raw else {}
-                    cached_state.update(payload)
-                    await self.redis_client.set(redis_state_key, json.dumps(cached_state))
-                except Exception as e:
-                    logger.error(f"Redis update failed for {machine_id}: {e}")
+                state = payload
 
-            asyncio.create_task(update_redis_cache())
+            # 3. IMMEDIATE Broadcast (Zero-latency path)
+            # Send the update to the UI before ANY db/redis blocking calls
+            # Local sockets only get it queued (encoded at most once per snapshot,
+            # merged on (type, machine) for rate-limited ones); other workers get
+            # it through the realtime bus
+            update_msg = RealtimeUpdate({"type": msg_type, "machine_id": machine_id, "data": state})
+            self.realtime_bus.publish(company_id, machine_id, msg_type, update_msg)
 
-            # 4. Process Persistence (Background)
+            # 4. Update the Redis cache (coalesced, pipelined HSET of the received
+            # fields) and persistence
+            self.state_writer.update(machine_id, state)
             if msg_type == "telemetry":
-                await self.queue_telemetry(machine_id, payload)
+                await self.queue_telemetry(machine_id, fields, extra)
             elif msg_type == "status":
-                asyncio.create_task(self.update_status_db(machine_id, payload))
+                self.status_writer.update(machine_id, fields)
 
         except Exception as e:
+            metrics.MESSAGES_FAILED.inc(msg_type)
             logger.error(f"Error handling MQTT message: {e}")
 
-    async def queue_telemetry(self, machine_id: int, payload: dict):
-        """Queues telemetry to memory buffer for batch processing."""
-        telemetry = Telemetry(
-            MachineID=machine_id,
-            BatteryLevel=payload.get("battery"),
-            SolarVoltage=payload.get("solar_v"),
-            SolarCurrent=payload.get("solar_a"),
-            WaterLevel=payload.get("water"),
-            AdditionalData=payload.get("extra")
-        )
-        async with self.buffer_lock:
-            self.telemetry_buffer.append(telemetry)
+    async def queue_telemetry(self, machine_id: int, fields: dict, extra: dict):
+        """Spools telemetry to disk and the memory buffer for batch processing.
 
-    async def update_status_db(self, machine_id: int, payload: dict):
-        """Asynchronously update the status record in MySQL."""
-        try:
-            async with AsyncSessionLocal() as db:
-                stmt = select(MachineStatus).filter(MachineStatus.MachineID == machine_id)
-                res = await db.execute(stmt)
-                status_entry = res.scalar_one_or_none()
-                
-                status_str = payload.get("status")
-                if status_entry:
-                    if status_str: status_entry.Status = status_str
-                    status_entry.EnergyValue = payload.get("energy", status_entry.EnergyValue)
-                    status_entry.WaterValue = payload.get("water", status_entry.WaterValue)
-                    status_entry.AreaValue = payload.get("area", status_entry.AreaValue)
-                else:
-                    db.add(MachineStatus(
-                        MachineID=machine_id,
-                        Status=status_str or "Online",
-                        EnergyValue=payload.get("energy", 0.0),
-                        WaterValue=payload.get("water", 0.0),
-                        AreaValue=payload.get("area", 0.0)
-                    ))
-                
-                # Update Machine.IsOnline
-                if status_str:
-                    m_stmt = select(Machine).filter(Machine.TableID == machine_id)
-                    m_res = await db.execute(m_stmt)
-                    machine = m_res.scalar_one_or_none()
-                    if machine:
-                        machine.IsOnline = 1 if status_str.lower() != "offline" else 0
-                
-                await db.commit()
-        except Exception as e:
-            logger.error(f"Failed to update status in DB: {e}")
+        Registry fields with a Telemetry column are stored there; other known
+        fields and unknown keys go to AdditionalData.
+        """
+        telemetry = {"MachineID": machine_id}
+        additional = dict(extra)
+        legacy_extra = additional.pop("extra", None)  # older firmware nests free-form data
+        if isinstance(legacy_extra, dict):
+            additional.update(legacy_extra)
+        elif legacy_extra is not None:
+            additional["extra"] = legacy_extra
+
+        for column in TELEMETRY_SCHEMA.columns:
+            telemetry[column] = fields.get(column)
+        for name, value in fields.items():
+            if name not in TELEMETRY_SCHEMA.column_set:
+                additional[name] = value
+
+        telemetry["AdditionalData"] = additional or None
+        telemetry["Timestamp"] = datetime.utcnow()
+        self.recent_telemetry.append(machine_id, telemetry)
+        async with self.buffer_lock:
+            try:
+                self.telemetry_buffer.append(telemetry)
+            except OSError as e:
+                logger.error(f"Telemetry spool write failed, dropping record for machine {machine_id}: {e}")
 
     async def publish_command(self, company_id: int, machine_serial: str, command: dict):
         if not self.client:
             logger.error("MQTT client not connected")
             return
         topic = f"company/{company_id}/machine/{machine_serial}/command"
-        await self.client.publish(topic, json.dumps(command))
+        await self.client.publish(topic, serialization.dumps(command))
         logger.info(f"Published command to {topic}")
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import uuid
+from typing import Dict, Hashable, List, Set, Tuple
+
+import redis.asyncio as redis
+
+from .ws_stream import RealtimeUpdate
+
+logger = logging.getLogger(__name__)
+
+# One channel per company; machine sockets follow the channel of their company
+REALTIME_CHANNEL = "realtime:company:{}"
+
+
+def realtime_channel(company_id: int) -> str:
+    return REALTIME_CHANNEL.format(company_id)
+
+
+class RealtimeBus:
+    """Relays realtime updates between worker processes over Redis pub/sub.
+
+    The ingesting worker delivers an update to its own sockets straight away and
+    publishes it once on the company channel (batched into pipelines every
+    ``interval`` seconds). Every other worker relays it to its local sockets.
+    A worker only subscribes to a company while it serves a socket of that
+    company or of one of its machines, so idle companies cost nothing.
+
+    Only needed when ingest is split across workers (shared subscription); with
+    a plain subscription every worker already ingests every message itself, and
+    the bus just delivers locally.
+    """
+
+    def __init__(self, redis_client: redis.Redis, manager, enabled: bool, interval: float,
+                 poll_interval: float = 0.25, retry_delay: float = 1.0):
+        self.redis_client = redis_client
+        self.manager = manager
+        self.enabled = enabled
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.origin = uuid.uuid4().hex[:12]
+        self.pending: List[Tuple[str, str]] = []
+
+        # company_id -> number of local sockets that need it
+        self.interest: Dict[int, int] = {}
+        self.subscribed: Set[int] = set()
+        self.interest_changed = asyncio.Event()
+
+        # Stats
+        self.published = 0
+        self.relayed = 0
+
+    def publish(self, company_id: int, machine_id: int, msg_type: str, update: RealtimeUpdate):
+        """Delivers an update to local sockets and queues it for the other workers."""
+        key: Hashable = (msg_type, machine_id)
+        self.manager.broadcast_to_machine(machine_id, update, key)
+        self.manager.broadcast_to_company(company_id, update, key)
+        if self.enabled:
+            envelope = f"{self.origin}\t{company_id}\t{machine_id}\t{msg_type}\t{update.frame}"
+            self.pending.append((realtime_channel(company_id), envelope))
+
+    def relay(self, envelope: str):
+        origin, company_id, machine_id, msg_type, frame = envelope.split("\t", 4)
+        if origin == self.origin:
+            return
+        company_id, machine_id = int(company_id), int(machine_id)
+        update = RealtimeUpdate(frame=frame)
+        key: Hashable = (msg_type, machine_id)
+        self.manager.broadcast_to_machine(machine_id, update, key)
+        self.manager.broadcast_to_company(company_id, update, key)
+        self.relayed += 1
+
+    def retain(self, company_id: int):
+        self.interest[company_id] = self.interest.get(company_id, 0) + 1
+        if self.interest[company_id] == 1:
+            self.interest_changed.set()
+
+    def release(self, company_id: int):
+        remaining = self.interest.get(company_id, 0) - 1
+        if remaining > 0:
+            self.interest[company_id] = remaining
+        else:
+            self.interest.pop(company_id, None)
+            self.interest_changed.set()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for channel, envelope in batch:
+                    pipe.publish(channel, envelope)
+                await pipe.execute()
+            self.published += len(batch)
+        except Exception as e:
+            # Realtime frames are stale by the time Redis is back and the state
+            # cache covers the gap, so the batch is dropped rather than retried
+            raise RuntimeError(f"dropped {len(batch)} updates: {e}") from e
+
+    async def run(self):
+        if not self.enabled:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Realtime fan-out publish failed: {e}")
+                await asyncio.sleep(self.retry_delay)
+
+    async def _sync_subscriptions(self, pubsub):
+        self.interest_changed.clear()
+        wanted = set(self.interest)
+        added, removed = wanted - self.subscribed, self.subscribed - wanted
+        if added:
+            await pubsub.subscribe(*(realtime_channel(company_id) for company_id in added))
+        if removed:
+            await pubsub.unsubscribe(*(realtime_channel(company_id) for company_id in removed))
+        self.subscribed = wanted
+
+    async def listen(self):
+        """Relays other workers' updates for the companies this worker serves."""
+        if not self.enabled:
+            return
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub()
+                self.subscribed = set()
+                self.interest_changed.set()
+                try:
+                    while True:
+                        if self.interest_changed.is_set():
+                            await self._sync_subscriptions(pubsub)
+                        if not self.subscribed:
+                            await self.interest_changed.wait()
+                            continue
+                        # Bounded wait so interest changes are applied promptly
+                        event = await pubsub.get_message(ignore_subscribe_messages=True, timeout=self.poll_interval)
+                        if event is not None and event.get("type") == "message":
+                            try:
+                                self.relay(event["data"])
+                            except Exception as e:
+                                logger.error(f"Bad realtime fan-out message: {e}")
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Realtime fan-out listener error: {e}. Retrying in 5 seconds...")
+                await asyncio.sleep(5)
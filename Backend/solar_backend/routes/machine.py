@@ -7,6 +7,7 @@ from ..database import get_db
 from ..models.machine import Machine
 from ..schemas.machine import MachineCreate, MachineUpdate, MachineResponse, MachineDelete
 from ..security import get_current_user
+from ..machine_index import machine_change, publish_machine_changes
 
 router = APIRouter(
     prefix="/machines",
@@ -38,6 +39,7 @@ async def create_machine(machine: MachineCreate, db: AsyncSession = Depends(get_
         db.add(new_machine)
         await db.commit()
         await db.refresh(new_machine)
+        await publish_machine_changes([machine_change(new_machine)])
         return new_machine
     except HTTPException:
         raise
@@ -62,18 +64,24 @@ async def get_machines(customer_id: int = None, db: AsyncSession = Depends(get_d
 @router.put("/update_list", response_model=dict)
 async def bulk_update_machines(data: List[MachineUpdate], db: AsyncSession = Depends(get_db)):
     updated_count: int = 0
+    changes = []
     for item in data:
         result = await db.execute(select(Machine).filter(Machine.TableID == item.TableID))
         machine = result.scalar_one_or_none()
         if not machine:
             continue
         
+        old_serial = machine.SerialNo
         for key, value in item.model_dump(exclude_unset=True).items():
             if key != "TableID":
                 setattr(machine, key, value)
+        if machine.SerialNo != old_serial:
+            changes.append({"serial": old_serial, "machine": None})
+        changes.append(machine_change(machine))
         updated_count += 1
         
     await db.commit()
+    await publish_machine_changes(changes)
     return {"updated_count": updated_count}
 
 @router.put("/{machine_id}", response_model=MachineResponse)
@@ -93,11 +101,16 @@ async def update_machine(machine_id: int, machine_update: MachineUpdate, db: Asy
                 detail=f"Machine with serial number '{machine_update.SerialNo}' already exists."
             )
 
+    old_serial = machine.SerialNo
     for key, value in machine_update.model_dump(exclude_unset=True).items():
         setattr(machine, key, value)
     
     await db.commit()
     await db.refresh(machine)
+    changes = [machine_change(machine)]
+    if machine.SerialNo != old_serial:
+        changes.insert(0, {"serial": old_serial, "machine": None})
+    await publish_machine_changes(changes)
     return machine
 
 # Bulk Delete
@@ -109,10 +122,12 @@ async def bulk_delete_machines(payload: MachineDelete, db: AsyncSession = Depend
     result = await db.execute(select(Machine).filter(Machine.TableID.in_(payload.ids)))
     machines = result.scalars().all()
     
+    changes = [machine_change(machine, deleted=True) for machine in machines]
     for machine in machines:
         await db.delete(machine)
         
     await db.commit()
+    await publish_machine_changes(changes)
     return {"deleted_count": len(machines)}
 
 @router.delete("/{machine_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -122,8 +137,10 @@ async def delete_machine(machine_id: int, db: AsyncSession = Depends(get_db)):
     if not machine:
         raise HTTPException(status_code=404, detail="Machine not found")
     
+    change = machine_change(machine, deleted=True)
     await db.delete(machine)
     await db.commit()
+    await publish_machine_changes([change])
 
 @router.post("/{machine_id}/command", response_model=dict)
 async def send_command(machine_id: int, command: dict, db: AsyncSession = Depends(get_db)):
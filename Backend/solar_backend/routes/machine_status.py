@@ -2,13 +2,17 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from typing import List
-import json
 import redis.asyncio as redis
 
 from ..database import get_db
 from ..models.machine_status import MachineStatus
 from ..schemas.machine_status import MachineStatusCreate, MachineStatusUpdate, MachineStatusResponse
 from ..config import settings
+from ..machine_state import read_state, read_states
+from ..telemetry_schema import compile_view
+
+# Cached live-state fields that MachineStatusResponse exposes, compiled once
+LIVE_STATUS_VIEW = compile_view(MachineStatusResponse.model_fields)
 
 router = APIRouter(
     prefix="/machine-status",
@@ -45,23 +49,14 @@ async def get_latest_status(
         await db.refresh(status_entry)
 
     # 2. Fetch latest telemetry from Redis
-    redis_key = f"machine_state:{machine_id}"
-    cached_data_raw = await redis_client.get(redis_key)
-    cached_data = json.loads(cached_data_raw) if cached_data_raw else {}
+    cached_data = await read_state(redis_client, machine_id)
 
     # 3. Merge: Convert DB model to Pydantic, then update with Redis data
     # (Pydantic model from_attributes=True handles the DB mapping)
     response_obj = MachineStatusResponse.model_validate(status_entry)
     
-    # Update with fields from Redis if they exist and match the schema
-    update_data = {}
-    for field in MachineStatusResponse.model_fields:
-        if field in cached_data:
-            update_data[field] = cached_data[field]
-        # Handle cases where Redis keys might be lowercase or diff names
-        elif field.lower() in cached_data:
-             update_data[field] = cached_data[field.lower()]
-             
+    # Update with the cached fields that match the schema
+    update_data, _ = LIVE_STATUS_VIEW.extract(cached_data)
     return response_obj.model_copy(update=update_data)
 
 @router.post("", response_model=MachineStatusResponse)
@@ -94,21 +89,14 @@ async def get_all_live_status(
     
     response_list = []
     
-    # 2. For each machine, fetch/merge Redis data
+    # 2. Fetch Redis state of all machines in one pipelined round trip, then merge
+    cached_states = await read_states(redis_client, [entry.MachineID for entry in status_entries])
     for entry in status_entries:
-        redis_key = f"machine_state:{entry.MachineID}"
-        cached_data_raw = await redis_client.get(redis_key)
-        cached_data = json.loads(cached_data_raw) if cached_data_raw else {}
+        cached_data = cached_states.get(entry.MachineID, {})
         
         response_obj = MachineStatusResponse.model_validate(entry)
         
-        update_data = {}
-        for field in MachineStatusResponse.model_fields:
-             if field in cached_data:
-                update_data[field] = cached_data[field]
-             elif field.lower() in cached_data: # Fallback to lowercase keys
-                update_data[field] = cached_data[field.lower()]
-                
+        update_data, _ = LIVE_STATUS_VIEW.extract(cached_data)
         response_list.append(response_obj.model_copy(update=update_data))
         
     return response_list
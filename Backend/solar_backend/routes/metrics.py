@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+
+router = APIRouter(
+    tags=["Metrics"]
+)
+
+@router.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint (per worker process)."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,8 +1,17 @@
-import asyncio
-import json
 import logging
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from typing import List, Dict
+from typing import Any, FrozenSet, Hashable, Iterable, List, Dict, Optional, Tuple, Union
+
+from sqlalchemy import select
+
+from ..database import AsyncSessionLocal
+from ..machine_state import read_states
+from ..models.machine import Machine
+from ..config import settings
+from ..ws_client import WebSocketClient
+from ..ws_encoding import Frame, decode, encode, negotiate
+from ..ws_heartbeat import HeartbeatWheel
+from ..ws_stream import RealtimeUpdate, StreamProfile, UpdateStream, rate_interval
 
 router = APIRouter(
     prefix="/realtime",
@@ -26,110 +35,369 @@ async def debug_company_ws_path(company_id: int):
 
 logger = logging.getLogger(__name__)
 
+# A realtime topic: ("machine", machine_id) or ("company", company_id)
+Topic = Tuple[str, int]
+MACHINE = "machine"
+COMPANY = "company"
+
 class ConnectionManager:
+    """Inverted index of topic -> streams -> subscribed sockets.
+
+    A socket can subscribe to any number of machine and company topics. Within
+    a topic, subscribers with the same delivery profile (rate, delta, encoding,
+    field subset) share one ``UpdateStream``, so a broadcast costs one push per
+    stream of the interested topics and nothing for everybody else.
+    """
+
     def __init__(self):
-        self.active_connections: Dict[int, List[WebSocket]] = {} # machine_id -> list of websockets
-        self.company_connections: Dict[int, List[WebSocket]] = {} # company_id -> list of websockets
+        self.topics: Dict[Topic, Dict[StreamProfile, UpdateStream]] = {}
+        self.subscriptions: Dict[WebSocketClient, Dict[Topic, UpdateStream]] = {}
+        # Cross-worker fan-out (set by the MQTT handler); company each subscription needs
+        self.bus = None
+        self.bus_interest: Dict[WebSocketClient, Dict[Topic, int]] = {}
+        # Keep-alive for every socket, shared instead of one sleeping task each
+        self.heartbeats = HeartbeatWheel(settings.WS_HEARTBEAT_INTERVAL)
+        # Cached machine state for snapshots (set by the MQTT handler)
+        self.redis_client = None
+        self.machine_index = None
+        self.evictions = 0
+
+    async def accept(self, websocket: WebSocket, encoding: Optional[str] = None) -> WebSocketClient:
+        """Completes the handshake in the negotiated wire encoding and registers the socket."""
+        encoding, subprotocol = negotiate(encoding, websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        client = WebSocketClient(websocket, settings.WS_SEND_QUEUE_SIZE, settings.WS_OVERFLOW_POLICY, encoding)
+        self.subscriptions[client] = {}
+        self.heartbeats.add(client)
+        return client
+
+    def profile(self, client: WebSocketClient, topic: Topic, max_hz: Optional[float] = None,
+                delta: bool = False, fields: Optional[Iterable[str]] = None) -> StreamProfile:
+        if topic[0] == MACHINE:
+            interval = rate_interval(settings.WS_MACHINE_MAX_HZ, max_hz)
+        else:
+            # Company updates are collected for at least one batch window per frame
+            interval = max(rate_interval(settings.WS_COMPANY_MAX_HZ, max_hz), settings.WS_COMPANY_BATCH_WINDOW)
+        return (
+            interval,
+            delta,
+            client.encoding,
+            frozenset(fields) if fields else None,
+        )
+
+    def subscribe(self, client: WebSocketClient, topic: Topic, profile: StreamProfile,
+                  company_id: Optional[int] = None) -> bool:
+        """Adds a socket to a topic, replacing an earlier subscription to it.
+
+        ``company_id`` (the owner of a machine topic) lets updates ingested by
+        other workers reach the socket. Returns False once the socket is at
+        ``WS_MAX_SUBSCRIPTIONS``.
+        """
+        subscribed = self.subscriptions.get(client)
+        if subscribed is None:
+            return False
+        if topic in subscribed:
+            self.unsubscribe(client, topic)
+        elif len(subscribed) >= settings.WS_MAX_SUBSCRIPTIONS:
+            return False
+
+        by_profile = self.topics.setdefault(topic, {})
+        stream = by_profile.get(profile)
+        if stream is None:
+            stream = by_profile[profile] = UpdateStream.from_profile(
+                profile, self._evict, settings.WS_KEYFRAME_INTERVAL,
+                batch=topic[0] == COMPANY and settings.WS_COMPANY_BATCH_WINDOW > 0,
+            )
+        stream.clients.append(client)
+        subscribed[topic] = stream
+
+        if topic[0] == COMPANY:
+            company_id = topic[1]
+        if company_id is not None and self.bus is not None:
+            self.bus_interest.setdefault(client, {})[topic] = company_id
+            self.bus.retain(company_id)
+        return True
+
+    def unsubscribe(self, client: WebSocketClient, topic: Topic):
+        stream = self.subscriptions.get(client, {}).pop(topic, None)
+        if stream is None:
+            return
+        if client in stream.clients:
+            stream.clients.remove(client)
+        if not stream.clients:
+            stream.close()
+            by_profile = self.topics.get(topic, {})
+            by_profile = {profile: other for profile, other in by_profile.items() if other is not stream}
+            if by_profile:
+                self.topics[topic] = by_profile
+            else:
+                self.topics.pop(topic, None)
+
+        company_id = self.bus_interest.get(client, {}).pop(topic, None)
+        if company_id is not None and self.bus is not None:
+            self.bus.release(company_id)
+
+    def remove(self, client: WebSocketClient):
+        """Closes a socket and drops all its subscriptions."""
+        client.close()
+        self.heartbeats.discard(client)
+        for topic in list(self.subscriptions.get(client, ())):
+            self.unsubscribe(client, topic)
+        self.subscriptions.pop(client, None)
+        self.bus_interest.pop(client, None)
+
+    def _evict(self, client: WebSocketClient):
+        # Dead or slow: the receive loop sees the close and cleans up too
+        if client in self.subscriptions:
+            self.evictions += 1
+            self.remove(client)
 
-    async def connect(self, websocket: WebSocket, machine_id: int):
+    def machines_of(self, topic: Topic) -> List[int]:
+        if topic[0] == MACHINE:
+            return [topic[1]]
+        return self.machine_index.machines_of_company(topic[1]) if self.machine_index is not None else []
+
+    async def send_snapshot(self, client: WebSocketClient, machine_ids: List[int],
+                            fields: Optional[FrozenSet[str]] = None):
+        """Queues the cached state of the machines ahead of everything else queued."""
+        if self.redis_client is None or not machine_ids:
+            return
+        try:
+            states = await read_states(self.redis_client, machine_ids)
+            if fields is not None:
+                states = {machine_id: {field: value for field, value in state.items() if field in fields}
+                          for machine_id, state in states.items()}
+            client.enqueue_first(encode({
+                "type": "snapshot",
+                "machines": [
+                    {"machine_id": machine_id, "data": state}
+                    for machine_id, state in states.items() if state
+                ],
+            }, client.encoding))
+        except Exception as e:
+            logger.error(f"WS: Snapshot of {len(machine_ids)} machines failed: {e}")
+
+    async def _open(self, websocket: WebSocket, topic: Topic, max_hz: Optional[float], delta: bool,
+                    encoding: Optional[str], company_id: Optional[int] = None) -> WebSocketClient:
+        client = await self.accept(websocket, encoding)
+        self.subscribe(client, topic, self.profile(client, topic, max_hz, delta), company_id)
+        # Subscribed before the snapshot is read, and writing only starts after it is
+        # queued, so live updates arriving meanwhile follow it instead of being missed
+        await self.send_snapshot(client, self.machines_of(topic))
+        client.start()
+        return client
+
+    async def connect(self, websocket: WebSocket, machine_id: int, max_hz: Optional[float] = None,
+                      company_id: Optional[int] = None, delta: bool = False,
+                      encoding: Optional[str] = None) -> Optional[WebSocketClient]:
+        """Opens a single-machine socket; ``company_id`` lets other workers' updates reach it."""
         try:
             logger.info(f"WS: Received connection request for machine {machine_id}")
-            await websocket.accept()
-            if machine_id not in self.active_connections:
-                self.active_connections[machine_id] = []
-            self.active_connections[machine_id].append(websocket)
+            client = await self._open(websocket, (MACHINE, machine_id), max_hz, delta, encoding, company_id)
             logger.info(f"WS: Handshake successful for machine {machine_id}")
+            return client
         except Exception as e:
             logger.error(f"WS ERROR: Handshake failed for machine {machine_id}: {e}")
 
-    async def connect_company(self, websocket: WebSocket, company_id: int):
+    async def connect_company(self, websocket: WebSocket, company_id: int, max_hz: Optional[float] = None,
+                              delta: bool = False, encoding: Optional[str] = None) -> Optional[WebSocketClient]:
         try:
             logger.info(f"WS: Received connection request for company {company_id}")
-            await websocket.accept()
-            if company_id not in self.company_connections:
-                self.company_connections[company_id] = []
-            self.company_connections[company_id].append(websocket)
+            client = await self._open(websocket, (COMPANY, company_id), max_hz, delta, encoding)
             logger.info(f"WS: Handshake successful for company {company_id}")
+            return client
         except Exception as e:
             logger.error(f"WS ERROR: Handshake failed for company {company_id}: {e}")
 
-    def disconnect(self, websocket: WebSocket, machine_id: int):
-        if machine_id in self.active_connections:
-            if websocket in self.active_connections[machine_id]:
-                self.active_connections[machine_id].remove(websocket)
-            if not self.active_connections[machine_id]:
-                self.active_connections.pop(machine_id, None)
+    def disconnect(self, client: WebSocketClient, machine_id: int):
+        self.remove(client)
         logger.info(f"WS: Disconnected machine {machine_id}")
 
-    def disconnect_company(self, websocket: WebSocket, company_id: int):
-        if company_id in self.company_connections:
-            if websocket in self.company_connections[company_id]:
-                self.company_connections[company_id].remove(websocket)
-            if not self.company_connections[company_id]:
-                self.company_connections.pop(company_id, None)
+    def disconnect_company(self, client: WebSocketClient, company_id: int):
+        self.remove(client)
         logger.info(f"WS: Disconnected company {company_id}")
 
-    async def _send_with_cleanup(self, websocket: WebSocket, message_str: str, target_id: int, is_company: bool):
-        try:
-            await websocket.send_text(message_str)
-        except Exception:
-            # Proactively remove dead connections
-            if is_company:
-                self.disconnect_company(websocket, target_id)
-            else:
-                self.disconnect(websocket, target_id)
-
-    async def broadcast_to_machine(self, machine_id: int, message: dict):
-        if machine_id in self.active_connections:
-            message_str = json.dumps(message)
-            tasks = [self._send_with_cleanup(conn, message_str, machine_id, False) for conn in self.active_connections[machine_id]]
-            if tasks:
-                await asyncio.gather(*tasks, return_exceptions=True)
-
-    async def broadcast_to_company(self, company_id: int, message: dict):
-        if company_id in self.company_connections:
-            message_str = json.dumps(message)
-            tasks = [self._send_with_cleanup(conn, message_str, company_id, True) for conn in self.company_connections[company_id]]
-            if tasks:
-                await asyncio.gather(*tasks, return_exceptions=True)
+    def broadcast(self, topic: Topic, message: Union[dict, RealtimeUpdate], key: Optional[Hashable] = None):
+        """Queues an update for the subscribers of a topic, at most at each one's max rate.
+
+        Never waits on a socket. ``key`` identifies what the update describes; it is
+        what updates are merged on between ticks and what lagging clients conflate on.
+        """
+        streams = self.topics.get(topic)
+        if streams:
+            update = message if isinstance(message, RealtimeUpdate) else RealtimeUpdate(message)
+            for stream in list(streams.values()):
+                stream.push(key, update)
+
+    def broadcast_to_machine(self, machine_id: int, message: Union[dict, RealtimeUpdate], key: Optional[Hashable] = None):
+        self.broadcast((MACHINE, machine_id), message, key)
+
+    def broadcast_to_company(self, company_id: int, message: Union[dict, RealtimeUpdate], key: Optional[Hashable] = None):
+        self.broadcast((COMPANY, company_id), message, key)
+
+    def resync(self, client: WebSocketClient):
+        """Answers a client that detected a ``seq`` gap with keyframes of its streams."""
+        for stream in list(self.subscriptions.get(client, {}).values()):
+            stream.resync(client)
+
+    def handle_client_message(self, client: WebSocketClient, frame: Frame):
+        """Handles a frame sent on a single-topic socket; only ``{"type": "resync"}`` is understood."""
+        message = decode_client_message(client, frame)
+        if message.get("type") == "resync":
+            self.resync(client)
+
+    def subscriber_counts(self, kind: str) -> Dict[int, int]:
+        """Number of subscribed sockets per machine or company id."""
+        return {
+            topic[1]: sum(len(stream.clients) for stream in streams.values())
+            for topic, streams in list(self.topics.items()) if topic[0] == kind
+        }
+
+    def queue_stats(self) -> Dict[str, Any]:
+        """Per-connection outbound queue depths and delivery counters."""
+        connections = [
+            {"topics": [f"{kind}:{target_id}" for kind, target_id in subscribed], **client.stats()}
+            for client, subscribed in list(self.subscriptions.items())
+        ]
+        return {"evictions": self.evictions, "connections": connections}
 
 manager = ConnectionManager()
 
+def decode_client_message(client: WebSocketClient, frame: Frame) -> Dict[str, Any]:
+    """Decodes a client frame in its wire encoding; anything but an object reads as ``{}``."""
+    try:
+        message = decode(frame, client.encoding)
+    except Exception:
+        return {}
+    return message if isinstance(message, dict) else {}
+
+async def receive_frame(websocket: WebSocket) -> Frame:
+    """Next text or binary frame from the client."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    return message["text"] if message.get("text") is not None else message.get("bytes", b"")
+
+async def machine_companies(machine_ids: List[int]) -> Dict[int, Optional[int]]:
+    """Companies of machines, needed to follow their updates across workers."""
+    if not machine_ids or manager.bus is None or not manager.bus.enabled:
+        return {}
+    try:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Machine.TableID, Machine.CompanyID).where(Machine.TableID.in_(machine_ids))
+            )
+            return dict(result.all())
+    except Exception as e:
+        logger.error(f"WS: Could not resolve company of machines {machine_ids}: {e}")
+        return {}
+
+async def machine_company(machine_id: int) -> Optional[int]:
+    return (await machine_companies([machine_id])).get(machine_id)
+
+def _ids(values: Any) -> List[int]:
+    if not isinstance(values, list):
+        return []
+    return [value for value in values if isinstance(value, int) and not isinstance(value, bool)]
+
+async def handle_stream_message(client: WebSocketClient, message: Dict[str, Any]):
+    """Applies one control message of the multiplexed protocol."""
+    msg_type = message.get("type")
+    machines, companies = _ids(message.get("machines")), _ids(message.get("companies"))
+    topics = [(MACHINE, machine_id) for machine_id in machines] + [(COMPANY, company_id) for company_id in companies]
+
+    if msg_type == "subscribe":
+        fields = message.get("fields")
+        fields = [field for field in fields if isinstance(field, str)] if isinstance(fields, list) else None
+        max_hz = message.get("max_hz")
+        max_hz = float(max_hz) if isinstance(max_hz, (int, float)) else None
+        delta = bool(message.get("delta", False))
+        owners = await machine_companies(machines)
+
+        accepted, rejected, snapshot_ids = [], [], []
+        for topic in topics:
+            profile = manager.profile(client, topic, max_hz, delta, fields)
+            if manager.subscribe(client, topic, profile, owners.get(topic[1]) if topic[0] == MACHINE else None):
+                accepted.append(topic)
+                snapshot_ids.extend(manager.machines_of(topic))
+            else:
+                rejected.append(topic)
+
+        client.enqueue(encode({
+            "type": "subscribed",
+            "machines": [target_id for kind, target_id in accepted if kind == MACHINE],
+            "companies": [target_id for kind, target_id in accepted if kind == COMPANY],
+            "rejected": [f"{kind}:{target_id}" for kind, target_id in rejected],
+        }, client.encoding))
+        await manager.send_snapshot(client, list(dict.fromkeys(snapshot_ids)),
+                                    frozenset(fields) if fields else None)
+
+    elif msg_type == "unsubscribe":
+        for topic in topics:
+            manager.unsubscribe(client, topic)
+        client.enqueue(encode({"type": "unsubscribed", "machines": machines, "companies": companies}, client.encoding))
+
+    elif msg_type == "resync":
+        manager.resync(client)
+
+@router.get("/stats")
+async def connection_stats():
+    """Outbound queue depth of every WebSocket served by this worker."""
+    return manager.queue_stats()
+
+@router.websocket("/stream")
+@router.websocket("/stream/")
+async def websocket_stream_endpoint(websocket: WebSocket, encoding: Optional[str] = None):
+    """One socket for any number of machines and companies.
+
+    The client sends ``{"type": "subscribe", "machines": [...], "companies": [...]}``
+    (optionally with ``fields``, ``max_hz`` and ``delta``), ``{"type": "unsubscribe", ...}``
+    and ``{"type": "resync"}``.
+    """
+    try:
+        client = await manager.accept(websocket, encoding)
+    except Exception as e:
+        logger.error(f"WS ERROR: Handshake failed for stream: {e}")
+        return
+    client.start()
+
+    try:
+        while True:
+            message = decode_client_message(client, await receive_frame(websocket))
+            await handle_stream_message(client, message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        manager.remove(client)
+
 @router.websocket("/company/{company_id}")
 @router.websocket("/company/{company_id}/")
-async def websocket_company_endpoint(websocket: WebSocket, company_id: int):
-    await manager.connect_company(websocket, company_id)
-    
-    # Start Heartbeat
-    heartbeat_task = asyncio.create_task(keep_alive(websocket))
-    
+async def websocket_company_endpoint(websocket: WebSocket, company_id: int, max_hz: Optional[float] = None,
+                                     delta: bool = False, encoding: Optional[str] = None):
+    client = await manager.connect_company(websocket, company_id, max_hz, delta, encoding)
+    if client is None:
+        return
+
     try:
         while True:
-            await websocket.receive_text()
+            manager.handle_client_message(client, await receive_frame(websocket))
     except WebSocketDisconnect:
-        manager.disconnect_company(websocket, company_id)
-        heartbeat_task.cancel()
+        pass
+    finally:
+        manager.disconnect_company(client, company_id)
 
 @router.websocket("/{machine_id}")
 @router.websocket("/{machine_id}/")
-async def websocket_endpoint(websocket: WebSocket, machine_id: int):
-    await manager.connect(websocket, machine_id)
-    
-    # Start Heartbeat
-    heartbeat_task = asyncio.create_task(keep_alive(websocket))
-    
-    try:
-        while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        manager.disconnect(websocket, machine_id)
-        heartbeat_task.cancel()
+async def websocket_endpoint(websocket: WebSocket, machine_id: int, max_hz: Optional[float] = None,
+                             delta: bool = False, encoding: Optional[str] = None):
+    client = await manager.connect(websocket, machine_id, max_hz, await machine_company(machine_id), delta, encoding)
+    if client is None:
+        return
 
-async def keep_alive(websocket: WebSocket):
-    """Sends a ping every 5 seconds to keep the connection alive."""
     try:
         while True:
-            await asyncio.sleep(5)
-            await websocket.send_text(json.dumps({"type": "heartbeat"}))
-    except Exception:
+            manager.handle_client_message(client, await receive_frame(websocket))
+    except WebSocketDisconnect:
         pass
+    finally:
+        manager.disconnect(client, machine_id)
@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta
+from typing import Optional
+
+from ..database import get_db
+from ..config import settings
+from ..schemas.telemetry import TelemetryHistoryResponse
+from ..telemetry_archive import archive, archive_boundary
+from ..telemetry_history import choose_bucket, query_history, to_utc
+from ..telemetry_recent import recent_telemetry
+from ..telemetry_schema import TELEMETRY_SCHEMA
+
+router = APIRouter(
+    prefix="/telemetry",
+    tags=["Telemetry"]
+)
+
+@router.get("/{machine_id}", response_model=TelemetryHistoryResponse)
+async def get_telemetry_history(
+    machine_id: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    bucket: Optional[int] = Query(None, gt=0, description="Bucket size in seconds; raised to cap the number of points"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns, default all"),
+    db: AsyncSession = Depends(get_db)
+):
+    # Default window: the last 24 hours
+    end = to_utc(end) if end else datetime.utcnow()
+    start = to_utc(start) if start else end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'from' must be before 'to'")
+
+    columns = TELEMETRY_SCHEMA.columns
+    if fields:
+        columns = tuple(field.strip() for field in fields.split(",") if field.strip())
+        unknown = [column for column in columns if column not in TELEMETRY_SCHEMA.column_set]
+        if unknown:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    bucket = choose_bucket(start, end, settings.TELEMETRY_HISTORY_MAX_POINTS, bucket)
+    # Recent windows are served from this worker's in-memory ring when it covers them
+    buckets = recent_telemetry.query_buckets(machine_id, start, end, bucket, columns)
+    if buckets is not None:
+        return {"MachineID": machine_id, "From": start, "To": end, "BucketSeconds": bucket, "Buckets": buckets}
+
+    archive_until = await archive_boundary(db, archive, machine_id) if settings.TELEMETRY_ARCHIVE_ENABLED else None
+    buckets = await query_history(db, machine_id, start, end, bucket, columns, archive, archive_until)
+    return {"MachineID": machine_id, "From": start, "To": end, "BucketSeconds": bucket, "Buckets": buckets}
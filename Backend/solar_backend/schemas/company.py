@@ -7,6 +7,7 @@ class CompanyBase(BaseModel):
     Address: Optional[str] = None
     Location: Optional[str] = None
     image: Optional[str] = None
+    TelemetryRetentionDays: Optional[int] = None
 
 class CompanyCreate(CompanyBase):
 
@@ -32,6 +33,7 @@ class CompanyUpdate(BaseModel):
     Address: Optional[str] = None
     Location: Optional[str] = None
     image: Optional[str] = None
+    TelemetryRetentionDays: Optional[int] = None
 
     @field_validator('image')
     @classmethod
@@ -0,0 +1,21 @@
+from pydantic import BaseModel
+from datetime import datetime
+from typing import Dict, List, Optional
+
+class TelemetryStats(BaseModel):
+    avg: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    last: Optional[float] = None
+
+class TelemetryBucket(BaseModel):
+    Timestamp: datetime  # bucket start (UTC)
+    Count: int
+    Values: Dict[str, TelemetryStats]
+
+class TelemetryHistoryResponse(BaseModel):
+    MachineID: int
+    From: datetime
+    To: datetime
+    BucketSeconds: int
+    Buckets: List[TelemetryBucket]
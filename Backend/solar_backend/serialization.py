@@ -0,0 +1,42 @@
+"""JSON serialization for the realtime path.
+
+Uses orjson when it is installed and falls back to the stdlib ``json`` module
+otherwise, so the backend still runs without the optional dependency. All
+helpers produce compact JSON and encode datetimes as ISO 8601 strings.
+"""
+import json
+from datetime import datetime, date
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def loads(data: Union[bytes, bytearray, str]) -> Any:
+        return orjson.loads(data)
+
+    def dumpb(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default)
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj, default=_default).decode()
+else:
+    def loads(data: Union[bytes, bytearray, str]) -> Any:
+        return json.loads(data)
+
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, separators=(",", ":"), default=_default)
+
+    def dumpb(obj: Any) -> bytes:
+        return dumps(obj).encode()
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, FrozenSet
+
+from sqlalchemy import update, case
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from .models.machine import Machine
+from .models.machine_status import MachineStatus
+
+logger = logging.getLogger(__name__)
+
+# MachineStatus value columns taken over when a status message reports them
+STATUS_VALUE_FIELDS = ("EnergyValue", "WaterValue", "AreaValue")
+
+
+class MachineStatusWriter:
+    """Latest-wins buffer of machine status, flushed as batched upserts.
+
+    Status messages only merge into a per-machine pending row. Each flush writes
+    all pending rows with ``INSERT ... ON DUPLICATE KEY UPDATE`` on the unique
+    ``MachineStatus.MachineID`` (one statement per distinct set of reported
+    fields, normally just one) plus a single ``UPDATE`` of ``Machine.IsOnline``,
+    instead of two SELECTs and a commit per message.
+    """
+
+    def __init__(self, engine: AsyncEngine, interval: float, retry_delay: float = 5.0):
+        self.engine = engine
+        self.interval = interval
+        self.retry_delay = retry_delay
+        self.pending: Dict[int, Dict[str, Any]] = {}
+
+    def update(self, machine_id: int, status: Dict[str, Any]):
+        """Merges status fields already mapped by ``STATUS_SCHEMA``."""
+        fields = self.pending.setdefault(machine_id, {})
+        status_str = status.get("Status")
+        if status_str:
+            fields["Status"] = status_str
+        for column in STATUS_VALUE_FIELDS:
+            if column in status:
+                fields[column] = status[column]
+        fields["Timestamp"] = datetime.utcnow()
+
+    async def _write(self, batch: Dict[int, Dict[str, Any]]):
+        # executemany needs the same columns in every row
+        groups: Dict[FrozenSet[str], List[Dict[str, Any]]] = {}
+        for machine_id, fields in batch.items():
+            groups.setdefault(frozenset(fields), []).append({"MachineID": machine_id, **fields})
+
+        online = {
+            machine_id: 0 if fields["Status"].lower() == "offline" else 1
+            for machine_id, fields in batch.items() if "Status" in fields
+        }
+
+        async with self.engine.begin() as conn:
+            for columns, rows in groups.items():
+                stmt = mysql_insert(MachineStatus.__table__)
+                stmt = stmt.on_duplicate_key_update({column: stmt.inserted[column] for column in columns})
+                await conn.execute(stmt, rows)
+
+            if online:
+                await conn.execute(
+                    update(Machine.__table__)
+                    .where(Machine.TableID.in_(list(online)))
+                    .values(IsOnline=case(online, value=Machine.TableID))
+                )
+
+    def _requeue(self, batch: Dict[int, Dict[str, Any]]):
+        """Puts a batch back underneath anything newer that arrived meanwhile."""
+        for machine_id, fields in batch.items():
+            fields.update(self.pending.get(machine_id, {}))
+            self.pending[machine_id] = fields
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        try:
+            await self._write(batch)
+            return
+        except IntegrityError as e:
+            if len(batch) == 1:
+                # e.g. a machine deleted since its status arrived; retrying cannot succeed
+                logger.error(f"Dropping status of machine {next(iter(batch))}: {e}")
+                return
+        except BaseException:
+            # Also when shutdown cancels the flush, so the final one still writes it
+            self._requeue(batch)
+            raise
+
+        # One machine's row failed the whole batch: write machine by machine
+        remaining = dict(batch)
+        for machine_id, fields in batch.items():
+            try:
+                await self._write({machine_id: fields})
+            except IntegrityError as e:
+                logger.error(f"Dropping status of machine {machine_id}: {e}")
+            except BaseException:
+                self._requeue(remaining)
+                raise
+            del remaining[machine_id]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to update status in DB: {e}")
+                await asyncio.sleep(self.retry_delay)
@@ -0,0 +1,287 @@
+"""Columnar cold storage for telemetry that has left MySQL.
+
+Every closed day is exported once into ``<TELEMETRY_ARCHIVE_DIR>/<day>.npz``:
+one NumPy array per column, rows sorted by (MachineID, Timestamp), plus
+``machine_ids``/``offsets`` so the rows of one machine are a contiguous slice.
+``manifest.json`` lists the archived days. Partitions and company rows are only
+dropped from MySQL once their days are in the archive.
+
+Members are stored uncompressed by default so they can be memory-mapped: a
+history read maps just the columns it needs and only touches the pages of one
+machine's slice. With ``TELEMETRY_ARCHIVE_COMPRESS`` the files are deflated,
+which makes reads decompress the requested columns instead.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import struct
+import zipfile
+import zlib
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from .config import settings
+from .models.telemetry import Telemetry
+from .telemetry_history import align
+from .telemetry_schema import TELEMETRY_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+# Size of a zip local file header before the file name
+ZIP_LOCAL_HEADER = 30
+
+
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def to_millis(value: datetime) -> int:
+    """Milliseconds since the epoch of a naive UTC datetime."""
+    return (value - EPOCH) // MILLISECOND
+
+
+class TelemetryArchive:
+    """Reads and writes the day files and the manifest of one archive directory."""
+
+    def __init__(self, directory: str, compress: bool = False):
+        self.root = Path(directory)
+        self.compress = compress
+        self.days: Dict[str, Dict[str, Any]] = {}
+        self.manifest_mtime = None
+        # path -> member -> (offset, dtype, shape) for stored members, None for deflated ones
+        self.layouts: Dict[Path, Dict[str, Optional[Tuple[int, np.dtype, Tuple[int, ...]]]]] = {}
+
+    def refresh(self):
+        """Reloads the manifest if another worker rewrote it."""
+        path = self.root / MANIFEST
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self.manifest_mtime:
+            self.days = json.loads(path.read_text())["days"]
+            self.manifest_mtime = mtime
+
+    def has(self, day: date) -> bool:
+        self.refresh()
+        return day.isoformat() in self.days
+
+    def covered_until(self) -> Optional[datetime]:
+        """End of the archived days (the day after the newest one)."""
+        self.refresh()
+        if not self.days:
+            return None
+        return datetime.fromisoformat(max(self.days)) + timedelta(days=1)
+
+    def _save_manifest(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f"{MANIFEST}.tmp"
+        tmp.write_text(json.dumps({"days": self.days}, indent=1, sort_keys=True))
+        os.replace(tmp, self.root / MANIFEST)
+        self.manifest_mtime = (self.root / MANIFEST).stat().st_mtime
+
+    def write_day(self, day: date, arrays: Dict[str, np.ndarray], machines: int):
+        """Writes a day file atomically, then records it in the manifest."""
+        self.refresh()
+        self.root.mkdir(parents=True, exist_ok=True)
+        name = f"{day.isoformat()}.npz"
+        rows = int(arrays["Timestamp"].size)
+        if rows:
+            tmp = self.root / f"{name}.tmp"
+            with open(tmp, "wb") as f:
+                (np.savez_compressed if self.compress else np.savez)(f, **arrays)
+            os.replace(tmp, self.root / name)
+        self.days[day.isoformat()] = {
+            "file": name if rows else None,
+            "rows": rows,
+            "machines": machines,
+            "archived_at": datetime.utcnow().isoformat(timespec="seconds"),
+        }
+        self._save_manifest()
+
+    def _layout(self, path: Path) -> Dict[str, Optional[Tuple[int, np.dtype, Tuple[int, ...]]]]:
+        layout = self.layouts.get(path)
+        if layout is not None:
+            return layout
+        layout = {}
+        with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+            for info in archive.infolist():
+                member = info.filename[:-len(".npy")]
+                if info.compress_type != zipfile.ZIP_STORED:
+                    layout[member] = None
+                    continue
+                # A stored member is the raw .npy file, right after its local header
+                f.seek(info.header_offset + 26)
+                name_length, extra_length = struct.unpack("<HH", f.read(4))
+                f.seek(info.header_offset + ZIP_LOCAL_HEADER + name_length + extra_length)
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+                layout[member] = (f.tell(), dtype, shape)
+        self.layouts[path] = layout
+        return layout
+
+    def column(self, path: Path, member: str) -> np.ndarray:
+        """One column of a day file, memory-mapped when it is stored uncompressed."""
+        spec = self._layout(path).get(member, ())
+        if spec == ():
+            raise KeyError(member)
+        if spec is None:
+            with np.load(path) as arrays:
+                return arrays[member]
+        offset, dtype, shape = spec
+        if math.prod(shape) == 0:
+            return np.empty(shape, dtype)
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+    def read(self, machine_id: int, start: datetime, end: datetime,
+             columns: Sequence[str]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Timestamps (ms since epoch) and the requested columns of one machine in ``[start, end)``."""
+        self.refresh()
+        start_ms, end_ms = to_millis(start), to_millis(end)
+        timestamps, values = [], {column: [] for column in columns}
+        day = start.date()
+        while day < end.date() + timedelta(days=1):
+            entry = self.days.get(day.isoformat())
+            day += timedelta(days=1)
+            if not entry or not entry["file"]:
+                continue
+            path = self.root / entry["file"]
+            machine_ids = self.column(path, "machine_ids")
+            position = int(np.searchsorted(machine_ids, machine_id))
+            if position >= machine_ids.size or machine_ids[position] != machine_id:
+                continue
+            offsets = self.column(path, "offsets")
+            first, last = int(offsets[position]), int(offsets[position + 1])
+            stamps = self.column(path, "Timestamp")[first:last]
+            low, high = np.searchsorted(stamps, [start_ms, end_ms])
+            timestamps.append(np.asarray(stamps[low:high]))
+            for column in columns:
+                values[column].append(np.asarray(self.column(path, column)[first + low:first + high]))
+        if not timestamps:
+            return np.empty(0, np.int64), {column: np.empty(0, np.float32) for column in columns}
+        return np.concatenate(timestamps), {column: np.concatenate(parts) for column, parts in values.items()}
+
+    def query_buckets(self, machine_id: int, start: datetime, end: datetime, bucket: int,
+                      columns: Sequence[str] = TELEMETRY_SCHEMA.columns) -> List[Dict[str, Any]]:
+        """Same result as ``telemetry_history.query_buckets``, computed from the archive."""
+        timestamps, values = self.read(machine_id, start, end, columns)
+        return bucket_arrays(timestamps, values, align(start, bucket), bucket)
+
+
+def bucket_arrays(timestamps: np.ndarray, values: Dict[str, np.ndarray],
+                  origin: datetime, bucket: int) -> List[Dict[str, Any]]:
+    """History buckets of sorted rows: ``timestamps`` in ms since the epoch and a
+    float array per column, NaN where a value is missing."""
+    if not timestamps.size:
+        return []
+    index = (timestamps - to_millis(origin)) // (bucket * 1000)
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    counts = np.diff(np.r_[starts, index.size])
+    positions = np.arange(index.size)
+
+    stats = {}
+    for column, column_values in values.items():
+        column_values = column_values.astype(np.float64)
+        valid = ~np.isnan(column_values)
+        present = np.add.reduceat(valid, starts)
+        sums = np.add.reduceat(np.where(valid, column_values, 0.0), starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages = np.where(present > 0, sums / np.maximum(present, 1), np.nan)
+        last_index = np.maximum.reduceat(np.where(valid, positions, -1), starts)
+        stats[column] = {
+            "avg": averages,
+            "min": np.fmin.reduceat(column_values, starts),
+            "max": np.fmax.reduceat(column_values, starts),
+            "last": np.where(last_index >= 0, column_values[np.maximum(last_index, 0)], np.nan),
+        }
+
+    buckets = []
+    for i, first in enumerate(starts):
+        buckets.append({
+            "Timestamp": origin + timedelta(seconds=int(index[first]) * bucket),
+            "Count": int(counts[i]),
+            "Values": {
+                column: {stat: None if math.isnan(series[i]) else float(series[i]) for stat, series in column_stats.items()}
+                for column, column_stats in stats.items()
+            },
+        })
+    return buckets
+
+
+archive = TelemetryArchive(settings.TELEMETRY_ARCHIVE_DIR, settings.TELEMETRY_ARCHIVE_COMPRESS)
+
+
+def _machine_arrays(rows: List[Tuple]) -> Dict[str, np.ndarray]:
+    """Column arrays of one machine's rows, as selected by ``export_day``."""
+    arrays = {"Timestamp": np.array([row[0] for row in rows], dtype="datetime64[ms]").astype(np.int64)}
+    for i, column in enumerate(TELEMETRY_SCHEMA.columns, start=1):
+        arrays[column] = np.array([np.nan if row[i] is None else row[i] for row in rows], dtype=np.float32)
+    arrays["AdditionalData"] = [row[-1] if row[-1] is not None else "null" for row in rows]
+    return arrays
+
+
+def _day_arrays(segments: List[Tuple[int, Dict[str, Any]]]) -> Dict[str, np.ndarray]:
+    arrays = {
+        "machine_ids": np.array([machine_id for machine_id, _ in segments], dtype=np.int64),
+        "offsets": np.cumsum([0] + [part["Timestamp"].size for _, part in segments]).astype(np.int64),
+    }
+    for column in ("Timestamp", *TELEMETRY_SCHEMA.columns):
+        empty = np.empty(0, np.int64 if column == "Timestamp" else np.float32)
+        arrays[column] = np.concatenate([part[column] for _, part in segments]) if segments else empty
+    # Free-form data is kept but never charted: zlib-compressed JSON lines
+    additional = "\n".join(line for _, part in segments for line in part["AdditionalData"]).encode()
+    arrays["AdditionalData"] = np.frombuffer(zlib.compress(additional), dtype=np.uint8)
+    return arrays
+
+
+async def export_day(conn: AsyncConnection, target: TelemetryArchive, day: date) -> int:
+    """Archives one closed day, machine by machine over the (MachineID, Timestamp) index."""
+    bounds = {"start": datetime.combine(day, datetime.min.time()),
+              "end": datetime.combine(day + timedelta(days=1), datetime.min.time())}
+    table = Telemetry.__tablename__
+    result = await conn.execute(text(
+        f"SELECT DISTINCT `MachineID` FROM `{table}` WHERE `Timestamp` >= :start AND `Timestamp` < :end "
+        f"ORDER BY `MachineID`"
+    ), bounds)
+    machine_ids = [row[0] for row in result.all()]
+
+    columns = ", ".join(f"`{column}`" for column in TELEMETRY_SCHEMA.columns)
+    select_rows = text(
+        f"SELECT `Timestamp`, {columns}, `AdditionalData` FROM `{table}` "
+        f"WHERE `MachineID` = :machine_id AND `Timestamp` >= :start AND `Timestamp` < :end ORDER BY `Timestamp`"
+    )
+    segments = []
+    for machine_id in machine_ids:
+        result = await conn.execute(select_rows, {"machine_id": machine_id, **bounds})
+        # Converted per machine, so only one machine's rows are held as Python objects
+        segments.append((machine_id, await asyncio.to_thread(_machine_arrays, result.all())))
+
+    arrays = await asyncio.to_thread(_day_arrays, segments)
+    await asyncio.to_thread(target.write_day, day, arrays, len(machine_ids))
+    return int(arrays["Timestamp"].size)
+
+
+async def archive_boundary(db: AsyncSession, target: TelemetryArchive, machine_id: int) -> Optional[datetime]:
+    """Where MySQL takes over from the archive for a machine: the start of its
+    company's retention window, but no later than the end of the archived days."""
+    covered_until = target.covered_until()
+    if covered_until is None:
+        return None
+    result = await db.execute(text(
+        "SELECT c.`TelemetryRetentionDays` FROM `Machine` m LEFT JOIN `Company` c ON c.`CompanyID` = m.`CompanyID` "
+        "WHERE m.`TableID` = :machine_id"
+    ), {"machine_id": machine_id})
+    days = result.scalar() or settings.TELEMETRY_RETENTION_DAYS
+    retained_from = datetime.combine(datetime.utcnow().date() - timedelta(days=days), datetime.min.time())
+    return min(retained_from, covered_until)
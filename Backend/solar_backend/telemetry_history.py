@@ -0,0 +1,195 @@
+"""Time-bucketed reads of telemetry for charts.
+
+Each numeric column is reduced to avg/min/max/last per bucket in SQL, so a
+response never carries more than ``TELEMETRY_HISTORY_MAX_POINTS`` buckets no
+matter how many raw rows the range holds. Buckets that are a multiple of a
+rollup level (1m / 1h / 1d) are computed from the coarsest such rollup table;
+other sizes, and ranges older than the rollups, are range scans of Telemetry on
+its ``(MachineID, Timestamp)`` index, or reads of the columnar archive for days
+that have already left MySQL.
+"""
+import asyncio
+import calendar
+import math
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models.telemetry import Telemetry
+from .models.telemetry_rollup import ROLLUPS
+from .telemetry_schema import TELEMETRY_SCHEMA
+
+# Bucket sizes (seconds) the automatic choice rounds up to, so chart axes stay regular
+BUCKET_STEPS = (
+    1, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800,
+    3600, 7200, 10800, 21600, 43200, 86400, 7 * 86400,
+)
+
+STATS = ("avg", "min", "max", "last")
+
+
+def to_utc(value: datetime) -> datetime:
+    """Naive UTC, as Telemetry timestamps are stored."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def choose_bucket(start: datetime, end: datetime, max_points: int, requested: Optional[int] = None) -> int:
+    """Bucket size in seconds: the requested one, raised as needed to stay within ``max_points``."""
+    span = max(1.0, (end - start).total_seconds())
+    smallest = math.ceil(span / max(1, max_points))
+    if requested is not None and requested >= smallest:
+        return requested
+    for step in BUCKET_STEPS:
+        if step >= smallest:
+            return step
+    return smallest
+
+
+def align(value: datetime, bucket: int) -> datetime:
+    """Start of the bucket containing ``value``, on a multiple of ``bucket`` since the epoch."""
+    epoch = calendar.timegm(value.timetuple())
+    return datetime(1970, 1, 1) + timedelta(seconds=epoch - epoch % bucket)
+
+
+def rollup_for(bucket: int) -> Optional[Tuple[int, Any]]:
+    """The coarsest rollup level whose buckets tile ``bucket`` exactly, if any."""
+    usable = [(step, model) for step, model in ROLLUPS if bucket % step == 0]
+    return usable[-1] if usable else None
+
+
+def _buckets(result, origin: datetime, bucket: int, columns: Sequence[str]) -> List[Dict[str, Any]]:
+    buckets = []
+    for row in result.mappings():
+        values = {}
+        for column in columns:
+            stats = {stat: row[f"{column}_{stat}"] for stat in STATS}
+            values[column] = {stat: float(value) if value is not None else None for stat, value in stats.items()}
+        buckets.append({
+            "Timestamp": origin + timedelta(seconds=int(row["bucket"]) * bucket),
+            "Count": int(row["count"]),
+            "Values": values,
+        })
+    return buckets
+
+
+async def query_buckets(db: AsyncSession, machine_id: int, start: datetime, end: datetime,
+                        bucket: int, columns: Sequence[str] = TELEMETRY_SCHEMA.columns) -> List[Dict[str, Any]]:
+    """Per-bucket count and avg/min/max/last of ``columns`` for one machine from raw rows (MySQL).
+
+    ``last`` is the newest non-NULL value of the bucket.
+    """
+    origin = align(start, bucket)
+    aggregates = []
+    for column in columns:
+        aggregates += [
+            f"AVG(`{column}`) AS `{column}_avg`",
+            f"MIN(`{column}`) AS `{column}_min`",
+            f"MAX(`{column}`) AS `{column}_max`",
+            f"SUBSTRING_INDEX(GROUP_CONCAT(`{column}` ORDER BY `Timestamp` DESC SEPARATOR ','), ',', 1) AS `{column}_last`",
+        ]
+    result = await db.execute(text(
+        f"SELECT TIMESTAMPDIFF(SECOND, :origin, `Timestamp`) DIV :bucket AS bucket, COUNT(*) AS count, "
+        f"{', '.join(aggregates)} "
+        f"FROM `{Telemetry.__tablename__}` "
+        f"WHERE `MachineID` = :machine_id AND `Timestamp` >= :start AND `Timestamp` < :end "
+        f"GROUP BY bucket ORDER BY bucket"
+    ), {"origin": origin, "bucket": bucket, "machine_id": machine_id, "start": start, "end": end})
+    return _buckets(result, origin, bucket, columns)
+
+
+async def query_rollup(db: AsyncSession, table: str, machine_id: int, start: datetime, end: datetime,
+                       bucket: int, columns: Sequence[str] = TELEMETRY_SCHEMA.columns) -> List[Dict[str, Any]]:
+    """Same result as ``query_buckets``, merged from the rows of a rollup table (MySQL)."""
+    origin = align(start, bucket)
+    aggregates = []
+    for column in columns:
+        aggregates += [
+            f"SUM(`{column}Sum`) / NULLIF(SUM(`{column}Count`), 0) AS `{column}_avg`",
+            f"MIN(`{column}Min`) AS `{column}_min`",
+            f"MAX(`{column}Max`) AS `{column}_max`",
+            f"SUBSTRING_INDEX(GROUP_CONCAT(`{column}Last` ORDER BY `BucketStart` DESC SEPARATOR ','), ',', 1) AS `{column}_last`",
+        ]
+    result = await db.execute(text(
+        f"SELECT TIMESTAMPDIFF(SECOND, :origin, `BucketStart`) DIV :bucket AS bucket, SUM(`Count`) AS count, "
+        f"{', '.join(aggregates)} "
+        f"FROM `{table}` "
+        f"WHERE `MachineID` = :machine_id AND `BucketStart` >= :start AND `BucketStart` < :end "
+        f"GROUP BY bucket ORDER BY bucket"
+    ), {"origin": origin, "bucket": bucket, "machine_id": machine_id, "start": start, "end": end})
+    return _buckets(result, origin, bucket, columns)
+
+
+async def rollup_coverage(db: AsyncSession, table: str, machine_id: int) -> Optional[datetime]:
+    """First bucket of a machine in a rollup table (a primary key seek)."""
+    result = await db.execute(
+        text(f"SELECT MIN(`BucketStart`) FROM `{table}` WHERE `MachineID` = :machine_id"),
+        {"machine_id": machine_id},
+    )
+    return result.scalar()
+
+
+def _merge_edge(before: List[Dict[str, Any]], after: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Joins two consecutive bucket lists whose boundary may cut one bucket in two."""
+    if not before or not after or before[-1]["Timestamp"] != after[0]["Timestamp"]:
+        return before + after
+    left, right = before[-1], after[0]
+    count = left["Count"] + right["Count"]
+    values = {}
+    for column, early in left["Values"].items():
+        late = right["Values"][column]
+        # (stats, rows) of the halves that have values; averages are weighted by
+        # row count, as per-column counts are not part of a bucket
+        present = [(stats, part["Count"]) for stats, part in ((early, left), (late, right)) if stats["avg"] is not None]
+        weight = sum(rows for _, rows in present)
+        values[column] = {
+            "avg": sum(stats["avg"] * rows for stats, rows in present) / weight if present else None,
+            "min": min((stats["min"] for stats, _ in present), default=None),
+            "max": max((stats["max"] for stats, _ in present), default=None),
+            "last": late["last"] if late["last"] is not None else early["last"],
+        }
+    return before[:-1] + [{"Timestamp": left["Timestamp"], "Count": count, "Values": values}] + after[1:]
+
+
+async def query_history(db: AsyncSession, machine_id: int, start: datetime, end: datetime,
+                        bucket: int, columns: Sequence[str] = TELEMETRY_SCHEMA.columns,
+                        archive=None, archive_until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Buckets for a range from the coarsest usable rollup, falling back to raw rows.
+
+    Rollups only exist from the moment they were introduced (or a machine first
+    reported), so the part of the range before a machine's first complete rollup
+    bucket is read from Telemetry and the rest from the rollup. Raw rows from
+    before ``archive_until`` are read from ``archive`` (a ``TelemetryArchive``).
+    """
+    async def raw(raw_start: datetime, raw_end: datetime) -> List[Dict[str, Any]]:
+        if archive is None or archive_until is None or raw_start >= archive_until:
+            return await query_buckets(db, machine_id, raw_start, raw_end, bucket, columns)
+        cold = await asyncio.to_thread(
+            archive.query_buckets, machine_id, raw_start, min(archive_until, raw_end), bucket, columns
+        )
+        if archive_until >= raw_end:
+            return cold
+        return _merge_edge(cold, await query_buckets(db, machine_id, archive_until, raw_end, bucket, columns))
+
+    level = rollup_for(bucket)
+    if level is None:
+        return await raw(start, end)
+
+    step, model = level
+    first = await rollup_coverage(db, model.__tablename__, machine_id)
+    if first is None:
+        return await raw(start, end)
+
+    # The first rollup bucket may be partial, and the split must fall on a bucket edge
+    split = align(first + timedelta(seconds=step) + timedelta(seconds=bucket - 1), bucket)
+    if split <= start:
+        # Include the rollup bucket that holds ``start``; buckets never straddle a query bucket
+        return await query_rollup(db, model.__tablename__, machine_id, align(start, step), end, bucket, columns)
+
+    buckets = await raw(start, min(split, end))
+    if split < end:
+        buckets += await query_rollup(db, model.__tablename__, machine_id, split, end, bucket, columns)
+    return buckets
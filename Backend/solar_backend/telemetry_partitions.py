@@ -0,0 +1,324 @@
+"""Daily RANGE partitioning and retention of the Telemetry table (MySQL).
+
+Telemetry is partitioned on ``TO_DAYS(Timestamp)``: one partition per day plus
+a ``pmax`` catch-all. A maintenance job keeps ``TELEMETRY_PARTITION_DAYS_AHEAD``
+days of empty partitions ready (split off ``pmax``, which is cheap while it is
+empty) and drops whole partitions once they are older than the longest
+retention of any company, which costs a file delete instead of a DELETE scan.
+Companies with a shorter ``TelemetryRetentionDays`` have their older rows
+deleted in small batches, pruned to the partitions still kept. The 1-minute
+rollup follows the raw retention; the hourly and daily rollups it was folded
+into are kept.
+
+With the archive enabled, closed days are exported to it first and nothing is
+dropped or deleted from a day that is not archived yet.
+"""
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from .config import settings
+from .models.telemetry import Telemetry
+from .models.telemetry_rollup import ROLLUPS
+from .telemetry_archive import archive, export_day
+from .telemetry_rollup import prune_rollup
+
+logger = logging.getLogger(__name__)
+
+TABLE = Telemetry.__tablename__
+CATCH_ALL = "pmax"
+HISTORY = "phistory"  # everything before the day an existing table was converted
+LOCK_NAME = "solar_telemetry_partitions"
+LAYOUT_LOCK_TIMEOUT = 60  # seconds a starting worker waits for another one's layout sync
+PURGE_BATCH = 10000
+
+# MySQL's TO_DAYS() counts from year 0, Python ordinals from year 1
+TO_DAYS_OFFSET = 365
+
+
+def to_days(day: date) -> int:
+    return day.toordinal() + TO_DAYS_OFFSET
+
+
+def from_days(days: int) -> date:
+    return date.fromordinal(days - TO_DAYS_OFFSET)
+
+
+def partition_name(day: date) -> str:
+    return f"p{day:%Y%m%d}"
+
+
+def partition_clause(day: date) -> str:
+    """Partition holding the rows of ``day``."""
+    return f"PARTITION {partition_name(day)} VALUES LESS THAN ({to_days(day + timedelta(days=1))})"
+
+
+async def read_partitions(conn: AsyncConnection) -> List[Tuple[Optional[str], Optional[date]]]:
+    """``(name, first day not included)`` per partition in order; the bound is None
+    for the catch-all, and the name is None if the table is not partitioned."""
+    result = await conn.execute(text(
+        "SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table ORDER BY PARTITION_ORDINAL_POSITION"
+    ), {"table": TABLE})
+    partitions = []
+    for name, description in result.all():
+        bound = None if description in (None, "MAXVALUE") else from_days(int(description))
+        partitions.append((name, bound))
+    return partitions
+
+
+async def _sync_columns(conn: AsyncConnection):
+    result = await conn.execute(text(
+        "SELECT COLUMN_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+    ), {"table": TABLE})
+    existing = {row[0].lower() for row in result.all()}
+    for column in Telemetry.__table__.columns:
+        if column.name.lower() in existing:
+            continue
+        col_type = column.type.compile(dialect=conn.dialect)
+        nullable = "NULL" if column.nullable else "NOT NULL"
+        print(f"SYNC: Adding missing column `{column.name}` to table `{TABLE}`")
+        await conn.execute(text(f"ALTER TABLE `{TABLE}` ADD COLUMN `{column.name}` {col_type} {nullable}"))
+
+
+async def _sync_history_index(conn: AsyncConnection):
+    result = await conn.execute(text(
+        f"SHOW INDEX FROM `{TABLE}` WHERE Key_name = 'ix_Telemetry_MachineID_Timestamp'"
+    ))
+    if not result.fetchall():
+        print(f"SYNC: Adding index on `{TABLE}` (`MachineID`, `Timestamp`)")
+        # Online DDL: ingest keeps writing while the index is built
+        await conn.execute(text(
+            f"ALTER TABLE `{TABLE}` ADD INDEX `ix_Telemetry_MachineID_Timestamp` (`MachineID`, `Timestamp`), "
+            "ALGORITHM=INPLACE, LOCK=NONE"
+        ))
+
+
+async def _partition_existing(conn: AsyncConnection, today: date):
+    """Converts an unpartitioned Telemetry table (a full table rebuild)."""
+    print(f"SYNC: Partitioning `{TABLE}` by day; this rebuilds the table once")
+    result = await conn.execute(text(
+        "SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS "
+        "WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = :table"
+    ), {"table": TABLE})
+    for (constraint,) in result.all():
+        await conn.execute(text(f"ALTER TABLE `{TABLE}` DROP FOREIGN KEY `{constraint}`"))
+
+    # The partitioning column has to be part of the primary key, and so NOT NULL
+    await conn.execute(text(f"UPDATE `{TABLE}` SET `Timestamp` = '1970-01-01' WHERE `Timestamp` IS NULL"))
+    await conn.execute(text(
+        f"ALTER TABLE `{TABLE}` MODIFY `Timestamp` DATETIME NOT NULL, "
+        f"DROP PRIMARY KEY, ADD PRIMARY KEY (`TelemetryID`, `Timestamp`)"
+    ))
+    await conn.execute(text(
+        f"ALTER TABLE `{TABLE}` PARTITION BY RANGE (TO_DAYS(`Timestamp`)) ("
+        f"PARTITION {HISTORY} VALUES LESS THAN ({to_days(today)}), "
+        f"PARTITION {CATCH_ALL} VALUES LESS THAN MAXVALUE)"
+    ))
+    print(f"SYNC: `{TABLE}` is partitioned.")
+
+
+async def ensure_telemetry_layout(conn: AsyncConnection):
+    """Startup schema sync for Telemetry, in place of the generic column sync.
+
+    Adds missing columns and the history index under the maintenance lock, so
+    workers starting together do not race on the same DDL. A table created
+    before partitioning was introduced is only reported: converting it
+    rebuilds the whole table, which is left to ``partition_existing_table``.
+    """
+    acquired = (await conn.execute(
+        text("SELECT GET_LOCK(:name, :timeout)"), {"name": LOCK_NAME, "timeout": LAYOUT_LOCK_TIMEOUT}
+    )).scalar()
+    if not acquired:
+        print(f"SYNC: `{TABLE}` layout is locked by another worker, skipping")
+        return
+    try:
+        await _sync_columns(conn)
+        await _sync_history_index(conn)
+        partitions = await read_partitions(conn)
+        if partitions and partitions[0][0] is None:
+            print(f"SYNC WARNING: `{TABLE}` is not partitioned, so old telemetry is not dropped. "
+                  f"Run `python -m solar_backend.telemetry_partitions` once to convert it.")
+    finally:
+        await conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+
+
+async def partition_existing_table(engine: AsyncEngine) -> bool:
+    """Operator command: partitions an existing unpartitioned Telemetry table.
+
+    Holds the maintenance lock for the whole rebuild and re-checks the layout
+    once it has it; returns False if the table was already partitioned.
+    """
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT GET_LOCK(:name, -1)"), {"name": LOCK_NAME})
+        try:
+            partitions = await read_partitions(conn)
+            if not partitions or partitions[0][0] is not None:
+                return False
+            await _partition_existing(conn, datetime.utcnow().date())
+            await conn.commit()
+            return True
+        finally:
+            await conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+            await conn.commit()
+
+
+async def add_future_partitions(conn: AsyncConnection, today: date, days_ahead: int) -> int:
+    """Splits daily partitions up to ``today + days_ahead`` off the catch-all."""
+    partitions = await read_partitions(conn)
+    if not partitions or partitions[0][0] is None:
+        return 0
+    bounds = [bound for _, bound in partitions if bound is not None]
+    day = max(bounds) if bounds else today
+    last = today + timedelta(days=days_ahead)
+    clauses = []
+    while day <= last:
+        clauses.append(partition_clause(day))
+        day += timedelta(days=1)
+    if not clauses:
+        return 0
+    await conn.execute(text(
+        f"ALTER TABLE `{TABLE}` REORGANIZE PARTITION {CATCH_ALL} INTO ("
+        f"{', '.join(clauses)}, PARTITION {CATCH_ALL} VALUES LESS THAN MAXVALUE)"
+    ))
+    return len(clauses)
+
+
+async def unarchived_days(conn: AsyncConnection, today: date) -> List[date]:
+    """Closed days still in MySQL that are not archived, oldest first.
+
+    A day is closed once a whole day has passed since its end, so late spool
+    replays still land in MySQL before it is exported.
+    """
+    days = []
+    lower = None
+    for name, bound in await read_partitions(conn):
+        if name is None or bound is None:
+            break
+        if name == HISTORY:
+            # Loose index scan: one probe per machine on (MachineID, Timestamp)
+            result = await conn.execute(text(
+                f"SELECT MIN(first) FROM (SELECT MIN(`Timestamp`) AS first FROM `{TABLE}` PARTITION ({HISTORY}) "
+                f"GROUP BY `MachineID`) AS firsts"
+            ))
+            first = result.scalar()
+            lower = first.date() if first is not None else bound
+        elif lower is None:
+            lower = bound - timedelta(days=1)
+        day = lower
+        while day < bound and day < today - timedelta(days=1):
+            if not archive.has(day):
+                days.append(day)
+            day += timedelta(days=1)
+        lower = bound
+    return days
+
+
+async def drop_expired_partitions(conn: AsyncConnection, cutoff: date) -> List[str]:
+    """Drops the partitions that only hold rows from before ``cutoff``."""
+    expired = [name for name, bound in await read_partitions(conn)
+               if name is not None and bound is not None and bound <= cutoff]
+    if expired:
+        await conn.execute(text(f"ALTER TABLE `{TABLE}` DROP PARTITION {', '.join(expired)}"))
+    return expired
+
+
+async def retention_cutoffs(conn: AsyncConnection, today: date) -> Tuple[date, Dict[int, date]]:
+    """Partition cutoff (longest retention) and the earlier cutoffs of companies that keep less."""
+    result = await conn.execute(text("SELECT `CompanyID`, `TelemetryRetentionDays` FROM `Company`"))
+    default = settings.TELEMETRY_RETENTION_DAYS
+    retention = {company_id: days if days and days > 0 else default for company_id, days in result.all()}
+    longest = max([default, *retention.values()])
+    shorter = {company_id: today - timedelta(days=days) for company_id, days in retention.items() if days < longest}
+    return today - timedelta(days=longest), shorter
+
+
+async def purge_company_rows(conn: AsyncConnection, company_id: int, since: date, cutoff: date) -> int:
+    """Deletes a company's rows in ``[since, cutoff)`` in batches, committing each one."""
+    result = await conn.execute(
+        text("SELECT `TableID` FROM `Machine` WHERE `CompanyID` = :company_id"), {"company_id": company_id}
+    )
+    machine_ids = [row[0] for row in result.all()]
+    if not machine_ids:
+        return 0
+    delete = text(
+        f"DELETE FROM `{TABLE}` WHERE `MachineID` IN :machine_ids "
+        f"AND `Timestamp` >= :since AND `Timestamp` < :cutoff LIMIT {PURGE_BATCH}"
+    ).bindparams(bindparam("machine_ids", expanding=True))
+    deleted = 0
+    while True:
+        result = await conn.execute(delete, {"machine_ids": machine_ids, "since": since, "cutoff": cutoff})
+        await conn.commit()
+        deleted += result.rowcount
+        if result.rowcount < PURGE_BATCH:
+            return deleted
+        await asyncio.sleep(0)
+
+
+async def maintain_partitions(engine: AsyncEngine, today: Optional[date] = None):
+    """One maintenance pass; with several workers only the one holding the lock runs it."""
+    today = today or datetime.utcnow().date()
+    async with engine.connect() as conn:
+        if not (await conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": LOCK_NAME})).scalar():
+            return
+        try:
+            created = await add_future_partitions(conn, today, settings.TELEMETRY_PARTITION_DAYS_AHEAD)
+            cutoff, company_cutoffs = await retention_cutoffs(conn, today)
+
+            archived = []
+            if settings.TELEMETRY_ARCHIVE_ENABLED:
+                pending = await unarchived_days(conn, today)
+                for day in pending[:settings.TELEMETRY_ARCHIVE_DAYS_PER_RUN]:
+                    rows = await export_day(conn, archive, day)
+                    archived.append(day)
+                    logger.info(f"🗄️ Archived {rows} telemetry rows of {day}")
+                pending = pending[len(archived):]
+                # Nothing at or after the oldest day still waiting for the archive is removed
+                if pending:
+                    cutoff = min(cutoff, pending[0])
+                    company_cutoffs = {company_id: min(company_cutoff, pending[0])
+                                       for company_id, company_cutoff in company_cutoffs.items()}
+
+            dropped = await drop_expired_partitions(conn, cutoff)
+            purged = 0
+            for company_id, company_cutoff in company_cutoffs.items():
+                if company_cutoff > cutoff:
+                    purged += await purge_company_rows(conn, company_id, cutoff, company_cutoff)
+            # Finest rollup level: its buckets are already merged into the coarser ones
+            _, finest = ROLLUPS[0]
+            pruned = await prune_rollup(conn, finest.__tablename__, datetime.combine(cutoff, datetime.min.time()),
+                                        PURGE_BATCH)
+            if created or dropped or purged or archived or pruned:
+                logger.info(f"🗂️ Telemetry partitions: {created} created, {len(dropped)} dropped, "
+                            f"{len(archived)} days archived, {purged} rows past company retention deleted, "
+                            f"{pruned} expired 1m rollup rows deleted")
+        finally:
+            await conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+            await conn.commit()
+
+
+async def partition_maintainer(engine: AsyncEngine):
+    """Runs partition maintenance at startup and then every ``TELEMETRY_PARTITION_CHECK_INTERVAL``."""
+    while True:
+        try:
+            await maintain_partitions(engine)
+        except Exception as e:
+            logger.error(f"Telemetry partition maintenance failed: {e}")
+        await asyncio.sleep(settings.TELEMETRY_PARTITION_CHECK_INTERVAL)
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    async def _main():
+        try:
+            if not await partition_existing_table(engine):
+                print(f"`{TABLE}` is already partitioned, nothing to do.")
+        finally:
+            await engine.dispose()
+
+    asyncio.run(_main())
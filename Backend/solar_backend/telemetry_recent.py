@@ -0,0 +1,118 @@
+"""In-memory ring buffers of each machine's most recent telemetry.
+
+Every row ``queue_telemetry`` accepts is also written into a fixed-size NumPy
+ring of its machine: an int64 timestamp column (ms since the epoch) and a
+float32 matrix of the numeric columns, NaN where a value is missing. History
+requests that fall entirely inside a ring ("the last 15 minutes") are bucketed
+from memory and never reach MySQL, including rows the flusher has not written
+yet.
+
+Every ring has the same size, so memory is ``TELEMETRY_RECENT_MAX_BYTES`` at
+most: once that many rings exist, the machine that reported least recently
+loses its ring. A ring only answers for the time since its oldest row, so a
+machine whose ring was evicted, or which has not reported since startup, falls
+back to MySQL.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import settings
+from .telemetry_archive import bucket_arrays, to_millis
+from .telemetry_history import align
+from .telemetry_schema import TELEMETRY_SCHEMA
+
+
+class MachineRing:
+    """Fixed-capacity ring of one machine's rows, oldest overwritten first."""
+
+    __slots__ = ("timestamps", "values", "size", "next", "since")
+
+    def __init__(self, capacity: int, width: int, since: int):
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full((capacity, width), np.nan, dtype=np.float32)
+        self.size = 0
+        self.next = 0
+        self.since = since  # ms; every row from here on is in the ring
+
+    def append(self, millis: int, row: List[float]):
+        slot = self.next
+        if self.size == self.timestamps.size:
+            self.since = int(self.timestamps[slot]) + 1
+        else:
+            self.size += 1
+        self.timestamps[slot] = millis
+        self.values[slot] = row
+        self.next = (slot + 1) % self.timestamps.size
+
+    def ordered(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Timestamps and values, oldest first."""
+        if self.size < self.timestamps.size:
+            return self.timestamps[:self.size], self.values[:self.size]
+        return np.roll(self.timestamps, -self.next), np.roll(self.values, -self.next, axis=0)
+
+
+class RecentTelemetry:
+    """LRU-bounded set of ``MachineRing``s, one per recently reporting machine."""
+
+    def __init__(self, rows_per_machine: int, max_bytes: int, columns: Sequence[str] = TELEMETRY_SCHEMA.columns):
+        self.columns = tuple(columns)
+        self.positions = {column: i for i, column in enumerate(self.columns)}
+        self.rows_per_machine = max(1, rows_per_machine)
+        self.ring_bytes = self.rows_per_machine * (np.dtype(np.int64).itemsize + len(self.columns) * np.dtype(np.float32).itemsize)
+        self.max_machines = max(0, max_bytes) // self.ring_bytes
+        self.enabled = self.max_machines > 0
+        self.rings: "OrderedDict[int, MachineRing]" = OrderedDict()
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return len(self.rings) * self.ring_bytes
+
+    def append(self, machine_id: int, row: Dict[str, Any]):
+        """Adds one telemetry row, as built by ``queue_telemetry``."""
+        if not self.enabled:
+            return
+        millis = to_millis(row["Timestamp"])
+        ring = self.rings.get(machine_id)
+        if ring is None:
+            if len(self.rings) >= self.max_machines:
+                self.rings.popitem(last=False)
+                self.evictions += 1
+            ring = self.rings[machine_id] = MachineRing(self.rows_per_machine, len(self.columns), millis)
+        else:
+            self.rings.move_to_end(machine_id)
+        ring.append(millis, [np.nan if row.get(column) is None else row[column] for column in self.columns])
+
+    def clear(self):
+        self.rings.clear()
+
+    def window(self, machine_id: int, start: datetime, end: datetime,
+               columns: Sequence[str]) -> Optional[Tuple[np.ndarray, Dict[str, np.ndarray]]]:
+        """Timestamps (ms) and the requested columns of ``[start, end)``, or None
+        if the ring does not reach back to ``start``."""
+        ring = self.rings.get(machine_id) if self.enabled else None
+        start_ms = to_millis(start)
+        if ring is None or start_ms < ring.since:
+            self.misses += 1
+            return None
+        self.hits += 1
+        timestamps, values = ring.ordered()
+        low, high = np.searchsorted(timestamps, [start_ms, to_millis(end)])
+        return timestamps[low:high], {column: values[low:high, self.positions[column]] for column in columns}
+
+    def query_buckets(self, machine_id: int, start: datetime, end: datetime, bucket: int,
+                      columns: Sequence[str] = TELEMETRY_SCHEMA.columns) -> Optional[List[Dict[str, Any]]]:
+        """Same result as ``telemetry_history.query_buckets``, or None if the range
+        is not entirely in memory."""
+        window = self.window(machine_id, start, end, columns)
+        if window is None:
+            return None
+        return bucket_arrays(*window, align(start, bucket), bucket)
+
+
+recent_telemetry = RecentTelemetry(settings.TELEMETRY_RECENT_ROWS, settings.TELEMETRY_RECENT_MAX_BYTES)
@@ -0,0 +1,151 @@
+"""Incremental maintenance of the 1m / 1h / 1d telemetry rollup tables.
+
+Every batch the flusher writes is folded into per-(machine, bucket) partial
+aggregates in memory and merged into the rollup tables with
+``INSERT ... ON DUPLICATE KEY UPDATE``, in the same transaction as the raw
+rows. Rollups therefore never need a scan of Telemetry and never drift from it:
+a batch that is retried after a failed flush was rolled back in both places.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import case, func, text
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .models.telemetry_rollup import ROLLUPS
+from .telemetry_history import align
+from .telemetry_schema import TELEMETRY_SCHEMA
+
+
+def _empty_bucket(machine_id: int, start: datetime) -> Dict[str, Any]:
+    bucket = {"MachineID": machine_id, "BucketStart": start, "Count": 0, "LastAt": None}
+    for name in TELEMETRY_SCHEMA.columns:
+        bucket.update({f"{name}Count": 0, f"{name}Sum": 0.0, f"{name}Min": None, f"{name}Max": None, f"{name}Last": None})
+    return bucket
+
+
+def rollup_batch(rows: List[Dict[str, Any]], step: int) -> List[Dict[str, Any]]:
+    """Partial aggregates of a telemetry batch, one per (machine, bucket)."""
+    buckets: Dict[Tuple[int, datetime], Dict[str, Any]] = {}
+    # Timestamp of each bucket's current *Last value, per column
+    last_at: Dict[Tuple[int, datetime], Dict[str, datetime]] = {}
+    columns = TELEMETRY_SCHEMA.columns
+    for row in rows:
+        timestamp = row.get("Timestamp")
+        if timestamp is None:
+            continue
+        key = (row["MachineID"], align(timestamp, step))
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = _empty_bucket(*key)
+            last_at[key] = {}
+        bucket["Count"] += 1
+        if bucket["LastAt"] is None or timestamp >= bucket["LastAt"]:
+            bucket["LastAt"] = timestamp
+
+        seen = last_at[key]
+        for name in columns:
+            value = row.get(name)
+            if value is None:
+                continue
+            bucket[f"{name}Count"] += 1
+            bucket[f"{name}Sum"] += value
+            low, high = bucket[f"{name}Min"], bucket[f"{name}Max"]
+            bucket[f"{name}Min"] = value if low is None else min(low, value)
+            bucket[f"{name}Max"] = value if high is None else max(high, value)
+            if name not in seen or timestamp >= seen[name]:
+                seen[name] = timestamp
+                bucket[f"{name}Last"] = value
+    return list(buckets.values())
+
+
+def coarsen(buckets: List[Dict[str, Any]], step: int) -> List[Dict[str, Any]]:
+    """Merges partial aggregates into coarser buckets, e.g. 1m into 1h.
+
+    Finer buckets are disjoint in time, so the last value of a coarse bucket is
+    the one of its latest fine bucket that has one.
+    """
+    merged: Dict[Tuple[int, datetime], Dict[str, Any]] = {}
+    columns = TELEMETRY_SCHEMA.columns
+    for fine in sorted(buckets, key=lambda bucket: bucket["BucketStart"]):
+        key = (fine["MachineID"], align(fine["BucketStart"], step))
+        bucket = merged.get(key)
+        if bucket is None:
+            merged[key] = {**fine, "BucketStart": key[1]}
+            continue
+        bucket["Count"] += fine["Count"]
+        bucket["LastAt"] = max(bucket["LastAt"], fine["LastAt"])
+        for name in columns:
+            if not fine[f"{name}Count"]:
+                continue
+            bucket[f"{name}Count"] += fine[f"{name}Count"]
+            bucket[f"{name}Sum"] += fine[f"{name}Sum"]
+            low, high = bucket[f"{name}Min"], bucket[f"{name}Max"]
+            bucket[f"{name}Min"] = fine[f"{name}Min"] if low is None else min(low, fine[f"{name}Min"])
+            bucket[f"{name}Max"] = fine[f"{name}Max"] if high is None else max(high, fine[f"{name}Max"])
+            bucket[f"{name}Last"] = fine[f"{name}Last"]
+    return list(merged.values())
+
+
+def _merge_statement(table):
+    """Upsert that merges a partial aggregate into the stored one."""
+    stmt = insert(table)
+    new, old = stmt.inserted, table.c
+    updates = [("Count", old.Count + new.Count)]
+    for name in TELEMETRY_SCHEMA.columns:
+        count, total, low, high, last = (f"{name}{part}" for part in ("Count", "Sum", "Min", "Max", "Last"))
+        updates += [
+            (count, old[count] + new[count]),
+            (total, old[total] + new[total]),
+            (low, func.least(func.coalesce(old[low], new[low]), func.coalesce(new[low], old[low]))),
+            (high, func.greatest(func.coalesce(old[high], new[high]), func.coalesce(new[high], old[high]))),
+            (last, case(
+                (new[last].is_not(None) & (old.LastAt.is_(None) | (new.LastAt >= old.LastAt)), new[last]),
+                else_=old[last],
+            )),
+        ]
+    # MySQL applies assignments left to right, so LastAt must come after the *Last columns
+    updates.append(("LastAt", func.greatest(func.coalesce(old.LastAt, new.LastAt), new.LastAt)))
+    return stmt.on_duplicate_key_update(updates)
+
+
+ROLLUP_MERGES = [(step, _merge_statement(model.__table__)) for step, model in ROLLUPS]
+
+
+async def update_rollups(conn: AsyncConnection, rows: List[Dict[str, Any]], chunk_size: int = 1000) -> int:
+    """Folds a telemetry batch into every rollup level; returns the rollup rows touched.
+
+    Raw rows are only aggregated once, into the finest level; each coarser level
+    is built from the one below it.
+    """
+    chunk_size = max(1, chunk_size)
+    touched = 0
+    buckets: List[Dict[str, Any]] = []
+    for level, (step, merge) in enumerate(ROLLUP_MERGES):
+        buckets = rollup_batch(rows, step) if level == 0 else coarsen(buckets, step)
+        for start in range(0, len(buckets), chunk_size):
+            await conn.execute(merge, buckets[start:start + chunk_size])
+        touched += len(buckets)
+    return touched
+
+
+async def prune_rollup(conn: AsyncConnection, table: str, cutoff: datetime, batch: int = 10000) -> int:
+    """Deletes a rollup table's buckets that start before ``cutoff``, committing each batch.
+
+    Runs machine by machine so every DELETE is a range of the primary key.
+    """
+    result = await conn.execute(text(f"SELECT DISTINCT `MachineID` FROM `{table}`"))
+    machine_ids = [row[0] for row in result.all()]
+    delete = text(
+        f"DELETE FROM `{table}` WHERE `MachineID` = :machine_id AND `BucketStart` < :cutoff LIMIT {batch}"
+    )
+    deleted = 0
+    for machine_id in machine_ids:
+        while True:
+            result = await conn.execute(delete, {"machine_id": machine_id, "cutoff": cutoff})
+            await conn.commit()
+            deleted += result.rowcount
+            if result.rowcount < batch:
+                break
+    return deleted
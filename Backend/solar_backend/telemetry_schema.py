@@ -0,0 +1,121 @@
+"""Declarative registry of the fields machines report over MQTT.
+
+Each field has a canonical name (the DB column / API field), a type and the
+device keys it may arrive under. The registry is compiled once into a flat
+``key -> (name, converter)`` map, so extracting a payload costs one dict lookup
+per key. Ingest uses it to fill typed Telemetry columns and the live state, and
+the read endpoints use a compiled view of it to project cached state onto their
+response models.
+"""
+import math
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Tuple
+
+
+class TelemetryField(NamedTuple):
+    name: str
+    type: type
+    aliases: Tuple[str, ...] = ()
+    column: bool = False  # stored in its own Telemetry column
+
+
+def _to_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def _to_float(value: Any) -> float:
+    number = float(value)
+    # "nan"/"inf" parse as floats, but MySQL cannot store them
+    if not math.isfinite(number):
+        raise ValueError(f"non-finite value {value!r}")
+    return number
+
+
+def _to_int(value: Any) -> int:
+    return int(float(value)) if isinstance(value, str) else int(value)
+
+
+CONVERTERS: Dict[type, Callable[[Any], Any]] = {
+    float: _to_float,
+    int: _to_int,
+    bool: _to_bool,
+    str: str,
+}
+
+TELEMETRY_FIELDS = (
+    TelemetryField("BatteryLevel", float, ("battery", "battery_level"), column=True),
+    TelemetryField("BatteryVoltage", float, ("battery_v", "battery_voltage"), column=True),
+    TelemetryField("SolarVoltage", float, ("solar_v", "solar_voltage"), column=True),
+    TelemetryField("SolarCurrent", float, ("solar_a", "solar_current"), column=True),
+    TelemetryField("WaterLevel", float, ("water", "water_level"), column=True),
+    TelemetryField("BrushRPM", int, ("brush_rpm", "rpm"), column=True),
+    TelemetryField("BrushTemp", float, ("brush_temp",), column=True),
+    TelemetryField("Speed", float, ("speed",), column=True),
+    TelemetryField("AreaToday", float, ("area_today",), column=True),
+    TelemetryField("Mode", str, ("mode",)),
+    TelemetryField("Timer", int, ("timer",)),
+    TelemetryField("IsCharging", bool, ("charging", "is_charging")),
+    TelemetryField("PumpStatus", bool, ("pump", "pump_status")),
+    TelemetryField("IsBrushJam", bool, ("brush_jam", "is_brush_jam")),
+    TelemetryField("Direction", float, ("direction", "heading")),
+    TelemetryField("EmergencyStop", bool, ("estop", "emergency_stop")),
+    TelemetryField("ObstacleDetected", bool, ("obstacle", "obstacle_detected")),
+    TelemetryField("CleaningTime", int, ("cleaning_time",)),
+    TelemetryField("TotalCycles", int, ("total_cycles", "cycles")),
+)
+
+# Status messages reuse short keys like "water" with a different meaning
+STATUS_FIELDS = (
+    TelemetryField("Status", str, ("status",)),
+    TelemetryField("EnergyValue", float, ("energy",)),
+    TelemetryField("WaterValue", float, ("water",)),
+    TelemetryField("AreaValue", float, ("area",)),
+)
+
+
+class CompiledSchema:
+    """A field set compiled into a single lookup table."""
+
+    def __init__(self, fields: Iterable[TelemetryField], aliases: bool = True):
+        self.fields = tuple(fields)
+        self.columns = tuple(f.name for f in self.fields if f.column)
+        self.column_set = frozenset(self.columns)
+        self.key_map: Dict[str, Tuple[str, Callable[[Any], Any]]] = {}
+        for f in self.fields:
+            keys = {f.name, f.name.lower(), *(f.aliases if aliases else ())}
+            for key in keys:
+                self.key_map[key] = (f.name, CONVERTERS[f.type])
+
+    def extract(self, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Splits a payload into typed known fields and untouched unknown keys.
+
+        Values that cannot be converted to the field type are kept as unknown.
+        """
+        known: Dict[str, Any] = {}
+        unknown: Dict[str, Any] = {}
+        lookup = self.key_map.get
+        for key, value in payload.items():
+            spec = lookup(key)
+            if spec is None:
+                unknown[key] = value
+                continue
+            name, convert = spec
+            if value is None:
+                known[name] = None
+                continue
+            try:
+                known[name] = convert(value)
+            except (TypeError, ValueError, OverflowError):
+                unknown[key] = value
+        return known, unknown
+
+
+TELEMETRY_SCHEMA = CompiledSchema(TELEMETRY_FIELDS)
+STATUS_SCHEMA = CompiledSchema(STATUS_FIELDS)
+
+
+def compile_view(names: Iterable[str]) -> CompiledSchema:
+    """Compiles the live-state fields (canonical names only) that appear in ``names``."""
+    names = set(names)
+    return CompiledSchema([f for f in STATUS_FIELDS + TELEMETRY_FIELDS if f.name in names], aliases=False)
@@ -0,0 +1,266 @@
+import os
+import asyncio
+import logging
+import itertools
+from pathlib import Path
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Awaitable, Callable, IO, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows dev setups run a single worker
+    fcntl = None
+
+from . import serialization
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "telemetry-"
+SEGMENT_SUFFIX = ".log"
+SLOT_PREFIX = "worker-"
+QUARANTINE_DIR = "quarantine"
+
+
+def _try_lock(directory: Path) -> Optional[IO]:
+    lock = open(directory / ".lock", "w")
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return lock
+    except OSError:
+        lock.close()
+        return None
+
+
+def _claim_slot(root: Path) -> Tuple[Path, Optional[IO]]:
+    """Claims the lowest spool slot not held by another live worker process."""
+    for slot in itertools.count():
+        directory = root / f"{SLOT_PREFIX}{slot}"
+        directory.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            return directory, None
+        lock = _try_lock(directory)
+        if lock:
+            return directory, lock
+
+
+class SpoolSegment:
+    """A closed spool file plus, while memory allows, its rows kept in RAM."""
+
+    def __init__(self, path: Path, rows: Optional[List[Dict[str, Any]]] = None):
+        self.path = path
+        self.rows = rows
+
+
+def _encode_row(row: Dict[str, Any]) -> str:
+    return serialization.dumps(row) + "\n"
+
+
+def _read_segment(path: Path) -> List[Dict[str, Any]]:
+    """Rows of a segment file; undecodable lines (e.g. a torn write from a crash) are skipped."""
+    rows = []
+    skipped = 0
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                skipped += 1  # partial record at the end of the file
+                continue
+            try:
+                row = serialization.loads(line)
+                if row.get("Timestamp"):
+                    row["Timestamp"] = datetime.fromisoformat(row["Timestamp"])
+            except (ValueError, TypeError, AttributeError):
+                skipped += 1
+                continue
+            rows.append(row)
+    if skipped:
+        logger.warning(f"Spool: skipped {skipped} undecodable line(s) in {path.name}")
+    return rows
+
+
+def _sync_files(files: List[IO]):
+    for f in files:
+        os.fsync(f.fileno())
+        f.close()
+
+
+def _write_quarantine(path: Path, rows: List[Dict[str, Any]]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(_encode_row(row) for row in rows)
+
+
+class TelemetrySpool:
+    """Append-only, segment-rotated write-ahead log for buffered telemetry.
+
+    Every row is written through to the active segment file before it joins the
+    in-memory batch, so it survives a crash of the process; segments are
+    fsynced, off the event loop, before their rows are sent to the database.
+    Sealed segments are deleted only after their rows were committed, so a crash
+    or redeploy loses nothing: segments left on disk are replayed on the next
+    start (at-least-once, a crash between commit and delete can insert a segment
+    twice).
+
+    In-memory copies are capped at ``max_memory_rows``. Beyond that, and after a
+    failed flush, rows live on disk only and are read back one segment at a time,
+    so a database outage fills disk segments rather than RAM.
+
+    Rows the database rejects for good (e.g. a value out of range) would block
+    every later segment, so a rejected segment is written again in halves until
+    only the offending rows are left; those are moved to ``quarantine/``.
+
+    Each worker process locks its own ``worker-N`` slot under ``directory``, so
+    several uvicorn workers can share one storage volume. Segments of slots whose
+    owner is gone (e.g. after scaling down) are adopted on startup.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int, max_memory_rows: int):
+        root = Path(directory)
+        self.directory, self._lock = _claim_slot(root)
+        self.segment_bytes = segment_bytes
+        self.max_memory_rows = max_memory_rows
+
+        # Segments left by a previous process are replayed from disk first
+        existing = sorted(self.directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}"))
+        self._next_seq = int(existing[-1].stem[len(SEGMENT_PREFIX):]) + 1 if existing else 0
+        existing += self._adopt_orphans(root)
+
+        self.pending: List[SpoolSegment] = [SpoolSegment(path) for path in existing]
+        if self.pending:
+            logger.warning(f"Spool: replaying {len(self.pending)} telemetry segment(s) from {self.directory}")
+
+        self._file = None
+        self._unsynced: List[IO] = []  # sealed segment files not fsynced yet
+        self._active_path: Optional[Path] = None
+        self._active_rows: Optional[List[Dict[str, Any]]] = None
+        self._active_bytes = 0
+        self.memory_rows = 0
+
+    def _adopt_orphans(self, root: Path) -> List[Path]:
+        """Moves segments of unowned slots into this worker's slot."""
+        if fcntl is None:
+            return []
+        adopted = []
+        for directory in sorted(root.glob(f"{SLOT_PREFIX}*")):
+            if directory == self.directory or not directory.is_dir():
+                continue
+            lock = _try_lock(directory)
+            if not lock:
+                continue
+            try:
+                for path in sorted(directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}")):
+                    target = self.directory / f"{SEGMENT_PREFIX}{self._next_seq:012d}{SEGMENT_SUFFIX}"
+                    self._next_seq += 1
+                    path.rename(target)
+                    adopted.append(target)
+            finally:
+                lock.close()
+        return adopted
+
+    def _open_segment(self):
+        self._active_path = self.directory / f"{SEGMENT_PREFIX}{self._next_seq:012d}{SEGMENT_SUFFIX}"
+        self._next_seq += 1
+        self._file = open(self._active_path, "a", encoding="utf-8")
+        self._active_rows = []
+        self._active_bytes = 0
+
+    def append(self, row: Dict[str, Any]):
+        """Writes one row through to the OS (not fsynced); rotates the segment once it is full."""
+        if self._file is None:
+            self._open_segment()
+
+        line = _encode_row(row)
+        self._file.write(line)
+        self._file.flush()
+        self._active_bytes += len(line)
+
+        if self._active_rows is not None:
+            if self.memory_rows < self.max_memory_rows:
+                self._active_rows.append(row)
+                self.memory_rows += 1
+            else:
+                # Memory cap reached: this segment will be read back from disk
+                self.memory_rows -= len(self._active_rows)
+                self._active_rows = None
+
+        if self._active_bytes >= self.segment_bytes:
+            self.seal()
+
+    def seal(self):
+        """Ends the active segment and queues it for flushing; ``sync`` fsyncs it."""
+        if self._file is None:
+            return
+        self._unsynced.append(self._file)
+        self.pending.append(SpoolSegment(self._active_path, self._active_rows))
+        self._file = None
+        self._active_path = None
+        self._active_rows = None
+
+    async def sync(self):
+        """Fsyncs and closes the sealed segment files in a thread."""
+        files, self._unsynced = self._unsynced, []
+        if files:
+            await asyncio.to_thread(_sync_files, files)
+
+    def buffered_rows(self) -> int:
+        return self.memory_rows
+
+    def _drop_memory(self, segment: SpoolSegment):
+        if segment.rows is not None:
+            self.memory_rows -= len(segment.rows)
+            segment.rows = None
+
+    async def _write_accepted(self, writer: Callable[[List[Dict[str, Any]]], Awaitable[int]],
+                              rows: List[Dict[str, Any]], rejected_errors: Tuple[type, ...],
+                              rejected: List[Dict[str, Any]]) -> int:
+        """Writes ``rows``, bisecting on rejection; rows rejected on their own go to ``rejected``."""
+        try:
+            return await writer(rows)
+        except rejected_errors as e:
+            if len(rows) == 1:
+                logger.error(f"Spool: quarantining a telemetry row the database rejected: {e}")
+                rejected.append(rows[0])
+                return 0
+        middle = len(rows) // 2
+        written = await self._write_accepted(writer, rows[:middle], rejected_errors, rejected)
+        return written + await self._write_accepted(writer, rows[middle:], rejected_errors, rejected)
+
+    async def drain(self, writer: Callable[[List[Dict[str, Any]]], Awaitable[int]],
+                    rejected_errors: Tuple[type, ...] = ()) -> int:
+        """Writes sealed segments oldest-first and deletes each one once committed.
+
+        ``rejected_errors`` are the writer errors that retrying will not fix; rows
+        raising them are quarantined instead of holding up the spool. Any other
+        error stops the drain: the remaining segments stay on disk and their
+        in-memory copies are released so an outage cannot grow RAM.
+        """
+        await self.sync()
+        written = 0
+        while self.pending:
+            segment = self.pending[0]
+            try:
+                rows = segment.rows if segment.rows is not None else await asyncio.to_thread(_read_segment, segment.path)
+                if rows:
+                    rejected: List[Dict[str, Any]] = []
+                    written += await self._write_accepted(writer, rows, rejected_errors, rejected)
+                    if rejected:
+                        quarantine = self.directory / QUARANTINE_DIR / segment.path.name
+                        await asyncio.to_thread(_write_quarantine, quarantine, rejected)
+                        logger.error(f"Spool: {len(rejected)} rejected row(s) of {segment.path.name} moved to {quarantine}")
+            except Exception:
+                for pending in self.pending:
+                    self._drop_memory(pending)
+                raise
+            self._drop_memory(segment)
+            self.pending.pop(0)
+            segment.path.unlink(missing_ok=True)
+        return written
+
+    def close(self):
+        if self._file is not None:
+            self._unsynced.append(self._file)
+            self._file = None
+        _sync_files(self._unsynced)
+        self._unsynced = []
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
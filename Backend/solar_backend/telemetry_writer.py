@@ -0,0 +1,101 @@
+import os
+import json
+import asyncio
+import logging
+import tempfile
+from datetime import datetime
+from typing import List, Dict, Any
+
+from sqlalchemy import insert, text
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from .models.telemetry import Telemetry
+from .telemetry_rollup import update_rollups
+from .telemetry_schema import TELEMETRY_SCHEMA
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Column order used by both the Core insert and the LOAD DATA file layout
+TELEMETRY_COLUMNS = ("MachineID", *TELEMETRY_SCHEMA.columns, "AdditionalData", "Timestamp")
+
+telemetry_insert = insert(Telemetry.__table__)
+
+# Errors the database raises for a row on every attempt (bad values, broken references):
+# retrying cannot fix them. Anything else, including bugs here, keeps the spool segment.
+REJECTED_ERRORS = (DataError, IntegrityError)
+
+
+async def insert_telemetry_rows(conn: AsyncConnection, rows: List[Dict[str, Any]], chunk_size: int = 1000) -> int:
+    """Inserts telemetry rows with Core executemany, one statement per chunk.
+
+    Skips the ORM unit of work entirely; the MySQL driver rewrites each chunk into
+    a single multi-row ``INSERT ... VALUES``.
+    """
+    chunk_size = max(1, chunk_size)
+    for start in range(0, len(rows), chunk_size):
+        await conn.execute(telemetry_insert, rows[start:start + chunk_size])
+    return len(rows)
+
+
+def _infile_value(value: Any) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def _write_infile(rows: List[Dict[str, Any]]) -> str:
+    fd, path = tempfile.mkstemp(prefix="telemetry_", suffix=".tsv")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write("\t".join(_infile_value(row.get(col)) for col in TELEMETRY_COLUMNS))
+            f.write("\n")
+    return path
+
+
+async def load_telemetry_rows(conn: AsyncConnection, rows: List[Dict[str, Any]]) -> int:
+    """Loads telemetry rows through ``LOAD DATA LOCAL INFILE`` (MySQL only).
+
+    Needs ``local_infile`` enabled on both the server and the client connection.
+    """
+    path = await asyncio.to_thread(_write_infile, rows)
+    try:
+        columns = ", ".join(f"`{col}`" for col in TELEMETRY_COLUMNS)
+        await conn.execute(text(
+            f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE `{Telemetry.__tablename__}` "
+            f"CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({columns})"
+        ))
+    finally:
+        os.remove(path)
+    return len(rows)
+
+
+async def write_telemetry(engine: AsyncEngine, rows: List[Dict[str, Any]]) -> int:
+    """Persists a telemetry batch in one transaction using the fastest enabled path.
+
+    Batches at or above ``TELEMETRY_LOAD_DATA_THRESHOLD`` use LOAD DATA when it is
+    enabled, falling back to chunked Core inserts if the server refuses it. The
+    rollup tables are updated from the same batch inside the same transaction.
+    """
+    if not rows:
+        return 0
+
+    threshold = settings.TELEMETRY_LOAD_DATA_THRESHOLD
+    if threshold > 0 and len(rows) >= threshold and engine.dialect.name == "mysql":
+        try:
+            async with engine.begin() as conn:
+                saved = await load_telemetry_rows(conn, rows)
+                await update_rollups(conn, rows, settings.TELEMETRY_INSERT_CHUNK_SIZE)
+                return saved
+        except Exception as e:
+            logger.warning(f"LOAD DATA LOCAL INFILE failed, falling back to bulk insert: {e}")
+
+    async with engine.begin() as conn:
+        saved = await insert_telemetry_rows(conn, rows, settings.TELEMETRY_INSERT_CHUNK_SIZE)
+        await update_rollups(conn, rows, settings.TELEMETRY_INSERT_CHUNK_SIZE)
+        return saved
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from collections import deque, OrderedDict
+from typing import Any, Deque, Dict, Hashable, Optional, Tuple
+
+from fastapi import WebSocket
+
+from .ws_encoding import JSON, Frame
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_CONFLATE = "conflate"
+OVERFLOW_DISCONNECT = "disconnect"
+
+# Close code sent to evicted slow consumers ("Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class WebSocketClient:
+    """One WebSocket with a bounded outbound queue drained by its own writer task.
+
+    Broadcasts only enqueue frames, so a slow client never stalls a fan-out.
+    When the queue is full the overflow policy decides what happens:
+
+    * ``conflate``: the queue collapses to the latest frame per key (machine),
+      so the client skips intermediate updates but still converges on the
+      current state. Frames that can combine with the one they replace (a
+      ``merge(newer)`` method, as on batch frames) are merged instead. Normal
+      FIFO delivery resumes once it has caught up.
+    * ``disconnect``: the client is evicted and closed with code 1013.
+    """
+
+    def __init__(self, websocket: WebSocket, max_queue: int, overflow_policy: str, encoding: str = JSON):
+        self.websocket = websocket
+        self.encoding = encoding
+        self.max_queue = max(1, max_queue)
+        self.overflow_policy = overflow_policy
+        self.queue: Deque[Tuple[Optional[Hashable], Any]] = deque()
+        self.conflated: Optional["OrderedDict[Hashable, Any]"] = None
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.close_code: Optional[int] = None
+        self.writer_task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.sent = 0
+        self.conflated_frames = 0
+        self.peak_depth = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self.conflated) if self.conflated is not None else len(self.queue)
+
+    def start(self):
+        self.writer_task = asyncio.create_task(self._writer())
+
+    def enqueue(self, frame: Any, key: Optional[Hashable] = None) -> bool:
+        """Queues a frame; returns False if the client is closed or was just evicted.
+
+        ``key`` identifies what the frame describes (normally the machine id) and
+        is what conflation collapses on; frames without a key are never merged.
+        """
+        if self.closed:
+            return False
+
+        if self.conflated is not None:
+            self._conflate(key, frame)
+        elif len(self.queue) >= self.max_queue:
+            if self.overflow_policy == OVERFLOW_DISCONNECT:
+                logger.warning(f"WS: Evicting slow consumer after {self.max_queue} queued frames")
+                self.close(SLOW_CONSUMER_CLOSE_CODE)
+                return False
+            self.conflated = OrderedDict()
+            for queued_key, queued_frame in self.queue:
+                self._conflate(queued_key, queued_frame)
+            self.queue.clear()
+            self._conflate(key, frame)
+        else:
+            self.queue.append((key, frame))
+
+        depth = self.depth
+        if depth > self.peak_depth:
+            self.peak_depth = depth
+        self.wakeup.set()
+        return True
+
+    def enqueue_first(self, frame: Any):
+        """Puts a frame ahead of everything already queued (e.g. an initial snapshot)."""
+        if self.closed:
+            return
+        if self.conflated is not None:
+            key = object()
+            self.conflated[key] = frame
+            self.conflated.move_to_end(key, last=False)
+        else:
+            self.queue.appendleft((None, frame))
+        self.wakeup.set()
+
+    def _conflate(self, key: Optional[Hashable], frame: Any):
+        if key is None:
+            key = object()
+        elif key in self.conflated:
+            self.conflated_frames += 1
+            merge = getattr(self.conflated[key], "merge", None)
+            if merge is not None:
+                frame = merge(frame)
+        self.conflated[key] = frame
+
+    def _next_frame(self) -> Any:
+        if self.conflated is not None:
+            _, frame = self.conflated.popitem(last=False)
+            if not self.conflated:
+                self.conflated = None
+            return frame
+        return self.queue.popleft()[1]
+
+    async def send(self, frame: Any):
+        if not isinstance(frame, (str, bytes)):
+            frame = frame.to_frame()  # encoded on send, e.g. a batch that may still merge
+        if isinstance(frame, bytes):
+            await self.websocket.send_bytes(frame)
+        else:
+            await self.websocket.send_text(frame)
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while not self.closed and self.depth:
+                    await self.send(self._next_frame())
+                    self.sent += 1
+        except Exception:
+            self.closed = True
+        if self.close_code is not None:
+            try:
+                await self.websocket.close(code=self.close_code)
+            except Exception:
+                pass
+
+    def close(self, code: Optional[int] = None):
+        """Stops the writer; with a code, the socket is closed once it exits."""
+        if self.closed:
+            return
+        self.closed = True
+        self.close_code = code
+        self.queue.clear()
+        self.conflated = None
+        self.wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "peak_depth": self.peak_depth,
+            "max_queue": self.max_queue,
+            "sent": self.sent,
+            "conflated_frames": self.conflated_frames,
+            "conflating": self.conflated is not None,
+            "overflow_policy": self.overflow_policy,
+            "encoding": self.encoding,
+        }
@@ -0,0 +1,89 @@
+"""Wire encodings for realtime WebSocket frames.
+
+* ``json``: text frames, the default.
+* ``msgpack``: binary MessagePack frames (needs the optional ``msgpack`` package).
+* ``deflate``: binary frames holding zlib-compressed JSON.
+
+``deflate`` exists next to the transport-level permessage-deflate extension
+(which uvicorn negotiates by itself when a client offers it) because that one
+compresses every frame again for every socket, while an application-level
+encoding is compressed once per message and shared by all subscribers.
+
+Clients pick an encoding with ``?encoding=`` or the ``solar.<encoding>``
+WebSocket subprotocol.
+"""
+import zlib
+from datetime import datetime, date
+from typing import Any, Iterable, Optional, Tuple, Union
+
+from . import serialization
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+DEFLATE = "deflate"
+
+ENCODINGS = (JSON, MSGPACK, DEFLATE) if msgpack is not None else (JSON, DEFLATE)
+SUBPROTOCOL_PREFIX = "solar."
+
+DEFLATE_LEVEL = 6
+# Largest decompressed client frame; control messages (a subscribe listing
+# WS_MAX_SUBSCRIPTIONS machines) stay far below it, a decompression bomb does not
+MAX_CONTROL_BYTES = 64 * 1024
+
+Frame = Union[str, bytes]
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not MessagePack serializable")
+
+
+def encode(message: Any, encoding: str) -> Frame:
+    if encoding == MSGPACK:
+        return msgpack.packb(message, default=_msgpack_default)
+    if encoding == DEFLATE:
+        return zlib.compress(serialization.dumpb(message), DEFLATE_LEVEL)
+    return serialization.dumps(message)
+
+
+def transcode(json_frame: str, encoding: str) -> Frame:
+    """Re-encodes an already encoded JSON frame, decoding it only when needed."""
+    if encoding == DEFLATE:
+        return zlib.compress(json_frame.encode(), DEFLATE_LEVEL)
+    if encoding == MSGPACK:
+        return encode(serialization.loads(json_frame), MSGPACK)
+    return json_frame
+
+
+def decode(frame: Frame, encoding: str) -> Any:
+    """Decodes a frame sent by a client in its negotiated encoding (text is always JSON)."""
+    if isinstance(frame, str):
+        return serialization.loads(frame)
+    if encoding == MSGPACK:
+        return msgpack.unpackb(frame)
+    if encoding == DEFLATE:
+        inflater = zlib.decompressobj()
+        data = inflater.decompress(frame, MAX_CONTROL_BYTES)
+        if inflater.unconsumed_tail:
+            raise ValueError(f"Client frame inflates beyond {MAX_CONTROL_BYTES} bytes")
+        return serialization.loads(data)
+    return serialization.loads(frame)
+
+
+def negotiate(requested: Optional[str], subprotocols: Iterable[str]) -> Tuple[str, Optional[str]]:
+    """Picks the encoding from the query parameter or the offered subprotocols.
+
+    Returns ``(encoding, subprotocol to accept)``; unknown requests fall back to JSON.
+    """
+    if requested in ENCODINGS:
+        return requested, None
+    for subprotocol in subprotocols:
+        if subprotocol.startswith(SUBPROTOCOL_PREFIX) and subprotocol[len(SUBPROTOCOL_PREFIX):] in ENCODINGS:
+            return subprotocol[len(SUBPROTOCOL_PREFIX):], subprotocol
+    return JSON, None
@@ -0,0 +1,86 @@
+import asyncio
+import time
+import logging
+from typing import Dict, List, Optional, Set
+
+from .ws_client import WebSocketClient
+from .ws_encoding import ENCODINGS, Frame, encode
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT = {"type": "heartbeat"}
+
+
+class HeartbeatWheel:
+    """One timer wheel that keeps every WebSocket of the process alive.
+
+    Clients are spread over ``slots`` buckets; a single task visits one bucket
+    per tick, so each client is checked once per ``interval`` and the work is
+    spread evenly instead of every socket owning a sleeping task. A client gets
+    the pre-encoded heartbeat frame queued only if no other frame was sent or
+    queued to it since its previous visit; live traffic already keeps it alive.
+    """
+
+    def __init__(self, interval: float, slots: int = 50):
+        self.interval = interval
+        self.slot_count = max(1, slots)
+        # Encoded once per wire encoding
+        self.frames: Dict[str, Frame] = {encoding: encode(HEARTBEAT, encoding) for encoding in ENCODINGS}
+        self.slots: List[Set[WebSocketClient]] = [set() for _ in range(self.slot_count)]
+        self.slot_of: Dict[WebSocketClient, int] = {}
+        # Frames sent + queued per client at its last visit, to detect traffic since
+        self.activity: Dict[WebSocketClient, int] = {}
+        self.cursor = 0
+        self.next_slot = 0
+        self.task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.sent = 0
+        self.skipped = 0
+
+    def add(self, client: WebSocketClient):
+        # Round robin, so a reconnect storm does not end up in a single bucket
+        slot = self.next_slot
+        self.next_slot = (slot + 1) % self.slot_count
+        self.slots[slot].add(client)
+        self.slot_of[client] = slot
+        self.activity[client] = client.sent + client.depth
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def discard(self, client: WebSocketClient):
+        slot = self.slot_of.pop(client, None)
+        self.activity.pop(client, None)
+        if slot is not None:
+            self.slots[slot].discard(client)
+
+    def tick(self):
+        """Processes the bucket under the cursor and advances it."""
+        bucket = self.slots[self.cursor]
+        self.cursor = (self.cursor + 1) % self.slot_count
+        if not bucket:
+            return
+
+        for client in list(bucket):
+            if client.closed:
+                self.discard(client)
+                continue
+            activity = client.sent + client.depth
+            if activity != self.activity.get(client):
+                self.activity[client] = activity
+                self.skipped += 1
+            elif client.enqueue(self.frames[client.encoding]):
+                # The heartbeat itself is not traffic
+                self.activity[client] = activity + 1
+                self.sent += 1
+
+    async def run(self):
+        step = self.interval / self.slot_count
+        next_tick = time.monotonic()
+        while self.slot_of:
+            next_tick += step
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Heartbeat tick failed: {e}")
@@ -0,0 +1,258 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, FrozenSet, Hashable, List, Optional, Tuple
+
+from . import serialization
+from .ws_client import WebSocketClient
+from .ws_encoding import JSON, Frame, encode, transcode
+
+
+class RealtimeUpdate:
+    """An update message whose frame is encoded at most once, on first use.
+
+    Updates relayed from another worker start from the encoded frame instead,
+    and are only decoded if a rate-limited stream needs to merge them.
+    """
+
+    __slots__ = ("_message", "_frame", "_encoded")
+
+    def __init__(self, message: Optional[Dict[str, Any]] = None, frame: Optional[str] = None):
+        self._message = message
+        self._frame = frame
+        self._encoded: Optional[Dict[str, Frame]] = None
+
+    @property
+    def message(self) -> Dict[str, Any]:
+        if self._message is None:
+            self._message = serialization.loads(self._frame)
+        return self._message
+
+    @property
+    def frame(self) -> str:
+        if self._frame is None:
+            self._frame = serialization.dumps(self._message)
+        return self._frame
+
+    def encoded(self, encoding: str) -> Frame:
+        """The frame in a wire encoding, produced once per encoding."""
+        if encoding == JSON:
+            return self.frame
+        if self._encoded is None:
+            self._encoded = {}
+        frame = self._encoded.get(encoding)
+        if frame is None:
+            frame = self._encoded[encoding] = transcode(self.frame, encoding)
+        return frame
+
+    def merge(self, newer: "RealtimeUpdate") -> "RealtimeUpdate":
+        """Returns a snapshot of this update with the newer one applied on top."""
+        message = merge_messages(self.message, newer.message)
+        return newer if message is newer.message else RealtimeUpdate(message)
+
+
+def merge_messages(older: Dict[str, Any], newer: Dict[str, Any]) -> Dict[str, Any]:
+    """The newer message with the older one's data fields it does not override."""
+    data, newer_data = older.get("data"), newer.get("data")
+    if isinstance(data, dict) and isinstance(newer_data, dict):
+        return {**newer, "data": {**data, **newer_data}}
+    return newer
+
+
+class BatchFrame:
+    """A ``{"type": "batch"}`` frame, encoded once on first send.
+
+    All of a stream's batches are queued under the same key, so a client that
+    falls behind merges its pending batches per machine instead of piling them up.
+    """
+
+    __slots__ = ("updates", "encoding", "_frame")
+
+    def __init__(self, updates: Dict[Hashable, Dict[str, Any]], encoding: str):
+        self.updates = updates
+        self.encoding = encoding
+        self._frame: Optional[Frame] = None
+
+    def merge(self, newer: "BatchFrame") -> "BatchFrame":
+        updates = dict(self.updates)
+        for key, message in newer.updates.items():
+            older = updates.get(key)
+            updates[key] = merge_messages(older, message) if older is not None else message
+        return BatchFrame(updates, self.encoding)
+
+    def to_frame(self) -> Frame:
+        if self._frame is None:
+            self._frame = encode({"type": "batch", "updates": list(self.updates.values())}, self.encoding)
+        return self._frame
+
+
+# (seconds between frames, delta encoded, wire encoding, field subset or None for all):
+# subscribers with the same profile share a stream
+StreamProfile = Tuple[float, bool, str, Optional[FrozenSet[str]]]
+
+_MISSING = object()
+
+
+class DeltaState:
+    """What a delta stream has sent so far for one key."""
+
+    __slots__ = ("header", "fields", "seq", "keyframe_at")
+
+    def __init__(self):
+        self.header: Dict[str, Any] = {}
+        self.fields: Dict[str, Any] = {}
+        self.seq = 0
+        self.keyframe_at = 0.0
+
+
+class UpdateStream:
+    """Delivers updates for one target to the subscribers that share a profile.
+
+    With an interval of 0 every update is queued as it arrives. Otherwise updates
+    arriving between ticks are merged into the latest snapshot per key (message
+    type and machine), and each tick encodes every snapshot once for all of the
+    stream's subscribers. An idle stream sends the first update on the next loop
+    iteration, so sparse updates are not delayed.
+
+    A delta stream only sends the fields whose value differs from what it last
+    sent for that key, plus a full keyframe every ``keyframe_interval`` seconds.
+    Its frames carry ``seq`` (per key, +1 per frame) so a client that sees a gap,
+    e.g. after its queue was conflated, can ask for a resync.
+
+    With a field subset, ``data`` is cut down to those fields and updates that
+    carry none of them are not sent at all.
+
+    A batching stream sends everything collected during a tick as one
+    ``{"type": "batch", "updates": [...]}`` frame (latest update per key) instead
+    of a frame per key, so busy companies cost one frame per window.
+    """
+
+    def __init__(self, interval: float, on_dead: Callable[[WebSocketClient], None],
+                 delta: bool = False, keyframe_interval: float = 30.0, encoding: str = JSON,
+                 fields: Optional[FrozenSet[str]] = None, batch: bool = False):
+        self.interval = interval
+        self.on_dead = on_dead
+        self.delta = delta
+        self.encoding = encoding
+        self.fields = fields
+        self.batch = batch
+        self.keyframe_interval = keyframe_interval
+        self.clients: List[WebSocketClient] = []
+        self.pending: Dict[Hashable, RealtimeUpdate] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.last_emit = 0.0
+        self.sent_state: Dict[Hashable, DeltaState] = {}
+        self.batch_key = object()  # queue key shared by all of this stream's batch frames
+
+    def push(self, key: Optional[Hashable], update: RealtimeUpdate):
+        # Unkeyed updates cannot be merged with anything, so they are never held back
+        if self.interval <= 0 or key is None:
+            self._deliver(key, update)
+            return
+
+        previous = self.pending.get(key)
+        self.pending[key] = previous.merge(update) if previous is not None else update
+        if self.timer is None:
+            delay = max(0.0, self.last_emit + self.interval - time.monotonic())
+            self.timer = asyncio.get_running_loop().call_later(delay, self.emit)
+
+    def emit(self):
+        self.timer = None
+        self.last_emit = time.monotonic()
+        pending, self.pending = self.pending, {}
+        if self.batch:
+            self._deliver_batch(pending)
+            return
+        for key, update in pending.items():
+            self._deliver(key, update)
+
+    @classmethod
+    def from_profile(cls, profile: StreamProfile, on_dead: Callable[[WebSocketClient], None],
+                     keyframe_interval: float, batch: bool = False) -> "UpdateStream":
+        interval, delta, encoding, fields = profile
+        return cls(interval, on_dead, delta=delta, keyframe_interval=keyframe_interval,
+                   encoding=encoding, fields=fields, batch=batch)
+
+    def _render(self, key: Optional[Hashable], update: RealtimeUpdate) -> Any:
+        """What this stream sends for an update: None to skip it, the update itself
+        when it goes out unchanged, else the message to encode."""
+        # Only decode relayed updates when the stream has to look inside them
+        structured = (self.delta or self.fields is not None) and key is not None \
+            and isinstance(update.message.get("data"), dict)
+        if not structured:
+            return update
+        message = update.message
+        if self.fields is not None:
+            data = {field: value for field, value in message["data"].items() if field in self.fields}
+            if not data:
+                return None
+            message = {**message, "data": data}
+        if self.delta:
+            return self._delta_message(key, message)
+        return message
+
+    def _deliver(self, key: Optional[Hashable], update: RealtimeUpdate):
+        rendered = self._render(key, update)
+        if rendered is None:
+            return
+        frame = update.encoded(self.encoding) if rendered is update else encode(rendered, self.encoding)
+        self._enqueue(frame, key)
+
+    def _deliver_batch(self, pending: Dict[Hashable, RealtimeUpdate]):
+        updates = {}
+        for key, update in pending.items():
+            rendered = self._render(key, update)
+            if rendered is not None:
+                updates[key] = update.message if rendered is update else rendered
+        if updates:
+            self._enqueue(BatchFrame(updates, self.encoding), self.batch_key)
+
+    def _enqueue(self, frame: Any, key: Optional[Hashable]):
+        for client in [client for client in self.clients if not client.enqueue(frame, key)]:
+            self.on_dead(client)
+
+    def _delta_message(self, key: Hashable, message: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The fields that changed, or a keyframe when one is due; None if nothing changed."""
+        state = self.sent_state.get(key)
+        if state is None:
+            state = self.sent_state[key] = DeltaState()
+        data = message["data"]
+        state.header = {field: value for field, value in message.items() if field != "data"}
+
+        now = time.monotonic()
+        # The first frame of a key is always a keyframe, however recent the boot
+        keyframe = state.seq == 0 or now - state.keyframe_at >= self.keyframe_interval
+        if keyframe:
+            state.fields.update(data)
+            state.keyframe_at = now
+            # A copy: the frame may be encoded later (batches), after newer updates
+            changed = dict(state.fields)
+        else:
+            changed = {field: value for field, value in data.items() if state.fields.get(field, _MISSING) != value}
+            if not changed:
+                return None
+            state.fields.update(changed)
+
+        state.seq += 1
+        return {**state.header, "data": changed, "seq": state.seq, "keyframe": keyframe}
+
+    def resync(self, client: WebSocketClient):
+        """Queues a keyframe of every key to one client, without advancing ``seq``."""
+        for key, state in self.sent_state.items():
+            client.enqueue(encode(
+                {**state.header, "data": state.fields, "seq": state.seq, "keyframe": True}, self.encoding
+            ), key)
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.pending.clear()
+        self.sent_state.clear()
+
+
+def rate_interval(server_max_hz: float, requested_hz: Optional[float]) -> float:
+    """Seconds between frames for a subscriber; clients may only ask for less than the server max."""
+    hz = server_max_hz
+    if requested_hz is not None and requested_hz > 0:
+        hz = min(hz, requested_hz) if hz > 0 else requested_hz
+    return 1.0 / hz if hz > 0 else 0.0
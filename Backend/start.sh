@@ -12,4 +12,5 @@ echo "Database is up!"
 
 # Start the application
 echo "Starting Uvicorn..."
-exec uvicorn solar_backend.main:app --host 0.0.0.0 --port 8006 --proxy-headers --forwarded-allow-ips='*'
+# Several workers need MQTT_SHARED_GROUP set, otherwise every worker ingests every message
+exec uvicorn solar_backend.main:app --host 0.0.0.0 --port 8006 --workers ${UVICORN_WORKERS:-1} --proxy-headers --forwarded-allow-ips='*'
@@ -0,0 +1,86 @@
+import asyncio
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from solar_backend.ws_client import WebSocketClient
+from solar_backend.ws_heartbeat import HeartbeatWheel
+
+# === CONFIGURATION ===
+CONNECTIONS = 10000
+INTERVAL = 0.5  # shortened so a run covers several heartbeat rounds
+ROUNDS = 6
+PRODUCTION_INTERVAL = 5.0
+
+class IdleSocket:
+    """Accepts frames instantly, like an idle dashboard on a healthy link."""
+
+    def __init__(self):
+        self.frames = 0
+
+    async def send_text(self, frame):
+        self.frames += 1
+
+    async def close(self, code=1000):
+        pass
+
+async def legacy_keep_alive(client):
+    """The previous scheme: one sleeping task per socket, encoding every beat."""
+    while not client.closed:
+        await asyncio.sleep(INTERVAL)
+        client.enqueue(json.dumps({"type": "heartbeat"}))
+
+async def measure(name, start_heartbeats):
+    gc.collect()
+    clients = []
+    for _ in range(CONNECTIONS):
+        client = WebSocketClient(IdleSocket(), 256, "conflate")
+        client.start()
+        clients.append(client)
+    await asyncio.sleep(0)
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    stop = start_heartbeats(clients)
+    await asyncio.sleep(0)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    cpu_start = time.process_time()
+    await asyncio.sleep(INTERVAL * ROUNDS)
+    cpu = time.process_time() - cpu_start
+
+    frames = sum(client.websocket.frames for client in clients)
+    stop()
+    for client in clients:
+        client.close()
+    await asyncio.sleep(0)
+
+    per_round = cpu / ROUNDS
+    print(f"  {name:<28} {(after - before) / 1024:9.0f} KiB {per_round * 1000:9.1f} ms/round "
+          f"{per_round / PRODUCTION_INTERVAL * 100:7.2f}% core {frames:8} beats")
+
+async def main():
+    print(f"📊 Heartbeats for {CONNECTIONS} idle connections ({ROUNDS} rounds of {INTERVAL}s)")
+    print(f"  {'scheme':<28} {'memory':>13} {'CPU':>15} {'@5s':>12} {'sent':>14}")
+
+    def per_socket_tasks(clients):
+        tasks = [asyncio.create_task(legacy_keep_alive(client)) for client in clients]
+        return lambda: [task.cancel() for task in tasks]
+
+    def shared_wheel(clients):
+        wheel = HeartbeatWheel(INTERVAL)
+        for client in clients:
+            wheel.add(client)
+        return lambda: wheel.task.cancel()
+
+    await measure("one task per socket", per_socket_tasks)
+    await measure("shared timer wheel", shared_wheel)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiomqtt import Message
+from prometheus_client import generate_latest
+
+from solar_backend import metrics
+from solar_backend import mqtt_handler as mqtt_module
+from solar_backend.config import settings
+
+# === CONFIGURATION ===
+MESSAGES = 50000
+MACHINES = 100
+CALLS = 1000000
+
+class NoopMetric:
+    def inc(self, *args):
+        pass
+
+    def observe(self, *args):
+        pass
+
+class NoopMetrics:
+    MESSAGES_RECEIVED = MESSAGES_PARSED = MESSAGES_DROPPED = MESSAGES_FAILED = NoopMetric()
+    HANDLE_SECONDS = TELEMETRY_FLUSH_SECONDS = TELEMETRY_FLUSH_ROWS = REDIS_FLUSH_SECONDS = NoopMetric()
+
+def per_call(name, fn):
+    start = time.perf_counter()
+    for _ in range(CALLS):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<36} {elapsed / CALLS * 1e9:8.0f} ns/call")
+
+def make_messages():
+    messages = []
+    for i in range(MESSAGES):
+        payload = {
+            "BatteryLevel": round(random.uniform(12.0, 14.8), 2),
+            "WaterLevel": round(random.uniform(40, 90), 1),
+            "BrushRPM": random.randint(1200, 3000),
+            "Speed": round(random.uniform(0.5, 3.5), 1),
+            "Mode": "Auto",
+        }
+        topic = f"company/1/machine/SN{i % MACHINES}/telemetry"
+        messages.append(Message(topic, json.dumps(payload).encode(), 0, False, 0, None))
+    return messages
+
+async def run_handler(messages, instrumented):
+    mqtt_module.metrics = metrics if instrumented else NoopMetrics
+    settings.TELEMETRY_SPOOL_DIR = tempfile.mkdtemp()
+    handler = mqtt_module.MQTTHandler("local", 1883)
+    for m in range(MACHINES):
+        handler.machine_index.put(f"SN{m}", m, 1)
+    queue = asyncio.Queue()
+    worker = asyncio.create_task(handler.ingest_worker(queue))
+
+    start = time.perf_counter()
+    for message in messages:
+        queue.put_nowait(message)
+    await queue.join()
+    elapsed = time.perf_counter() - start
+
+    worker.cancel()
+    handler.telemetry_buffer.close()
+    return elapsed
+
+async def main():
+    print(f"📊 Metric primitives ({CALLS} calls each)")
+    per_call("CounterByType.inc", lambda: metrics.MESSAGES_RECEIVED.inc("telemetry"))
+    per_call("FastHistogram.observe", lambda: metrics.HANDLE_SECONDS.observe(0.0012))
+    per_call("time.perf_counter", time.perf_counter)
+
+    messages = make_messages()
+    print(f"\n📊 handle_message end to end ({MESSAGES} telemetry messages, best of 3)")
+    results = {}
+    for instrumented in (False, True, False, True, False, True):
+        elapsed = await run_handler(messages, instrumented)
+        results[instrumented] = min(elapsed, results.get(instrumented, elapsed))
+    base, inst = results[False], results[True]
+    print(f"  {'without metrics':<36} {base / MESSAGES * 1e6:8.2f} µs/msg")
+    print(f"  {'with metrics':<36} {inst / MESSAGES * 1e6:8.2f} µs/msg")
+    print(f"  {'overhead':<36} {(inst - base) / MESSAGES * 1e6:8.2f} µs/msg ({(inst - base) / base * 100:+.1f}%)")
+    mqtt_module.metrics = metrics
+
+    start = time.perf_counter()
+    for _ in range(100):
+        generate_latest()
+    print(f"\n📊 /metrics scrape: {(time.perf_counter() - start) * 10:.2f} ms")
+
+if __name__ == "__main__":
+    asyncio.run(main())
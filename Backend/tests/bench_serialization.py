@@ -0,0 +1,58 @@
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from solar_backend import serialization
+
+# === CONFIGURATION ===
+MESSAGES = 100000
+
+def make_payload():
+    # Same shape as tests/simulate_machine.py telemetry
+    return json.dumps({
+        "BatteryLevel": round(random.uniform(12.0, 14.8), 2),
+        "BatteryVoltage": round(random.uniform(18.0, 24.0), 2),
+        "WaterLevel": round(random.uniform(40, 90), 1),
+        "BrushRPM": random.randint(1200, 3000),
+        "BrushTemp": round(random.uniform(20, 50), 1),
+        "Speed": round(random.uniform(0.5, 3.5), 1),
+        "AreaToday": round(random.uniform(10, 500), 0),
+        "TotalCycles": random.randint(50, 5000),
+        "Mode": random.choice(["Auto", "Manual", "Spot", "Edge"]),
+    }).encode()
+
+def old_path(raw):
+    # Decode, then one json.dumps per fan-out (machine + company)
+    payload = json.loads(raw.decode())
+    update_msg = {"type": "telemetry", "machine_id": 1, "data": payload}
+    json.dumps(update_msg)
+    json.dumps(update_msg)
+
+def stdlib_single_encode(raw):
+    payload = json.loads(raw)
+    json.dumps({"type": "telemetry", "machine_id": 1, "data": payload}, separators=(",", ":"))
+
+def new_path(raw):
+    payload = serialization.loads(raw)
+    serialization.dumps({"type": "telemetry", "machine_id": 1, "data": payload})
+
+def bench(name, fn, messages):
+    start = time.perf_counter()
+    for raw in messages:
+        fn(raw)
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<34} {elapsed / len(messages) * 1e6:7.2f} µs/msg  {len(messages) / elapsed:10.0f} msg/s")
+
+def main():
+    messages = [make_payload() for _ in range(MESSAGES)]
+    print(f"📊 Decode + encode per MQTT message ({MESSAGES} messages, serializer backend: {serialization.BACKEND})")
+    bench("stdlib, encoded per fan-out (old)", old_path, messages)
+    bench("stdlib, encoded once", stdlib_single_encode, messages)
+    bench(f"{serialization.BACKEND}, encoded once (current)", new_path, messages)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import asyncio
+import random
+import sys
+import time
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from solar_backend.config import settings
+from solar_backend.routes.realtime import ConnectionManager
+from solar_backend.ws_encoding import ENCODINGS
+
+# === CONFIGURATION ===
+SUBSCRIBERS = 1000
+MESSAGES = 200
+MACHINES = 20
+
+class CountingSocket:
+    """Counts the bytes each frame would put on the wire."""
+
+    def __init__(self, subprotocols=()):
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.bytes = 0
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, frame):
+        self.bytes += len(frame.encode())
+
+    async def send_bytes(self, frame):
+        self.bytes += len(frame)
+
+class PerMessageDeflateSocket(CountingSocket):
+    """JSON text compressed by the transport, as permessage-deflate does: once per socket."""
+
+    def __init__(self):
+        super().__init__()
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+
+    async def send_text(self, frame):
+        data = self.compressor.compress(frame.encode()) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.bytes += len(data)
+
+def make_updates():
+    updates = []
+    for i in range(MESSAGES):
+        machine_id = i % MACHINES
+        payload = {
+            "BatteryLevel": round(random.uniform(12.0, 14.8), 2),
+            "BatteryVoltage": round(random.uniform(24.0, 28.0), 2),
+            "SolarVoltage": round(random.uniform(30.0, 42.0), 2),
+            "SolarCurrent": round(random.uniform(0.0, 8.0), 2),
+            "WaterLevel": round(random.uniform(40, 90), 1),
+            "BrushRPM": random.randint(1200, 3000),
+            "Speed": round(random.uniform(0.5, 3.5), 1),
+            "Mode": "Auto",
+            "Direction": "Forward",
+            "TotalCycles": 1042,
+        }
+        updates.append((machine_id, {"type": "telemetry", "machine_id": machine_id, "data": payload}))
+    return updates
+
+async def measure(name, sockets, encoding, updates):
+    manager = ConnectionManager()
+    clients = [await manager.connect(socket, 1, encoding=encoding) for socket in sockets]
+
+    cpu_start = time.process_time()
+    for machine_id, message in updates:
+        manager.broadcast_to_machine(1, message, ("telemetry", machine_id))
+        await asyncio.sleep(0)
+    while any(client.depth for client in clients):
+        await asyncio.sleep(0)
+    cpu = time.process_time() - cpu_start
+
+    for client in clients:
+        manager.disconnect(client, 1)
+    await asyncio.sleep(0)
+
+    frame_bytes = sum(socket.bytes for socket in sockets) / len(sockets) / len(updates)
+    print(f"  {name:<32} {frame_bytes:8.0f} B/frame {cpu / len(updates) * 1000:9.2f} ms/msg "
+          f"{frame_bytes * len(sockets) / 1024:9.0f} KiB/msg")
+
+async def main():
+    settings.WS_MACHINE_MAX_HZ = 0
+    settings.WS_SEND_QUEUE_SIZE = MESSAGES + 10
+    updates = make_updates()
+
+    print(f"📊 Realtime encodings, {SUBSCRIBERS} subscribers x {MESSAGES} telemetry messages")
+    print(f"  {'encoding':<32} {'wire size':>15} {'server CPU':>16} {'egress':>13}")
+    for encoding in ENCODINGS:
+        await measure(encoding, [CountingSocket() for _ in range(SUBSCRIBERS)], encoding, updates)
+    await measure("json + permessage-deflate", [PerMessageDeflateSocket() for _ in range(SUBSCRIBERS)], "json", updates)
+
+if __name__ == "__main__":
+    asyncio.run(main())
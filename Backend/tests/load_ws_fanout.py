@@ -0,0 +1,299 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+import urllib.request
+from array import array
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# === CONFIGURATION ===
+CLIENTS = 2000
+CLIENT_PROCESSES = 2  # receivers are spread over processes so they do not bottleneck on one core
+ENDPOINT = "machine"  # "machine": /realtime/{machine_id}, "company": /realtime/company/{COMPANY_ID}
+COMPANY_ID = 1
+MACHINES = 50
+MESSAGES = 2000
+RATE = 200  # messages per second injected into the server
+ENCODING = "json"
+PORT = 8765
+CONNECT_BATCH = 200
+DRAIN_TIMEOUT = 10.0
+# Server delivery settings; None keeps the configured production value
+MACHINE_MAX_HZ = None
+COMPANY_MAX_HZ = None
+
+def machine_of(seq):
+    return seq % MACHINES
+
+def make_message(seq):
+    machine_id = machine_of(seq)
+    return {
+        "type": "telemetry",
+        "machine_id": machine_id,
+        "data": {
+            "LoadSeq": seq,
+            "SentAt": time.time(),
+            "BatteryLevel": round(random.uniform(12.0, 14.8), 2),
+            "SolarVoltage": round(random.uniform(30.0, 42.0), 2),
+            "Speed": round(random.uniform(0.5, 3.5), 1),
+            "Mode": "Auto",
+        },
+    }
+
+# --- Server process: the real realtime router, fed through the ingest publish path ---
+
+def serve(start_event, done_event):
+    from contextlib import asynccontextmanager
+
+    import uvicorn
+    from fastapi import FastAPI
+
+    from solar_backend.config import settings
+    from solar_backend.realtime_bus import RealtimeBus
+    from solar_backend.routes import realtime
+    from solar_backend.ws_stream import RealtimeUpdate
+
+    if MACHINE_MAX_HZ is not None:
+        settings.WS_MACHINE_MAX_HZ = MACHINE_MAX_HZ
+    if COMPANY_MAX_HZ is not None:
+        settings.WS_COMPANY_MAX_HZ = COMPANY_MAX_HZ
+
+    async def inject():
+        # Same entry point MQTTHandler.handle_message uses for every message
+        bus = RealtimeBus(None, realtime.manager, enabled=False, interval=0)
+        while not start_event.is_set():
+            await asyncio.sleep(0.05)
+        next_send = time.monotonic()
+        for seq in range(MESSAGES):
+            next_send += 1 / RATE
+            await asyncio.sleep(max(0.0, next_send - time.monotonic()))
+            message = make_message(seq)
+            bus.publish(COMPANY_ID, message["machine_id"], "telemetry", RealtimeUpdate(message))
+        done_event.set()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        injector = asyncio.create_task(inject())
+        yield
+        injector.cancel()
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(realtime.router)
+
+    uvicorn.run(app, host="127.0.0.1", port=PORT, log_level="warning", backlog=4096)
+
+# --- Client processes ---
+
+def endpoint_for(index):
+    if ENDPOINT == "company":
+        return f"ws://127.0.0.1:{PORT}/realtime/company/{COMPANY_ID}?encoding={ENCODING}"
+    return f"ws://127.0.0.1:{PORT}/realtime/{machine_of(index)}?encoding={ENCODING}"
+
+def expected_seqs(index):
+    if ENDPOINT == "company":
+        return set(range(MESSAGES))
+    machine_id = machine_of(index)
+    return {seq for seq in range(MESSAGES) if machine_of(seq) == machine_id}
+
+async def receive(websocket, index, latencies, deadline):
+    from solar_backend.ws_encoding import decode
+
+    expected = expected_seqs(index)
+    last_seq = max(expected, default=-1)
+    seen = set()
+    while len(seen) < len(expected):
+        timeout = deadline[0] - time.monotonic() if deadline[0] else None
+        if timeout is not None and timeout <= 0:
+            break
+        try:
+            frame = await asyncio.wait_for(websocket.recv(), timeout)
+        except Exception:
+            break
+        received_at = time.time()
+        message = decode(frame, ENCODING)
+        if not isinstance(message, dict):
+            continue
+        # Company sockets get one {"type": "batch", "updates": [...]} frame per window
+        updates = message.get("updates", []) if message.get("type") == "batch" else [message]
+        for update in updates:
+            if not isinstance(update, dict) or update.get("type") != "telemetry":
+                continue
+            data = update.get("data")
+            if not isinstance(data, dict) or "LoadSeq" not in data:
+                continue
+            latencies.append((received_at - data["SentAt"]) * 1000)
+            seen.add(data["LoadSeq"])
+        if last_seq in seen:
+            break
+    return len(expected), len(seen)
+
+async def run_clients(indices, ready_queue, done_event, collected_event, result_queue):
+    import websockets
+
+    sockets, failures = [], 0
+    for offset in range(0, len(indices), CONNECT_BATCH):
+        batch = indices[offset:offset + CONNECT_BATCH]
+        results = await asyncio.gather(
+            *(websockets.connect(endpoint_for(index), max_queue=None, ping_interval=None) for index in batch),
+            return_exceptions=True,
+        )
+        for index, result in zip(batch, results):
+            if isinstance(result, Exception):
+                failures += 1
+            else:
+                sockets.append((index, result))
+    ready_queue.put(failures)
+
+    latencies = array("d")
+    deadline = [0.0]
+
+    async def watch_done():
+        while not done_event.is_set():
+            await asyncio.sleep(0.05)
+        deadline[0] = time.monotonic() + DRAIN_TIMEOUT
+
+    watcher = asyncio.create_task(watch_done())
+    counts = await asyncio.gather(*(receive(websocket, index, latencies, deadline) for index, websocket in sockets))
+    watcher.cancel()
+
+    expected = sum(count[0] for count in counts)
+    received = sum(count[1] for count in counts)
+    result_queue.put((failures, expected, received, latencies.tobytes()))
+    # Stay connected until the server's queue stats are read
+    while not collected_event.is_set():
+        await asyncio.sleep(0.05)
+    await asyncio.gather(*(websocket.close() for _, websocket in sockets), return_exceptions=True)
+
+def client_process(indices, ready_queue, done_event, collected_event, result_queue):
+    asyncio.run(run_clients(indices, ready_queue, done_event, collected_event, result_queue))
+
+# --- Server resource sampling (Linux /proc) ---
+
+def proc_sample(pid):
+    """(rss bytes, cpu seconds) of a process, or None where /proc is not available."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm") as f:
+            rss_pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    return rss_pages * os.sysconf("SC_PAGE_SIZE"), (int(fields[11]) + int(fields[12])) / ticks
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(len(values) * fraction))], 2)
+
+def server_stats():
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{PORT}/realtime/stats", timeout=10) as response:
+            stats = json.loads(response.read())
+    except Exception as e:
+        print(f"⚠️ Could not read /realtime/stats: {e}")
+        return {}
+    connections = stats.get("connections", [])
+    return {
+        "evictions": stats.get("evictions", 0),
+        "connections": len(connections),
+        "conflated_frames": sum(connection["conflated_frames"] for connection in connections),
+        "peak_queue_depth": max((connection["peak_depth"] for connection in connections), default=0),
+    }
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) >= 2 else CLIENTS
+    output = Path(sys.argv[2]) if len(sys.argv) >= 3 else Path(f"ws_load_{datetime.now():%Y%m%d-%H%M%S}.json")
+    if len(sys.argv) < 2:
+        print("💡 Tip: Use 'python load_ws_fanout.py <clients> <output.json>' to change the client count.")
+
+    context = multiprocessing.get_context("spawn")
+    start_event, done_event, collected_event = context.Event(), context.Event(), context.Event()
+    ready_queue, result_queue = context.Queue(), context.Queue()
+
+    server = context.Process(target=serve, args=(start_event, done_event), daemon=True)
+    server.start()
+    time.sleep(2)
+    if not server.is_alive():
+        print("❌ Server process failed to start")
+        return
+
+    print(f"📡 Opening {clients} '{ENDPOINT}' sockets from {CLIENT_PROCESSES} processes...")
+    workers = []
+    for worker in range(CLIENT_PROCESSES):
+        indices = list(range(worker, clients, CLIENT_PROCESSES))
+        process = context.Process(target=client_process, args=(indices, ready_queue, done_event, collected_event, result_queue))
+        process.start()
+        workers.append(process)
+    connect_failures = sum(ready_queue.get() for _ in workers)
+    idle = proc_sample(server.pid)
+    print(f"✅ Connected ({connect_failures} failed). Injecting {MESSAGES} messages at {RATE}/s...")
+
+    samples = []
+    started = time.monotonic()
+    start_event.set()
+    while not done_event.is_set():
+        samples.append(proc_sample(server.pid))
+        time.sleep(0.25)
+    injected_for = time.monotonic() - started
+    loaded = proc_sample(server.pid)
+
+    results = [result_queue.get() for _ in workers]
+    stats = server_stats()
+    collected_event.set()
+    for process in workers:
+        process.join()
+    server.terminate()
+    server.join()
+
+    latencies = array("d")
+    for _, _, _, raw in results:
+        latencies.frombytes(raw)
+    latencies = sorted(latencies)
+    expected = sum(result[1] for result in results)
+    received = sum(result[2] for result in results)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "clients": clients, "client_processes": CLIENT_PROCESSES, "endpoint": ENDPOINT,
+            "machines": MACHINES, "messages": MESSAGES, "rate": RATE, "encoding": ENCODING,
+            "machine_max_hz": MACHINE_MAX_HZ, "company_max_hz": COMPANY_MAX_HZ,
+        },
+        "connect_failures": connect_failures,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": round(latencies[-1], 2) if latencies else None,
+        },
+        "frames": {
+            "expected": expected,
+            "received": received,
+            # Updates never seen by a client: merged by the rate limit, conflated or lost
+            "dropped": expected - received,
+        },
+        "server": {
+            "rss_mib_idle": round(idle[0] / 2**20, 1) if idle else None,
+            "rss_mib_peak": round(max(sample[0] for sample in samples if sample) / 2**20, 1)
+            if any(samples) else None,
+            "cpu_percent": round((loaded[1] - idle[1]) / injected_for * 100, 1) if idle and loaded else None,
+            **stats,
+        },
+    }
+    output.write_text(json.dumps(report, indent=2))
+
+    print(f"📊 Latency p50 {report['latency_ms']['p50']} ms, p95 {report['latency_ms']['p95']} ms, "
+          f"p99 {report['latency_ms']['p99']} ms")
+    print(f"📊 Updates {received}/{expected} ({expected - received} dropped), "
+          f"server RSS {report['server']['rss_mib_peak']} MiB, CPU {report['server']['cpu_percent']}%")
+    print(f"💾 Report written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import asyncio
+import json
+import sys
+import tempfile
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from aiomqtt import Message
+
+from solar_backend import mqtt_handler as mqtt_module
+from solar_backend.config import settings
+from solar_backend.routes.realtime import ConnectionManager
+
+# === CONFIGURATION ===
+WORKERS = 4
+MACHINES = 10
+MESSAGES = 400
+SHARED_GROUP = "solar_ingest"
+
+def topic_matches(topic_filter, topic):
+    filter_parts = topic_filter.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(filter_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts) or (part != '+' and part != topic_parts[i]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+class LocalBroker:
+    """In-process MQTT broker stand-in with EMQX-style $share/<group>/ round robin."""
+
+    def __init__(self):
+        self.subscriptions = []  # (group or None, topic filter, client)
+        self.rounds = Counter()
+
+    def subscribe(self, client, topic_filter):
+        group = None
+        if topic_filter.startswith("$share/"):
+            _, group, topic_filter = topic_filter.split('/', 2)
+        self.subscriptions.append((group, topic_filter, client))
+
+    def publish(self, topic, payload):
+        groups = {}
+        for group, topic_filter, client in self.subscriptions:
+            if not topic_matches(topic_filter, topic):
+                continue
+            if group is None:
+                client.deliver(topic, payload)
+            else:
+                groups.setdefault((group, topic_filter), []).append(client)
+        for key, members in groups.items():
+            members[self.rounds[key] % len(members)].deliver(topic, payload)
+            self.rounds[key] += 1
+
+class LocalClient:
+    """Stands in for aiomqtt.Client, connected to a LocalBroker."""
+
+    def __init__(self, broker, **kwargs):
+        self.broker = broker
+        self.queue = asyncio.Queue()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def subscribe(self, topic_filter):
+        self.broker.subscribe(self, topic_filter)
+
+    def deliver(self, topic, payload):
+        self.queue.put_nowait(Message(topic, payload, 0, False, 0, None))
+
+    @property
+    async def messages(self):
+        while True:
+            yield await self.queue.get()
+
+class LocalPubSubHub:
+    """In-process stand-in for Redis PUBLISH/SUBSCRIBE."""
+
+    def __init__(self):
+        self.subscribers = {}  # channel -> set of FakePubSub
+
+    def publish(self, channel, data):
+        for pubsub in self.subscribers.get(channel, ()):
+            pubsub.queue.put_nowait({"type": "message", "channel": channel, "data": data})
+
+class FakePubSub:
+    def __init__(self, hub):
+        self.hub = hub
+        self.queue = asyncio.Queue()
+
+    async def subscribe(self, *channels):
+        for channel in channels:
+            self.hub.subscribers.setdefault(channel, set()).add(self)
+
+    async def unsubscribe(self, *channels):
+        for channel in channels:
+            self.hub.subscribers.get(channel, set()).discard(self)
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        await self.unsubscribe(*list(self.hub.subscribers))
+
+class FakePipeline:
+    def __init__(self, hub=None):
+        self.hub = hub
+        self.published = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def hset(self, key, mapping):
+        pass
+
+    def publish(self, channel, data):
+        self.published.append((channel, data))
+
+    async def execute(self):
+        for channel, data in self.published:
+            self.hub.publish(channel, data)
+        return []
+
+class FakeRedis:
+    def __init__(self, hub=None):
+        self.hub = hub
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self.hub)
+
+    def pubsub(self):
+        return FakePubSub(self.hub)
+
+class FakeWebSocket:
+    def __init__(self):
+        self.frames = []
+        self.scope = {"subprotocols": []}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, frame):
+        self.frames.append(json.loads(frame))
+
+    async def close(self, code=1000):
+        pass
+
+async def run_ingest(workers, shared_group):
+    """Runs N handlers against one broker.
+
+    Returns the persisted sequence numbers and, per worker, the sequence numbers
+    received by a company WebSocket connected to that worker.
+    """
+    broker = LocalBroker()
+    hub = LocalPubSubHub()
+    persisted = []
+    sockets = []
+
+    async def record_rows(engine, rows):
+        persisted.extend(row["AdditionalData"]["seq"] for row in rows)
+        return len(rows)
+
+    original = (mqtt_module.Client, mqtt_module.write_telemetry, settings.TELEMETRY_SPOOL_DIR,
+                settings.WS_COMPANY_MAX_HZ, settings.WS_COMPANY_BATCH_WINDOW, settings.WS_SEND_QUEUE_SIZE)
+    spool_dir = tempfile.TemporaryDirectory()
+    mqtt_module.Client = lambda **kwargs: LocalClient(broker, **kwargs)
+    mqtt_module.write_telemetry = record_rows
+    settings.TELEMETRY_SPOOL_DIR = spool_dir.name
+    # Every frame must arrive, not a merged or conflated snapshot
+    settings.WS_COMPANY_MAX_HZ = 0
+    settings.WS_COMPANY_BATCH_WINDOW = 0
+    settings.WS_SEND_QUEUE_SIZE = MESSAGES * WORKERS
+
+    handlers, tasks = [], []
+    try:
+        for _ in range(workers):
+            handler = mqtt_module.MQTTHandler("local", 1883, shared_group=shared_group)
+            handler.machine_index.listen = lambda: asyncio.Event().wait()
+            for m in range(MACHINES):
+                handler.machine_index.put(f"SN{m}", m, 1)
+            handler.state_writer.redis_client = FakeRedis()
+            handler.flush_interval = 0.05
+
+            # Each worker process has its own ConnectionManager
+            local_manager = ConnectionManager()
+            local_manager.bus = handler.realtime_bus
+            handler.realtime_bus.manager = local_manager
+            handler.realtime_bus.redis_client = FakeRedis(hub)
+            socket = FakeWebSocket()
+            await local_manager.connect_company(socket, 1)
+            sockets.append(socket)
+
+            handlers.append(handler)
+            tasks.append(asyncio.create_task(handler.start()))
+
+        while len(broker.subscriptions) < workers * 2:
+            await asyncio.sleep(0.01)
+        if shared_group:
+            while sum(len(subscribers) for subscribers in hub.subscribers.values()) < workers:
+                await asyncio.sleep(0.01)
+
+        for seq in range(MESSAGES):
+            topic = f"company/1/machine/SN{seq % MACHINES}/telemetry"
+            broker.publish(topic, json.dumps({"battery": 13.2, "extra": {"seq": seq}}).encode())
+
+        expected = MESSAGES * (1 if shared_group else workers)
+        for _ in range(200):
+            if len(persisted) >= expected and all(len(socket.frames) >= MESSAGES for socket in sockets):
+                break
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.2)  # catch late duplicates
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        (mqtt_module.Client, mqtt_module.write_telemetry, settings.TELEMETRY_SPOOL_DIR,
+         settings.WS_COMPANY_MAX_HZ, settings.WS_COMPANY_BATCH_WINDOW, settings.WS_SEND_QUEUE_SIZE) = original
+        spool_dir.cleanup()
+
+    received = [[frame["data"]["extra"]["seq"] for frame in socket.frames if frame["type"] == "telemetry"]
+                for socket in sockets]
+    return persisted, received
+
+def test_shared_subscription_persists_each_message_once():
+    persisted, _ = asyncio.run(run_ingest(WORKERS, SHARED_GROUP))
+    counts = Counter(persisted)
+    assert sorted(counts) == list(range(MESSAGES))
+    assert set(counts.values()) == {1}
+
+def test_shared_subscription_fans_out_to_every_worker():
+    _, received = asyncio.run(run_ingest(WORKERS, SHARED_GROUP))
+    for seqs in received:
+        assert sorted(seqs) == list(range(MESSAGES))
+
+def test_plain_subscription_duplicates_across_workers():
+    persisted, received = asyncio.run(run_ingest(WORKERS, None))
+    assert set(Counter(persisted).values()) == {WORKERS}
+    for seqs in received:
+        assert sorted(seqs) == list(range(MESSAGES))
+
+if __name__ == "__main__":
+    test_shared_subscription_persists_each_message_once()
+    print(f"✅ {MESSAGES} messages persisted exactly once across {WORKERS} workers")
+    test_shared_subscription_fans_out_to_every_worker()
+    print(f"✅ Company sockets on all {WORKERS} workers received every message")
+    test_plain_subscription_duplicates_across_workers()
+    print(f"⚠️ Without a shared group every message is persisted {WORKERS} times")
@@ -0,0 +1,141 @@
+import asyncio
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from solar_backend import telemetry_history as history
+
+# === CONFIGURATION ===
+MACHINE = 7
+HOUR = 3600
+
+def at(hour, minute=0):
+    return datetime(2024, 5, 1, hour, minute)
+
+class FakeQueries:
+    """Replaces the MySQL reads of telemetry_history and records which source served which range."""
+
+    def __init__(self, monkeypatch, first_rollup=None):
+        self.calls = []
+        self.first_rollup = first_rollup
+        monkeypatch.setattr(history, "query_buckets", self.query_buckets)
+        monkeypatch.setattr(history, "query_rollup", self.query_rollup)
+        monkeypatch.setattr(history, "rollup_coverage", self.rollup_coverage)
+
+    async def query_buckets(self, db, machine_id, start, end, bucket, columns):
+        self.calls.append(("raw", start, end))
+        return []
+
+    async def query_rollup(self, db, table, machine_id, start, end, bucket, columns):
+        self.calls.append((table, start, end))
+        return []
+
+    async def rollup_coverage(self, db, table, machine_id):
+        return self.first_rollup
+
+def run(start, end, bucket, **kwargs):
+    return asyncio.run(history.query_history(None, MACHINE, start, end, bucket, **kwargs))
+
+def test_bucket_without_rollup_level_reads_raw_rows(monkeypatch):
+    fake = FakeQueries(monkeypatch, first_rollup=at(0))
+    run(at(8), at(14), 90)
+    assert fake.calls == [("raw", at(8), at(14))]
+
+def test_machine_without_rollups_reads_raw_rows(monkeypatch):
+    fake = FakeQueries(monkeypatch, first_rollup=None)
+    run(at(8), at(14), HOUR)
+    assert fake.calls == [("raw", at(8), at(14))]
+
+def test_range_before_first_complete_rollup_bucket_reads_raw_rows(monkeypatch):
+    # The first 1h bucket (10:00) may be partial, so rollups serve from 11:00
+    fake = FakeQueries(monkeypatch, first_rollup=at(10))
+    run(at(8), at(14), HOUR)
+    assert fake.calls == [("raw", at(8), at(11)), ("TelemetryRollup1h", at(11), at(14))]
+
+def test_split_falls_on_a_query_bucket_edge(monkeypatch):
+    fake = FakeQueries(monkeypatch, first_rollup=at(10, 30))
+    run(at(8), at(14), 2 * HOUR)
+    assert fake.calls == [("raw", at(8), at(12)), ("TelemetryRollup1h", at(12), at(14))]
+
+def test_range_inside_rollups_reads_only_the_coarsest_rollup(monkeypatch):
+    fake = FakeQueries(monkeypatch, first_rollup=at(0))
+    run(at(12, 30), at(14), 5 * 60)
+    # 5 minutes is tiled by 1m buckets only; start is aligned to the rollup step
+    assert fake.calls == [("TelemetryRollup1m", at(12, 30), at(14))]
+    run(datetime(2024, 5, 2), datetime(2024, 5, 4), 86400)
+    assert fake.calls[-1] == ("TelemetryRollup1d", datetime(2024, 5, 2), datetime(2024, 5, 4))
+    assert len(fake.calls) == 2
+
+def test_range_ending_before_rollups_reads_only_raw_rows(monkeypatch):
+    fake = FakeQueries(monkeypatch, first_rollup=at(20))
+    run(at(8), at(14), HOUR)
+    assert fake.calls == [("raw", at(8), at(14))]
+
+class FakeArchive:
+    """Stands in for TelemetryArchive; returns the given buckets and records the ranges asked for."""
+
+    def __init__(self, buckets=()):
+        self.calls = []
+        self.buckets = list(buckets)
+
+    def query_buckets(self, machine_id, start, end, bucket, columns):
+        self.calls.append((start, end))
+        return self.buckets
+
+def bucket(timestamp, count, avg, low, high, last):
+    return {"Timestamp": timestamp, "Count": count,
+            "Values": {"BatteryLevel": {"avg": avg, "min": low, "max": high, "last": last}}}
+
+def test_archived_days_are_read_from_the_archive(monkeypatch):
+    fake = FakeQueries(monkeypatch, first_rollup=at(10))
+    archive = FakeArchive()
+    run(at(8), at(14), HOUR, archive=archive, archive_until=at(9))
+    assert archive.calls == [(at(8), at(9))]
+    assert fake.calls == [("raw", at(9), at(11)), ("TelemetryRollup1h", at(11), at(14))]
+
+def test_raw_range_entirely_archived_skips_mysql(monkeypatch):
+    fake = FakeQueries(monkeypatch, first_rollup=None)
+    archive = FakeArchive()
+    run(at(8), at(14), HOUR, archive=archive, archive_until=at(20))
+    assert archive.calls == [(at(8), at(14))]
+    assert fake.calls == []
+
+def test_range_after_archive_boundary_skips_the_archive(monkeypatch):
+    fake = FakeQueries(monkeypatch, first_rollup=None)
+    archive = FakeArchive()
+    run(at(8), at(14), HOUR, archive=archive, archive_until=at(6))
+    assert archive.calls == []
+    assert fake.calls == [("raw", at(8), at(14))]
+
+def test_bucket_cut_by_the_archive_boundary_is_merged(monkeypatch):
+    FakeQueries(monkeypatch)
+    hot = [bucket(at(10), 6, 20.0, 15.0, 25.0, 18.0), bucket(at(11), 1, 5.0, 5.0, 5.0, 5.0)]
+
+    async def query_buckets(db, machine_id, start, end, size, columns):
+        return hot
+    monkeypatch.setattr(history, "query_buckets", query_buckets)
+
+    archive = FakeArchive([bucket(at(9), 1, 1.0, 1.0, 1.0, 1.0), bucket(at(10), 2, 10.0, 8.0, 12.0, 12.0)])
+    merged = run(at(9), at(12), HOUR, archive=archive, archive_until=at(10, 30))
+    assert [b["Timestamp"] for b in merged] == [at(9), at(10), at(11)]
+    assert merged[1] == bucket(at(10), 8, 17.5, 8.0, 25.0, 18.0)
+
+def test_merge_edge_weights_averages_and_keeps_the_latest_last():
+    early = bucket(at(10), 2, 10.0, 8.0, 12.0, 12.0)
+    late = bucket(at(10), 6, 20.0, 15.0, 25.0, None)
+    merged = history._merge_edge([early], [late])
+    assert merged == [bucket(at(10), 8, 17.5, 8.0, 25.0, 12.0)]
+
+def test_merge_edge_ignores_halves_without_values():
+    early = bucket(at(10), 3, None, None, None, None)
+    late = bucket(at(10), 1, 4.0, 4.0, 4.0, 4.0)
+    assert history._merge_edge([early], [late]) == [bucket(at(10), 4, 4.0, 4.0, 4.0, 4.0)]
+
+def test_merge_edge_concatenates_disjoint_lists():
+    before, after = [bucket(at(9), 1, 1.0, 1.0, 1.0, 1.0)], [bucket(at(10), 1, 2.0, 2.0, 2.0, 2.0)]
+    assert history._merge_edge(before, after) == before + after
+    assert history._merge_edge([], after) == after
@@ -0,0 +1,58 @@
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from solar_backend.telemetry_rollup import coarsen, rollup_batch
+
+# === CONFIGURATION ===
+MINUTE = 60
+HOUR = 3600
+
+def row(machine_id, minute, second, **values):
+    return {"MachineID": machine_id, "Timestamp": datetime(2024, 5, 1, 10, minute, second), **values}
+
+def by_key(buckets):
+    return {(bucket["MachineID"], bucket["BucketStart"]): bucket for bucket in buckets}
+
+ROWS = [
+    row(1, 0, 10, BatteryLevel=80.0, Speed=1.0),
+    row(1, 0, 50, BatteryLevel=78.0),  # Speed not reported
+    row(1, 0, 30, BatteryLevel=90.0, Speed=3.0),  # arrives late: not the last value
+    row(1, 1, 5, BatteryLevel=77.0),
+    row(2, 0, 20, BatteryLevel=50.0, Speed=2.0),
+]
+
+def test_rollup_batch_aggregates_per_machine_and_minute():
+    buckets = by_key(rollup_batch(ROWS, MINUTE))
+    assert set(buckets) == {(1, datetime(2024, 5, 1, 10, 0)), (1, datetime(2024, 5, 1, 10, 1)),
+                            (2, datetime(2024, 5, 1, 10, 0))}
+
+    first = buckets[(1, datetime(2024, 5, 1, 10, 0))]
+    assert first["Count"] == 3
+    assert first["LastAt"] == datetime(2024, 5, 1, 10, 0, 50)
+    assert (first["BatteryLevelCount"], first["BatteryLevelSum"]) == (3, 248.0)
+    assert (first["BatteryLevelMin"], first["BatteryLevelMax"], first["BatteryLevelLast"]) == (78.0, 90.0, 78.0)
+    # Last is the newest reported value, not the newest row or the last to arrive
+    assert (first["SpeedCount"], first["SpeedSum"], first["SpeedLast"]) == (2, 4.0, 3.0)
+    assert (first["WaterLevelCount"], first["WaterLevelMin"], first["WaterLevelLast"]) == (0, None, None)
+
+def test_rows_without_timestamp_are_skipped():
+    assert rollup_batch([{"MachineID": 1, "Timestamp": None, "BatteryLevel": 1.0}], MINUTE) == []
+
+def test_coarsen_merges_minutes_into_hours():
+    hours = by_key(coarsen(rollup_batch(ROWS, MINUTE), HOUR))
+    hour = hours[(1, datetime(2024, 5, 1, 10, 0))]
+    assert hour["Count"] == 4
+    assert hour["LastAt"] == datetime(2024, 5, 1, 10, 1, 5)
+    assert (hour["BatteryLevelCount"], hour["BatteryLevelSum"]) == (4, 325.0)
+    assert (hour["BatteryLevelMin"], hour["BatteryLevelMax"], hour["BatteryLevelLast"]) == (77.0, 90.0, 77.0)
+    # The latest minute has no Speed, so the hour keeps the earlier minute's last value
+    assert (hour["SpeedCount"], hour["SpeedLast"]) == (2, 3.0)
+
+def test_coarsen_matches_a_direct_rollup():
+    direct = by_key(rollup_batch(ROWS, HOUR))
+    # Input order of the fine buckets does not matter
+    coarse = by_key(coarsen(list(reversed(rollup_batch(ROWS, MINUTE))), HOUR))
+    assert coarse == direct
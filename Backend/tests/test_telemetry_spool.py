@@ -0,0 +1,147 @@
+import asyncio
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy.exc import DataError, OperationalError
+
+from solar_backend.telemetry_spool import TelemetrySpool, QUARANTINE_DIR, _read_segment
+from solar_backend.telemetry_writer import REJECTED_ERRORS
+
+# === CONFIGURATION ===
+SEGMENT_BYTES = 1 << 20
+MAX_MEMORY_ROWS = 1000
+
+def make_row(seq, battery=12.5):
+    return {"MachineID": 1, "BatteryLevel": battery, "AdditionalData": {"seq": seq},
+            "Timestamp": datetime(2024, 1, 1, 0, 0, seq % 60)}
+
+def crash(spool):
+    """Drops a spool the way a killed process would: no seal, no fsync, lock released."""
+    if spool._file is not None:
+        spool._file.close()
+    for f in spool._unsynced:
+        f.close()
+    spool._lock.close()
+
+class RecordingWriter:
+    """Stands in for write_telemetry; rows with a negative battery are rejected like MySQL would."""
+
+    def __init__(self, error=None):
+        self.rows = []
+        self.calls = 0
+        self.error = error
+
+    async def __call__(self, rows):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        if any(row["BatteryLevel"] < 0 for row in rows):
+            raise DataError("INSERT", {}, Exception("Out of range value for column 'BatteryLevel'"))
+        self.rows.extend(rows)
+        return len(rows)
+
+def segments(spool):
+    return sorted(spool.directory.glob("telemetry-*.log"))
+
+def test_unsealed_rows_are_replayed_after_a_crash():
+    with tempfile.TemporaryDirectory() as root:
+        spool = TelemetrySpool(root, SEGMENT_BYTES, MAX_MEMORY_ROWS)
+        for seq in range(10):
+            spool.append(make_row(seq))
+        crash(spool)
+
+        replayed = TelemetrySpool(root, SEGMENT_BYTES, MAX_MEMORY_ROWS)
+        assert replayed.directory == spool.directory
+        assert len(replayed.pending) == 1
+        assert replayed.pending[0].rows is None  # read back from disk
+
+        writer = RecordingWriter()
+        assert asyncio.run(replayed.drain(writer)) == 10
+        assert [row["AdditionalData"]["seq"] for row in writer.rows] == list(range(10))
+        assert writer.rows[3]["Timestamp"] == datetime(2024, 1, 1, 0, 0, 3)
+        assert segments(replayed) == []
+        replayed.close()
+
+def test_new_segments_sort_after_replayed_ones():
+    with tempfile.TemporaryDirectory() as root:
+        spool = TelemetrySpool(root, SEGMENT_BYTES, MAX_MEMORY_ROWS)
+        spool.append(make_row(0))
+        crash(spool)
+
+        replayed = TelemetrySpool(root, SEGMENT_BYTES, MAX_MEMORY_ROWS)
+        replayed.append(make_row(1))
+        replayed.seal()
+        writer = RecordingWriter()
+        asyncio.run(replayed.drain(writer))
+        assert [row["AdditionalData"]["seq"] for row in writer.rows] == [0, 1]
+        replayed.close()
+
+def test_torn_and_corrupt_lines_are_skipped():
+    with tempfile.TemporaryDirectory() as root:
+        spool = TelemetrySpool(root, SEGMENT_BYTES, MAX_MEMORY_ROWS)
+        spool.append(make_row(0))
+        spool._file.write("{not json}\n")
+        spool.append(make_row(1))
+        spool._file.write('{"MachineID": 1, "Batt')  # torn by the crash
+        crash(spool)
+
+        assert [row["AdditionalData"]["seq"] for row in _read_segment(segments(spool)[0])] == [0, 1]
+
+def test_rejected_rows_are_quarantined_and_the_rest_written():
+    with tempfile.TemporaryDirectory() as root:
+        spool = TelemetrySpool(root, SEGMENT_BYTES, MAX_MEMORY_ROWS)
+        for seq in range(16):
+            spool.append(make_row(seq, battery=-1.0 if seq in (5, 11) else 12.5))
+        spool.seal()
+        name = spool.pending[0].path.name
+
+        writer = RecordingWriter()
+        assert asyncio.run(spool.drain(writer, REJECTED_ERRORS)) == 14
+        assert [row["AdditionalData"]["seq"] for row in writer.rows] == [s for s in range(16) if s not in (5, 11)]
+        assert spool.pending == []
+        assert segments(spool) == []
+
+        quarantined = _read_segment(spool.directory / QUARANTINE_DIR / name)
+        assert [row["AdditionalData"]["seq"] for row in quarantined] == [5, 11]
+        assert spool.buffered_rows() == 0
+        spool.close()
+
+def test_transient_error_keeps_the_segment_on_disk():
+    with tempfile.TemporaryDirectory() as root:
+        spool = TelemetrySpool(root, SEGMENT_BYTES, MAX_MEMORY_ROWS)
+        for seq in range(4):
+            spool.append(make_row(seq))
+        spool.seal()
+
+        outage = RecordingWriter(OperationalError("INSERT", {}, Exception("server has gone away")))
+        with pytest.raises(OperationalError):
+            asyncio.run(spool.drain(outage, REJECTED_ERRORS))
+        assert outage.calls == 1  # not bisected
+        assert len(spool.pending) == 1
+        assert spool.pending[0].rows is None  # memory released during the outage
+        assert spool.buffered_rows() == 0
+        assert not (spool.directory / QUARANTINE_DIR).exists()
+
+        writer = RecordingWriter()
+        assert asyncio.run(spool.drain(writer, REJECTED_ERRORS)) == 4
+        assert segments(spool) == []
+        spool.close()
+
+def test_memory_cap_falls_back_to_disk():
+    with tempfile.TemporaryDirectory() as root:
+        spool = TelemetrySpool(root, SEGMENT_BYTES, max_memory_rows=3)
+        for seq in range(5):
+            spool.append(make_row(seq))
+        spool.seal()
+        assert spool.buffered_rows() == 0
+        assert spool.pending[0].rows is None
+
+        writer = RecordingWriter()
+        assert asyncio.run(spool.drain(writer)) == 5
+        spool.close()
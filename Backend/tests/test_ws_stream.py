@@ -0,0 +1,105 @@
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from solar_backend.ws_stream import BatchFrame, RealtimeUpdate, UpdateStream, merge_messages
+from solar_backend.ws_encoding import JSON
+
+# === CONFIGURATION ===
+KEY = ("telemetry", 7)
+NEVER = 1e9  # keyframe interval that never comes due after the first frame
+
+class FakeClient:
+    """Stands in for WebSocketClient; records the decoded frames it is given."""
+
+    def __init__(self):
+        self.frames = []
+
+    def enqueue(self, frame, key):
+        self.frames.append(json.loads(frame.to_frame() if isinstance(frame, BatchFrame) else frame))
+        return True
+
+def delta_stream(keyframe_interval=NEVER, **kwargs):
+    stream = UpdateStream(0, on_dead=lambda client: None, delta=True,
+                          keyframe_interval=keyframe_interval, **kwargs)
+    client = FakeClient()
+    stream.clients.append(client)
+    return stream, client
+
+def telemetry(**data):
+    return RealtimeUpdate({"type": "telemetry", "machine_id": 7, "data": data})
+
+def test_first_frame_is_a_full_keyframe():
+    stream, client = delta_stream()
+    stream.push(KEY, telemetry(BatteryLevel=80.0, Speed=1.5))
+    assert client.frames == [{"type": "telemetry", "machine_id": 7, "seq": 1, "keyframe": True,
+                              "data": {"BatteryLevel": 80.0, "Speed": 1.5}}]
+
+def test_only_changed_fields_are_sent_and_seq_counts_frames():
+    stream, client = delta_stream()
+    stream.push(KEY, telemetry(BatteryLevel=80.0, Speed=1.5))
+    stream.push(KEY, telemetry(BatteryLevel=79.5, Speed=1.5))
+    stream.push(KEY, telemetry(BatteryLevel=79.5, Speed=1.5))  # nothing changed: no frame
+    stream.push(KEY, telemetry(Mode="auto"))
+
+    assert [frame["seq"] for frame in client.frames] == [1, 2, 3]
+    assert [frame["data"] for frame in client.frames[1:]] == [{"BatteryLevel": 79.5}, {"Mode": "auto"}]
+    assert [frame["keyframe"] for frame in client.frames] == [True, False, False]
+
+def test_seq_is_per_key():
+    stream, client = delta_stream()
+    stream.push(("telemetry", 7), telemetry(Speed=1.0))
+    stream.push(("telemetry", 8), RealtimeUpdate({"type": "telemetry", "machine_id": 8, "data": {"Speed": 1.0}}))
+    stream.push(("telemetry", 7), telemetry(Speed=2.0))
+    assert [(frame["machine_id"], frame["seq"]) for frame in client.frames] == [(7, 1), (8, 1), (7, 2)]
+
+def test_keyframe_is_sent_when_due():
+    stream, client = delta_stream(keyframe_interval=0)
+    stream.push(KEY, telemetry(BatteryLevel=80.0, Speed=1.5))
+    stream.push(KEY, telemetry(Speed=2.0))
+    assert client.frames[1]["keyframe"] is True
+    assert client.frames[1]["data"] == {"BatteryLevel": 80.0, "Speed": 2.0}
+    assert client.frames[1]["seq"] == 2
+
+def test_keyframe_data_is_a_copy_of_the_sent_state():
+    stream, _ = delta_stream(keyframe_interval=0)
+    message = stream._delta_message(KEY, {"type": "telemetry", "data": {"Speed": 1.0}})
+    stream._delta_message(KEY, {"type": "telemetry", "data": {"Speed": 2.0}})
+    # An unencoded keyframe (e.g. inside a batch) must not pick up newer values
+    assert message["data"] == {"Speed": 1.0}
+
+def test_resync_sends_full_state_without_advancing_seq():
+    stream, _ = delta_stream()
+    stream.push(KEY, telemetry(BatteryLevel=80.0, Speed=1.5))
+    stream.push(KEY, telemetry(Speed=2.0))
+
+    late = FakeClient()
+    stream.resync(late)
+    assert late.frames == [{"type": "telemetry", "machine_id": 7, "seq": 2, "keyframe": True,
+                            "data": {"BatteryLevel": 80.0, "Speed": 2.0}}]
+
+    stream.push(KEY, telemetry(Speed=2.5))
+    assert stream.sent_state[KEY].seq == 3
+
+def test_field_subset_drops_updates_without_those_fields():
+    stream, client = delta_stream(fields=frozenset({"BatteryLevel"}))
+    stream.push(KEY, telemetry(Speed=1.5))
+    stream.push(KEY, telemetry(BatteryLevel=80.0, Speed=2.0))
+    assert [frame["data"] for frame in client.frames] == [{"BatteryLevel": 80.0}]
+    assert client.frames[0]["seq"] == 1
+
+def test_batch_frames_merge_per_machine():
+    older = BatchFrame({7: {"type": "telemetry", "machine_id": 7, "data": {"Speed": 1.0, "Mode": "auto"}},
+                        8: {"type": "telemetry", "machine_id": 8, "data": {"Speed": 3.0}}}, JSON)
+    newer = BatchFrame({7: {"type": "telemetry", "machine_id": 7, "data": {"Speed": 2.0}}}, JSON)
+    merged = json.loads(older.merge(newer).to_frame())
+    assert merged == {"type": "batch", "updates": [
+        {"type": "telemetry", "machine_id": 7, "data": {"Speed": 2.0, "Mode": "auto"}},
+        {"type": "telemetry", "machine_id": 8, "data": {"Speed": 3.0}},
+    ]}
+
+def test_merge_without_data_dicts_keeps_the_newer_message():
+    newer = {"type": "status", "machine_id": 7, "data": "offline"}
+    assert merge_messages({"type": "status", "machine_id": 7, "data": {"Status": "online"}}, newer) is newer
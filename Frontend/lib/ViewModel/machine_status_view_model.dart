@@ -58,8 +58,8 @@ class MachineStatusViewModel extends ChangeNotifier {
       channel.stream.listen(
         (message) {
           _reconnectDelay = 1;
-          final data = json.decode(message);
-          _handleRealtimeUpdate(machineId, data);
+          final Map<String, dynamic> frame = json.decode(message);
+          _handleFrame(frame, machineId: machineId);
         },
         onError: (error) {
           debugPrint('WS Error for machine $machineId: $error');
@@ -103,14 +103,8 @@ class MachineStatusViewModel extends ChangeNotifier {
         (message) {
           _isConnecting = false;
           _reconnectDelay = 1; // Reset backoff on successful message
-          final Map<String, dynamic> update = json.decode(message);
-
-          if (update['type'] == 'heartbeat') return;
-
-          final machineId = update['machine_id'];
-          if (machineId != null) {
-            _handleRealtimeUpdate(machineId, update);
-          }
+          final Map<String, dynamic> frame = json.decode(message);
+          _handleFrame(frame);
         },
         onError: (error) {
           _isConnecting = false;
@@ -157,6 +151,36 @@ class MachineStatusViewModel extends ChangeNotifier {
     _channels.remove(machineId);
   }
 
+  /// Routes one decoded frame. Batch frames (company sockets) and snapshot
+  /// frames (sent on connect) carry updates for several machines.
+  void _handleFrame(Map<String, dynamic> frame, {int? machineId}) {
+    switch (frame['type']) {
+      case 'heartbeat':
+        return;
+      case 'batch':
+        for (final update in (frame['updates'] as List? ?? const [])) {
+          if (update is Map<String, dynamic>) {
+            _handleFrame(update, machineId: machineId);
+          }
+        }
+        return;
+      case 'snapshot':
+        for (final machine in (frame['machines'] as List? ?? const [])) {
+          if (machine is Map<String, dynamic> && machine['machine_id'] is int) {
+            _handleRealtimeUpdate(machine['machine_id'] as int, {
+              'type': 'telemetry',
+              'data': machine['data'] ?? <String, dynamic>{},
+            });
+          }
+        }
+        return;
+    }
+    final id = frame['machine_id'] ?? machineId;
+    if (id is int) {
+      _handleRealtimeUpdate(id, frame);
+    }
+  }
+
   void _handleRealtimeUpdate(int machineId, Map<String, dynamic> update) {
     try {
       final String type = update['type'] ?? '';